@@ -0,0 +1,126 @@
+"""Benchmarks for templar/api/build.py.
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/build_benchmark.py
+
+Builds a site of Markdown pages serially and with increasing numbers of worker processes, and
+prints the speedup of each parallel build over the serial one. Then watches the site, edits one
+page at a time, and prints the time from the edit until the page is published again.
+"""
+
+from templar.api.build import Page
+from templar.api.build import Watcher
+from templar.api.build import build
+from templar.api.config import ConfigBuilder
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+PAGE_SECTION = """
+Section {0}
+-----------
+
+Some *emphasized* text, some **strong** text and a [link](http://example.com/{0}).
+
+* First item of list {0}
+* Second item, with `code`
+    1. A nested item
+    2. Another nested item
+
+> A quotation that spans
+> two lines.
+
+    def section_{0}():
+        return {0}
+"""
+
+def make_site(directory, num_pages, sections_per_page):
+    """Writes num_pages Markdown pages and a template into directory. Returns the Pages to build."""
+    with open(os.path.join(directory, 'page.html'), 'w') as f:
+        f.write('<html><body>{{ blocks.all }}</body></html>')
+    pages = []
+    for page_id in range(num_pages):
+        source = os.path.join(directory, 'page{}.md'.format(page_id))
+        with open(source, 'w') as f:
+            f.write(''.join(PAGE_SECTION.format(i) for i in range(sections_per_page)))
+        destination = os.path.join(directory, 'site', 'page{}.html'.format(page_id))
+        pages.append(Page(source, 'page.html', destination))
+    return pages
+
+
+def bench_build(num_pages, sections_per_page, worker_counts):
+    print('build: {} pages of {} sections'.format(num_pages, sections_per_page))
+    directory = tempfile.mkdtemp()
+    try:
+        pages = make_site(directory, num_pages, sections_per_page)
+        config = ConfigBuilder() \
+                .add_template_dirs(directory) \
+                .append_compiler_rules(MarkdownToHtmlRule()) \
+                .build()
+        serial_time = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            build(config, pages, workers=workers)
+            elapsed = time.perf_counter() - start
+            if serial_time is None:
+                serial_time = elapsed
+            print('  {:>3} workers: {:8.3f}s total, {:6.2f}ms/page, {:5.2f}x speedup'.format(
+                workers, elapsed, elapsed / num_pages * 1e3, serial_time / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_watch(num_pages, sections_per_page, num_edits):
+    print('watch: {} pages of {} sections, {} edits'.format(num_pages, sections_per_page, num_edits))
+    directory = tempfile.mkdtemp()
+    try:
+        pages = make_site(directory, num_pages, sections_per_page)
+        config = ConfigBuilder() \
+                .add_template_dirs(directory) \
+                .append_compiler_rules(MarkdownToHtmlRule()) \
+                .build()
+        watcher = Watcher(lambda: config, lambda: pages)
+        watcher.poll()
+
+        start = time.perf_counter()
+        watcher.poll()
+        print('  idle poll:  {:8.2f}ms'.format((time.perf_counter() - start) * 1e3))
+
+        turnarounds = []
+        for edit in range(num_edits):
+            page = pages[edit % num_pages]
+            start = time.perf_counter()
+            with open(page.source, 'a') as f:
+                f.write(PAGE_SECTION.format('edit{}'.format(edit)))
+            results, _ = watcher.poll()
+            turnarounds.append(time.perf_counter() - start)
+            assert [result.page for result in results] == [page]
+        turnarounds.sort()
+        print('  turnaround: {:8.2f}ms median, {:8.2f}ms max'.format(
+            turnarounds[len(turnarounds) // 2] * 1e3, turnarounds[-1] * 1e3))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200,
+                        help='Number of pages to build.')
+    parser.add_argument('--sections', type=int, default=20,
+                        help='Number of Markdown sections per page.')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}),
+                        help='Numbers of worker processes to benchmark. The first is the baseline.')
+    parser.add_argument('--edits', type=int, default=20,
+                        help='Number of single-page edits to time while watching.')
+    args = parser.parse_args()
+    bench_build(args.pages, args.sections, args.workers)
+    bench_watch(args.pages, args.sections, args.edits)
+
+if __name__ == '__main__':
+    main()
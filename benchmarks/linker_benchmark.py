@@ -0,0 +1,201 @@
+"""Benchmarks for templar/linker.py.
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/linker_benchmark.py
+
+Each benchmark prints the total time and the time per line, which should stay roughly constant as
+the input grows if the linker scales linearly.
+"""
+
+from templar.linker import Block
+from templar.linker import BlockMap
+from templar.linker import LinkStack
+from templar.linker import Linker
+from templar.linker import convert_lines_to_block
+from templar.linker import get_block_dict
+from templar.linker import link
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+def make_lines(num_lines):
+    """Generates num_lines lines of source content: blocks of 100 lines (including the block tags),
+    followed by plain text for any remainder.
+    """
+    lines = []
+    for block_id in range(num_lines // 100):
+        lines.append('<block block{}>'.format(block_id))
+        lines.extend('Line {} of some block content.'.format(i) for i in range(98))
+        lines.append('</block block{}>'.format(block_id))
+    lines.extend('Trailing line {}.'.format(i) for i in range(num_lines - len(lines)))
+    return lines
+
+
+def bench_convert_lines_to_block(sizes):
+    print('convert_lines_to_block')
+    for num_lines in sizes:
+        lines = make_lines(num_lines)
+        start = time.perf_counter()
+        convert_lines_to_block(lines, BlockMap(), LinkStack('bench.md'), 'bench.md')
+        elapsed = time.perf_counter() - start
+        print('  {:>9,} lines: {:8.3f}s total, {:6.2f}us/line'.format(
+            num_lines, elapsed, elapsed / num_lines * 1e6))
+
+
+class IdentityRule(object):
+    """A rule that does as little work as possible, so that the cost of traversing blocks shows."""
+    def apply(self, content):
+        return content
+
+
+def bench_apply_rules(num_lines, num_rules):
+    print('apply {} rules to {:,} lines'.format(num_rules, num_lines))
+    rules = [IdentityRule() for _ in range(num_rules)]
+    block = convert_lines_to_block(
+            make_lines(num_lines), BlockMap(), LinkStack('bench.md'), 'bench.md')
+    start = time.perf_counter()
+    for rule in rules:
+        block.apply_rule(rule)
+    one_at_a_time = time.perf_counter() - start
+    start = time.perf_counter()
+    block.apply_rules(rules)
+    together = time.perf_counter() - start
+    print('  apply_rule per rule: {:8.3f}ms'.format(one_at_a_time * 1e3))
+    print('  apply_rules:         {:8.3f}ms, {:5.1f}x faster'.format(
+        together * 1e3, one_at_a_time / together))
+
+
+def make_nested_lines(depth, lines_per_level):
+    """Generates source content with blocks nested depth levels deep, each of which has
+    lines_per_level lines of its own before and after the block nested in it.
+    """
+    lines = []
+    for level in range(depth):
+        lines.append('<block level{}>'.format(level))
+        lines.extend('Line {} before level {}.'.format(i, level) for i in range(lines_per_level))
+    for level in reversed(range(depth)):
+        lines.extend('Line {} after level {}.'.format(i, level) for i in range(lines_per_level))
+        lines.append('</block level{}>'.format(level))
+    return lines
+
+
+def eager_block_dict(top_level_block):
+    """Joins every block's contents from the joined contents of its nested blocks, as
+    get_block_dict did before blocks were joined lazily.
+    """
+    block_strs = {}
+    def join(block):
+        block_strs[block.name] = '\n'.join(
+                segment if isinstance(segment, str) else join(segment)
+                for segment in block.segments)
+        return block_strs[block.name]
+    join(top_level_block)
+    return block_strs
+
+
+def measure(function, make_block, repeat=5):
+    """Returns the fastest time that function takes on a fresh block, and the peak memory it
+    allocates, which is measured separately since tracing allocations slows it down.
+    """
+    times = []
+    for _ in range(repeat):
+        block = make_block()
+        start = time.perf_counter()
+        function(block)
+        times.append(time.perf_counter() - start)
+    block = make_block()
+    tracemalloc.start()
+    function(block)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def bench_nested_blocks(depth, lines_per_level):
+    print('get_block_dict: {} levels of nested blocks, {:,} lines per level'.format(
+        depth, 2 * lines_per_level))
+    lines = make_nested_lines(depth, lines_per_level)
+
+    def make_block():
+        return convert_lines_to_block(lines, BlockMap(), LinkStack('bench.md'), 'bench.md')
+
+    assert dict(get_block_dict(make_block())) == eager_block_dict(make_block())
+
+    cases = [
+        ('eager joins, every block', eager_block_dict),
+        ('every block', lambda block: dict(get_block_dict(block))),
+        ('only all', lambda block: get_block_dict(block)['all']),
+    ]
+    for name, function in cases:
+        elapsed, peak = measure(function, make_block)
+        print('  {:<25} {:8.3f}ms, {:8.2f}MB peak'.format(name + ':', elapsed * 1e3, peak / 2**20))
+
+
+def make_site(directory, num_pages, num_partials):
+    """Writes num_pages pages into directory, each of which includes every one of num_partials
+    partials. Returns the paths of the pages.
+    """
+    for partial_id in range(num_partials):
+        with open(os.path.join(directory, 'partial{}.md'.format(partial_id)), 'w') as f:
+            f.write('\n'.join(make_lines(1000)))
+    pages = []
+    for page_id in range(num_pages):
+        page = os.path.join(directory, 'page{}.md'.format(page_id))
+        with open(page, 'w') as f:
+            f.write('\n'.join('<include partial{}.md:block{}>'.format(partial_id, page_id % 10)
+                              for partial_id in range(num_partials)))
+        pages.append(page)
+    return pages
+
+
+def bench_shared_partials(num_pages, num_partials):
+    print('{} pages sharing {} partials'.format(num_pages, num_partials))
+    directory = tempfile.mkdtemp()
+    try:
+        pages = make_site(directory, num_pages, num_partials)
+        start = time.perf_counter()
+        for page in pages:
+            link(page)
+        elapsed = time.perf_counter() - start
+        print('  link:        {:8.3f}s total, {:6.2f}ms/page'.format(
+            elapsed, elapsed / num_pages * 1e3))
+
+        linker = Linker()
+        start = time.perf_counter()
+        for page in pages:
+            linker.link(page)
+        elapsed = time.perf_counter() - start
+        print('  Linker.link: {:8.3f}s total, {:6.2f}ms/page'.format(
+            elapsed, elapsed / num_pages * 1e3))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000],
+                        help='Numbers of source lines to benchmark.')
+    parser.add_argument('--pages', type=int, default=200,
+                        help='Number of pages for the shared partials benchmark.')
+    parser.add_argument('--partials', type=int, default=20,
+                        help='Number of partials for the shared partials benchmark.')
+    parser.add_argument('--rules', type=int, default=40,
+                        help='Number of rules applied to the blocks of 100,000 lines.')
+    parser.add_argument('--depth', type=int, default=20,
+                        help='Levels of nested blocks for the get_block_dict benchmark.')
+    parser.add_argument('--lines-per-level', type=int, default=2500,
+                        help='Lines before and after the nested block of each level.')
+    args = parser.parse_args()
+    bench_convert_lines_to_block(args.sizes)
+    bench_shared_partials(args.pages, args.partials)
+    bench_apply_rules(100000, args.rules)
+    bench_nested_blocks(args.depth, args.lines_per_level)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""Benchmarks for templar/markdown.py.
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/markdown_benchmark.py
+
+Converts documents of increasing size with the regex engine and the token engine, checks that
+both engines produce the same HTML, and prints the throughput of each engine.
+
+Also compares the placeholders of the regex engine against the previous implementation, which hashed
+every placeholder with a salted SHA-1 digest and re-scanned the whole document until no placeholders
+remained, on tag-heavy pages of inline HTML, and compares list hashing against the previous
+implementation, which located every list with str.index, on long and deeply nested lists. Unhashing
+is compared against the previous implementation, which pulled <pre> blocks out of their indentation
+with a regex, on lists with block quotes nested in them.
+
+Finally, converts table-heavy pages without the fragment cache, with a cache that starts empty for
+every page, and with a cache that is already warm from converting the page before.
+"""
+
+from templar import markdown
+from templar.markdown import ConversionCache
+from templar.markdown import Markdown
+from templar.markdown import REGEX_ENGINE
+from templar.markdown import TOKEN_ENGINE
+from templar.markdown import convert
+
+import argparse
+import hashlib
+import random
+import re
+import time
+
+SECTION = """
+Section {0}
+-----------
+
+Some *emphasized* text, some **strong** text, a [link](http://example.com/{0} "Title") and an
+image: ![alt text](image{0}.png). Ampersands & <span class="tag">inline tags</span> are kept.
+This line ends with a line break
+and continues with `inline code` and a reference [link][ref{0}].
+
+### Subsection {0} {{#sub-{0} .subsection}}
+
+* First item of list {0}
+* Second item, with `code`
+    1. A nested item
+    2. Another nested item
+* Third item
+
+> A quotation that spans
+> two lines, with *emphasis*.
+>
+> > And a nested quotation.
+
+    def section_{0}():
+        return '{0}' + "-"
+
+| Header | Centered | Right |
+|:-------|:--------:|------:|
+| cell   | *emph*   | {0}   |
+| cell   | `code`   | {0}   |
+
+<div class="note">
+Raw HTML is preserved as-is, including *asterisks*.
+</div>
+
+* * *
+
+[ref{0}]: http://example.com/ref/{0}
+"""
+
+def make_document(num_sections):
+    return ''.join(SECTION.format(i) for i in range(num_sections))
+
+
+def bench_engines(sizes, repeat):
+    print('convert: regex engine vs token engine')
+    for num_sections in sizes:
+        document = make_document(num_sections)
+        timings = {}
+        results = {}
+        for engine in (REGEX_ENGINE, TOKEN_ENGINE):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                results[engine] = convert(document, engine)
+            timings[engine] = (time.perf_counter() - start) / repeat
+        assert results[REGEX_ENGINE] == results[TOKEN_ENGINE]
+        size = len(document) / 1e3
+        print('  {:>5,} sections ({:7,.0f} KB): regex {:8.2f}ms ({:6,.0f} KB/s), '
+              'token {:8.2f}ms ({:6,.0f} KB/s), {:5.1f}x faster'.format(
+                  num_sections, size,
+                  timings[REGEX_ENGINE] * 1e3, size / timings[REGEX_ENGINE],
+                  timings[TOKEN_ENGINE] * 1e3, size / timings[TOKEN_ENGINE],
+                  timings[REGEX_ENGINE] / timings[TOKEN_ENGINE]))
+
+
+TAG_PARAGRAPH = """
+<span class="name">Entry {0}</span> links to <a href="/entries/{0}">its page</a>, with
+<b>bold</b>, <i>italic</i>, <code>code</code>, `inline code` and <abbr title="x">abbr</abbr>.
+<img src="/images/{0}.png"> <br> <sup>{0}</sup> <kbd>Ctrl</kbd>+<kbd>C</kbd> [link](/{0}).
+"""
+
+def make_tag_document(num_paragraphs):
+    return ''.join(TAG_PARAGRAPH.format(i) for i in range(num_paragraphs))
+
+
+LEGACY_SALT = bytes(random.randint(0, 1000000))
+def legacy_hash_text(s, label, hashes):
+    """The previous implementation of markdown.hash_text."""
+    hashed = label + '-' + hashlib.sha1(LEGACY_SALT + s.encode('utf-8')).hexdigest() + '-' + label
+    hashes[hashed] = s
+    return hashed
+
+
+def legacy_unhash(text, hashes):
+    """The previous implementation of markdown.unhash."""
+    def retrieve_match(match):
+        return hashes[match.group(0)]
+    while markdown.re_hash.search(text):
+        text = markdown.re_hash.sub(retrieve_match, text)
+    return markdown.pull_out_pre_tags(text)
+
+
+def bench_placeholders(sizes, repeat):
+    print('regex engine placeholders on tag-heavy pages: legacy vs current')
+    current = markdown.hash_text, markdown.unhash
+    for num_paragraphs in sizes:
+        document = make_tag_document(num_paragraphs)
+        timings = []
+        for hash_text, unhash in ((legacy_hash_text, legacy_unhash), current):
+            markdown.hash_text, markdown.unhash = hash_text, unhash
+            try:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    result = convert(document)
+                timings.append((time.perf_counter() - start) / repeat)
+                timings.append(result)
+            finally:
+                markdown.hash_text, markdown.unhash = current
+        legacy_time, legacy_result, new_time, new_result = timings
+        assert legacy_result == new_result
+        print('  {:>5,} paragraphs: legacy {:8.2f}ms, current {:8.2f}ms, {:5.1f}x faster'.format(
+            num_paragraphs, legacy_time * 1e3, new_time * 1e3, legacy_time / new_time))
+
+
+def make_flat_list(num_items):
+    return '\n'.join('* Item {} with *emphasis*'.format(i) for i in range(num_items))
+
+
+def make_separate_lists(num_lists):
+    return '\n\nA paragraph between lists.\n\n'.join(
+            '* First item\n* Second item' for _ in range(num_lists))
+
+
+def make_nested_list(depth, width):
+    """Returns a list that is nested depth levels deep, where each level
+    has width items and the last item of each level contains the next.
+    """
+    lines = []
+    for level in range(depth):
+        indent = ' ' * 4 * level
+        for i in range(width):
+            lines.append('{}* Item {} of level {}'.format(indent, i, level))
+    return '\n'.join(lines)
+
+
+def legacy_hash_lists(text, hashes, markdown_obj):
+    """The previous implementation of markdown.hash_lists."""
+    for style, marker in (('u', '[+*-]'), ('o', r'\d+\.')):
+        list_re = re.compile(markdown.re_list % (marker, marker), re.S | re.X)
+        for match in list_re.finditer(text):
+            lst = match.group(1)
+            items = re.split(r'(?:\n|\A) {0,3}%s ' % marker, lst)[1:]
+            whole_list = markdown.list_html(style, items, markdown_obj)
+            hashed = markdown.hash_text(whole_list, 'list', hashes)
+            start = text.index(match.group(0))
+            end = start + len(match.group(0))
+            text = text[:start] + '\n\n' + hashed + '\n\n' + text[end:]
+    return text
+
+
+def bench_lists(sizes, depths, repeat):
+    print('regex engine list hashing: legacy vs current')
+    documents = [('{:>6,} items'.format(n), make_flat_list(n)) for n in sizes]
+    documents += [('{:>6,} lists'.format(n), make_separate_lists(n)) for n in sizes]
+    documents += [('{:>6} deep'.format(d), make_nested_list(d, 10)) for d in depths]
+    current = markdown.hash_lists
+    for name, document in documents:
+        timings = []
+        for hash_lists in (legacy_hash_lists, current):
+            markdown.hash_lists = hash_lists
+            try:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    result = convert(document)
+                timings.append((time.perf_counter() - start) / repeat)
+                timings.append(result)
+            finally:
+                markdown.hash_lists = current
+        legacy_time, legacy_result, new_time, new_result = timings
+        assert legacy_result == new_result
+        print('  {}: legacy {:8.2f}ms, current {:8.2f}ms, {:5.1f}x faster'.format(
+            name, legacy_time * 1e3, new_time * 1e3, legacy_time / new_time))
+
+
+def make_nested_document(num_sections, depth):
+    """Returns sections of lists nested depth levels deep, where every item contains a block quote
+    with a code block, so that every level hashes and unhashes <pre> blocks.
+    """
+    sections = []
+    for section in range(num_sections):
+        lines = []
+        for level in range(depth):
+            indent = ' ' * 4 * level
+            lines.extend([
+                '{}* Item {} of level {} with `code` and <b>tags</b>'.format(
+                    indent, section, level),
+                '{}* Another item of level {}'.format(indent, level),
+                '',
+                '{}    > A quotation with *emphasis*'.format(indent),
+                '{}    >'.format(indent),
+                '{}    >     quoted_code({})'.format(indent, level),
+                '',
+            ])
+        sections.append('\n'.join(lines))
+        sections.append('\n\nParagraph {0}.\n\n        code_block({0})\n\n'.format(section))
+    return ''.join(sections)
+
+
+LEGACY_RE_PRE_TAG = re.compile(r"""
+([ ]*)  # \1 is leading whitespace
+<pre>
+.*?
+</pre>
+""", re.S | re.X)
+def legacy_pull_out_pre_tags(text):
+    """The previous implementation of markdown.pull_out_pre_tags."""
+    return LEGACY_RE_PRE_TAG.sub(
+            lambda m: re.sub('^' + m.group(1), '', m.group(0), flags=re.M), text)
+
+
+def bench_unhash(depths, repeat):
+    print('regex engine unhash on nested lists and block quotes: legacy vs current')
+    current = markdown.pull_out_pre_tags
+    current_unhash = markdown.unhash
+    for depth in depths:
+        document = make_nested_document(30, depth)
+        # Collect the text and hashes that every (recursive) conversion of the document unhashes.
+        calls = []
+        def record_unhash(text, hashes):
+            calls.append((text, dict(hashes)))
+            return current_unhash(text, hashes)
+        markdown.unhash = record_unhash
+        try:
+            convert(document)
+        finally:
+            markdown.unhash = current_unhash
+
+        timings = []
+        for pull_out_pre_tags in (legacy_pull_out_pre_tags, current):
+            markdown.pull_out_pre_tags = pull_out_pre_tags
+            try:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    results = [markdown.unhash(text, hashes) for text, hashes in calls]
+                timings.append((time.perf_counter() - start) / repeat)
+                timings.append(results)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    convert(document)
+                timings.append((time.perf_counter() - start) / repeat)
+            finally:
+                markdown.pull_out_pre_tags = current
+        legacy_time, legacy_results, legacy_convert, new_time, new_results, new_convert = timings
+        assert legacy_results == new_results
+        print('  {:>3} deep, {:>5,} unhashes: legacy {:8.2f}ms, current {:8.2f}ms, {:5.1f}x faster '
+              '(whole conversion: {:8.2f}ms vs {:8.2f}ms)'.format(
+                  depth, len(calls), legacy_time * 1e3, new_time * 1e3, legacy_time / new_time,
+                  legacy_convert * 1e3, new_convert * 1e3))
+
+
+TABLE = """
+Table {0}
+---------
+
+| Feature      | Supported | Notes                          |
+|:-------------|:---------:|-------------------------------:|
+| `build`      | **Yes**   | See [the guide][guide].        |
+| `watch`      | *No*      | Planned                        |
+| `serve`      | **Yes**   | See [the guide][guide].        |
+| Feature {0}  | *No*      | Planned                        |
+
+> **Note:** this table is generated.
+
+[guide]: /guide.html
+"""
+
+def make_table_document(num_tables):
+    return ''.join(TABLE.format(i) for i in range(num_tables))
+
+
+def bench_cache(sizes, repeat):
+    print('fragment cache on table-heavy pages')
+    default_cache = Markdown.cache
+    for num_tables in sizes:
+        document = make_table_document(num_tables)
+        timings = {}
+        results = {}
+        try:
+            for name in ('uncached', 'cold', 'warm'):
+                Markdown.cache = None if name == 'uncached' else ConversionCache()
+                if name == 'warm':
+                    convert(document)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    if name == 'cold':
+                        Markdown.cache.clear()
+                    results[name] = convert(document)
+                timings[name] = (time.perf_counter() - start) / repeat
+            hits, misses = Markdown.cache.hits, Markdown.cache.misses
+        finally:
+            Markdown.cache = default_cache
+        assert results['uncached'] == results['cold'] == results['warm']
+        print('  {:>5,} tables: uncached {:8.2f}ms, cold cache {:8.2f}ms ({:4.1f}x), '
+              'warm cache {:8.2f}ms ({:6.1f}x), {:,} hits, {:,} misses'.format(
+                  num_tables, timings['uncached'] * 1e3,
+                  timings['cold'] * 1e3, timings['uncached'] / timings['cold'],
+                  timings['warm'] * 1e3, timings['uncached'] / timings['warm'],
+                  hits, misses))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 300],
+                        help='Numbers of sections per document to benchmark.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times each document is converted.')
+    parser.add_argument('--tag-sizes', type=int, nargs='+', default=[10, 100, 300],
+                        help='Numbers of paragraphs per tag-heavy page to benchmark.')
+    parser.add_argument('--list-sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Numbers of items per flat list, and of separate lists per page, to benchmark.')
+    parser.add_argument('--list-depths', type=int, nargs='+', default=[5, 10, 20],
+                        help='Nesting depths of nested lists to benchmark.')
+    parser.add_argument('--unhash-depths', type=int, nargs='+', default=[2, 5, 10],
+                        help='Nesting depths of lists with block quotes to benchmark unhashing on.')
+    parser.add_argument('--table-sizes', type=int, nargs='+', default=[10, 100, 300],
+                        help='Numbers of tables per table-heavy page to benchmark.')
+    args = parser.parse_args()
+    # The other benchmarks convert the same documents repeatedly, so they run without the fragment
+    # cache to measure the conversion itself.
+    default_cache, Markdown.cache = Markdown.cache, None
+    try:
+        bench_engines(args.sizes, args.repeat)
+        bench_placeholders(args.tag_sizes, args.repeat)
+        bench_lists(args.list_sizes, args.list_depths, args.repeat)
+        bench_unhash(args.unhash_depths, args.repeat)
+    finally:
+        Markdown.cache = default_cache
+    bench_cache(args.table_sizes, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Benchmarks for templar/api/publish.py.
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/publish_benchmark.py
+
+Compares recursive Jinja expression evaluation against the previous implementation, which created a
+new Environment and re-rendered the whole page on every iteration.
+
+Also compares the time and peak memory of publishing large generated pages by rendering them into a
+single string against streaming them to the destination file.
+"""
+
+from templar.api.config import ConfigBuilder
+from templar.api.publish import _jinja_expression_re
+from templar.api.publish import _recursively_evaluate_jinja_expressions
+from templar.api.publish import publish
+
+import argparse
+import jinja2
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+def make_page(num_lines, depth):
+    """Returns a page of num_lines lines, every tenth of which contains an expression that takes
+    depth renders to expand fully, along with the variables that the expressions use.
+    """
+    variables = {'var{}'.format(depth): 'value'}
+    for level in range(depth):
+        variables['var{}'.format(level)] = '({{{{ var{} }}}})'.format(level + 1)
+    lines = []
+    for i in range(num_lines):
+        if i % 10 == 0:
+            lines.append('Line {} refers to {{{{ var0 }}}}.'.format(i))
+        else:
+            lines.append('Line {} is plain text without any expressions.'.format(i))
+    return '\n'.join(lines), variables
+
+
+def legacy_recursive_evaluation(result, variables):
+    """The previous implementation of recursive Jinja expression evaluation."""
+    while _jinja_expression_re.search(result):
+        jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'intermediate': result}))
+        result = jinja_env.get_template('intermediate').render(variables)
+    return result
+
+
+def bench_recursive_evaluation(sizes, depth, repeat):
+    print('recursive Jinja evaluation (depth {})'.format(depth))
+    for num_lines in sizes:
+        page, variables = make_page(num_lines, depth)
+        timings = []
+        for evaluate in (legacy_recursive_evaluation, _recursively_evaluate_jinja_expressions):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = evaluate(page, variables)
+            timings.append((time.perf_counter() - start) / repeat)
+            timings.append(result)
+        legacy_time, legacy_result, new_time, new_result = timings
+        assert legacy_result == new_result
+        print('  {:>7,} lines: legacy {:8.2f}ms, current {:8.2f}ms, {:5.1f}x faster'.format(
+            num_lines, legacy_time * 1e3, new_time * 1e3, legacy_time / new_time))
+
+
+REFERENCE_TEMPLATE = """<html><body>
+{% for i in range(num_entries) %}<section id="entry-{{ i }}">
+  <h2>Entry {{ i }}</h2>
+  <p>{{ description }} ({{ i }})</p>
+</section>
+{% endfor %}</body></html>"""
+
+def bench_streaming(sizes):
+    print('publishing large pages: render vs stream')
+    jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'page.html': REFERENCE_TEMPLATE}))
+    config = ConfigBuilder().add_variable('description', 'A generated reference entry.').build()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        destination = os.path.join(temp_dir, 'page.html')
+        for num_entries in sizes:
+            config = config.to_builder().add_variable('num_entries', num_entries).build()
+            timings = []
+            for stream in (False, True):
+                start = time.perf_counter()
+                publish(config, template='page.html', destination=destination,
+                        jinja_env=jinja_env, stream=stream)
+                timings.append(time.perf_counter() - start)
+                # Memory is measured separately, since tracing allocations slows down rendering.
+                tracemalloc.start()
+                publish(config, template='page.html', destination=destination,
+                        jinja_env=jinja_env, stream=stream)
+                timings.append(tracemalloc.get_traced_memory()[1] / 1e6)
+                tracemalloc.stop()
+            size = os.path.getsize(destination) / 1e6
+            print('  {:>9,} entries ({:6.1f} MB): render {:8.2f}ms ({:6.1f} MB peak), '
+                  'stream {:8.2f}ms ({:6.1f} MB peak)'.format(
+                      num_entries, size, timings[0] * 1e3, timings[1], timings[2] * 1e3,
+                      timings[3]))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Numbers of lines per page to benchmark.')
+    parser.add_argument('--depth', type=int, default=5,
+                        help='Number of renders needed to expand each expression.')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Number of times each page is evaluated.')
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Numbers of entries per generated page to benchmark.')
+    args = parser.parse_args()
+    bench_recursive_evaluation(args.sizes, args.depth, args.repeat)
+    bench_streaming(args.page_sizes)
+
+if __name__ == '__main__':
+    main()
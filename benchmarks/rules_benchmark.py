@@ -0,0 +1,158 @@
+"""Benchmarks for templar/api/rules/core.py.
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/rules_benchmark.py
+
+Compares selecting the rules that apply to each page with a RuleIndex against checking every rule,
+for a config of rules scoped to sections of a site by their src patterns, plus a few rules scoped
+only by file extension.
+
+Also compares applying many SubstitutionRules to a page one at a time against applying them in one
+pass with a FusedSubstitutionRule.
+"""
+
+from templar.api.rules.core import FusedSubstitutionRule
+from templar.api.rules.core import Rule
+from templar.api.rules.core import RuleIndex
+from templar.api.rules.core import SubstitutionRule
+
+import argparse
+import random
+import time
+
+def make_rules(num_rules, num_sections):
+    """Returns rules that are mostly scoped to one section of the site each."""
+    rules = [Rule(src=r'\.md$', dst=r'\.html$'), Rule(dst=r'\.html$'), Rule()]
+    rng = random.Random(0)
+    while len(rules) < num_rules:
+        section = rng.randrange(num_sections)
+        kind = rng.randrange(4)
+        if kind == 0:
+            rules.append(Rule(src=r'^site/section{}/'.format(section)))
+        elif kind == 1:
+            rules.append(Rule(src=r'section{}/.*\.md$'.format(section), dst=r'\.html$'))
+        elif kind == 2:
+            rules.append(Rule(src=r'section{}/page\d+\.md'.format(section)))
+        else:
+            rules.append(Rule(dst=r'/section{}/.*\.(html|txt)$'.format(section)))
+    return rules
+
+
+def make_paths(num_paths, num_sections):
+    rng = random.Random(1)
+    paths = []
+    for i in range(num_paths):
+        section = rng.randrange(num_sections)
+        src = 'site/section{}/page{}.md'.format(section, i)
+        paths.append((src, 'out/section{}/page{}.html'.format(section, i)))
+    return paths
+
+
+def linear_applicable_rules(rules, src, dst):
+    """Checks every rule, as publish did before rules were indexed (without memoizing)."""
+    applicable = []
+    for rule in rules:
+        if rule._src_regex and (src is None or rule._src_regex.search(src) is None):
+            continue
+        elif rule._dst_regex and (dst is None or rule._dst_regex.search(dst) is None):
+            continue
+        applicable.append(rule)
+    return applicable
+
+
+def bench_index(num_rules, num_paths, num_sections):
+    print('index: {} rules x {} paths, {} sections'.format(num_rules, num_paths, num_sections))
+    rules = make_rules(num_rules, num_sections)
+    paths = make_paths(num_paths, num_sections)
+
+    start = time.perf_counter()
+    linear = [linear_applicable_rules(rules, src, dst) for src, dst in paths]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = RuleIndex(rules)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed = [index.applicable_rules(src, dst) for src, dst in paths]
+    index_time = time.perf_counter() - start
+
+    assert linear == indexed
+    num_applicable = sum(len(applicable) for applicable in indexed) / num_paths
+    print('  linear:  {:8.3f}s ({:7.2f}us/path)'.format(linear_time, linear_time / num_paths * 1e6))
+    print('  index:   {:8.3f}s ({:7.2f}us/path) + {:.3f}s to build, {:5.1f}x faster'.format(
+        index_time, index_time / num_paths * 1e6, build_time, linear_time / index_time))
+    print('  {:.1f} applicable rules per path'.format(num_applicable))
+
+
+class ShortcodeRule(SubstitutionRule):
+    """Replaces shortcodes like [[name arg]] with HTML, as a site's substitution rules might."""
+    def __init__(self, name):
+        super().__init__()
+        self.pattern = r'\[\[{} ([^\]]+)\]\]'.format(name)
+        self.name = name
+
+    def substitute(self, match):
+        return '<span class="{}">{}</span>'.format(self.name, match.group(1))
+
+
+def make_page(num_rules, num_paragraphs):
+    rng = random.Random(2)
+    paragraphs = []
+    for i in range(num_paragraphs):
+        words = ['word{}'.format(rng.randrange(1000)) for _ in range(60)]
+        for _ in range(3):
+            shortcode = '[[code{} arg{}]]'.format(rng.randrange(num_rules), i)
+            words[rng.randrange(len(words))] = shortcode
+        paragraphs.append(' '.join(words))
+    return '\n\n'.join(paragraphs)
+
+
+def bench_fusion(num_rules, num_paragraphs, repeat):
+    print('fusion: {} rules, page of {} paragraphs'.format(num_rules, num_paragraphs))
+    rules = [ShortcodeRule('code{}'.format(i)) for i in range(num_rules)]
+    page = make_page(num_rules, num_paragraphs)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        sequential = page
+        for rule in rules:
+            sequential = rule.apply(sequential)
+    sequential_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    fused_rule = FusedSubstitutionRule(rules)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fused = fused_rule.apply(page)
+    fused_time = (time.perf_counter() - start) / repeat
+
+    assert sequential == fused
+    print('  one at a time: {:8.3f}ms'.format(sequential_time * 1e3))
+    print('  fused:         {:8.3f}ms + {:.3f}ms to build, {:5.1f}x faster'.format(
+        fused_time * 1e3, build_time * 1e3, sequential_time / fused_time))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', type=int, nargs='+', default=[100, 300, 1000],
+                        help='Numbers of rules to benchmark.')
+    parser.add_argument('--paths', type=int, default=10000,
+                        help='Number of pages whose applicable rules are selected.')
+    parser.add_argument('--sections', type=int, default=200,
+                        help='Number of sections that rules are scoped to.')
+    parser.add_argument('--substitution-rules', type=int, nargs='+', default=[10, 40, 100],
+                        help='Numbers of SubstitutionRules to apply to a page.')
+    parser.add_argument('--paragraphs', type=int, default=200,
+                        help='Number of paragraphs in the page that SubstitutionRules apply to.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Number of times SubstitutionRules are applied to the page.')
+    args = parser.parse_args()
+    for num_rules in args.rules:
+        bench_index(num_rules, args.paths, args.sections)
+    for num_rules in args.substitution_rules:
+        bench_fusion(num_rules, args.paragraphs, args.repeat)
+
+if __name__ == '__main__':
+    main()
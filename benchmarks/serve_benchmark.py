@@ -0,0 +1,115 @@
+"""Benchmarks for templar/api/serve.py.
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/serve_benchmark.py
+
+Compares rendering a page by running the templar command once per request, as a preview environment
+without a server would, against requesting it from a render server whose caches are warm. Also
+times requests made right after the page's source is edited, and prints the latency percentiles
+that the server reports.
+"""
+
+from templar.api.build import Page
+from templar.api.config import ConfigBuilder
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
+from templar.api.serve import PageRenderer
+from templar.api.serve import STATS_PATH
+from templar.api.serve import make_server
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+PAGE_SECTION = """
+Section {0}
+-----------
+
+Some *emphasized* text, some **strong** text and a [link](http://example.com/{0}).
+
+* First item of list {0}
+* Second item, with `code`
+"""
+
+CONFIG = """
+from templar.api.config import ConfigBuilder
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
+
+config = ConfigBuilder().add_template_dirs({!r}).append_compiler_rules(MarkdownToHtmlRule()).build()
+"""
+
+def bench_serve(num_sections, num_requests):
+    print('serve: page of {} sections, {} requests'.format(num_sections, num_requests))
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'page.md')
+        with open(source, 'w') as f:
+            f.write(''.join(PAGE_SECTION.format(i) for i in range(num_sections)))
+        with open(os.path.join(directory, 'page.html'), 'w') as f:
+            f.write('<html><body>{{ blocks.all }}</body></html>')
+        config_path = os.path.join(directory, 'config.py')
+        with open(config_path, 'w') as f:
+            f.write(CONFIG.format(directory))
+
+        command = [sys.executable, '-c', 'from templar.cli.templar import main; main()',
+                   '-s', source, '-t', 'page.html', '-c', config_path]
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        start = time.perf_counter()
+        for _ in range(max(1, num_requests // 10)):
+            subprocess.check_call(command, env=env, stdout=subprocess.DEVNULL)
+        cli_time = (time.perf_counter() - start) / max(1, num_requests // 10)
+        print('  command per request: {:8.2f}ms'.format(cli_time * 1e3))
+
+        config = ConfigBuilder() \
+                .add_template_dirs(directory) \
+                .append_compiler_rules(MarkdownToHtmlRule()) \
+                .build()
+        pages = [Page(source, 'page.html', 'page.html')]
+        server = make_server(PageRenderer(lambda: config, lambda: pages, '.'), port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = 'http://127.0.0.1:{}/page.html'.format(server.server_port)
+        try:
+            start = time.perf_counter()
+            for _ in range(num_requests):
+                urllib.request.urlopen(url).close()
+            warm_time = (time.perf_counter() - start) / num_requests
+            print('  warm server:         {:8.2f}ms, {:5.1f}x faster'.format(
+                warm_time * 1e3, cli_time / warm_time))
+
+            start = time.perf_counter()
+            for edit in range(num_requests // 10):
+                with open(source, 'a') as f:
+                    f.write(PAGE_SECTION.format('edit{}'.format(edit)))
+                urllib.request.urlopen(url).close()
+            edit_time = (time.perf_counter() - start) / max(1, num_requests // 10)
+            print('  after each edit:     {:8.2f}ms'.format(edit_time * 1e3))
+
+            stats_url = 'http://127.0.0.1:{}{}'.format(server.server_port, STATS_PATH)
+            with urllib.request.urlopen(stats_url) as response:
+                print('  server stats:        {}'.format(response.read().decode('utf-8')))
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sections', type=int, default=50,
+                        help='Number of Markdown sections in the served page.')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Number of requests made to the warm server.')
+    args = parser.parse_args()
+    bench_serve(args.sections, args.requests)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Benchmarks the startup of Templar's command-line tools.
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/startup_benchmark.py
+
+Runs `templar --version`, a Markdown-only `templar` run and a `markdown` run in fresh interpreters
+with `python -X importtime`, and prints the wall time of each command along with the time spent
+importing modules and the slowest imports. Bytecode is written and reused, as it would be in an
+installed copy of Templar. Needs Python 3.7 or later, for -X importtime.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = {
+    'templar --version': (
+        "import sys; sys.argv = ['templar', '--version']; "
+        "from templar.cli.templar import main; main()"),
+    'templar -s page.md': (
+        "import sys; sys.argv = ['templar', '-s', {page!r}, '-c', {config!r}]; "
+        "from templar.cli.templar import main; main()"),
+    'markdown -s page.md': (
+        "import sys; sys.argv = ['markdown', '-s', {page!r}]; "
+        "from templar.markdown import main; main()"),
+}
+
+CONFIG = """
+from templar.api.config import ConfigBuilder
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
+
+config = ConfigBuilder().append_compiler_rules(MarkdownToHtmlRule()).build()
+"""
+
+def parse_importtime(stderr):
+    """Returns the self and cumulative import times (in microseconds) of every module reported by
+    -X importtime, along with its line of the report (whose indentation shows nesting), keyed by
+    module name.
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports[name.strip()] = (int(self_us), int(cumulative_us), name.rstrip())
+    return imports
+
+
+def run_command(code, repeat):
+    """Runs code in fresh interpreters, returning the fastest wall time and its import report."""
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    best = None
+    for _ in range(repeat + 1):  # The first run writes bytecode.
+        start = time.perf_counter()
+        process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', code],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                universal_newlines=True, check=True)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, parse_importtime(process.stderr))
+    return best
+
+
+def bench_startup(repeat, num_slowest):
+    directory = tempfile.mkdtemp()
+    try:
+        page = os.path.join(directory, 'page.md')
+        with open(page, 'w') as f:
+            f.write('Some *Markdown* content.\n')
+        config = os.path.join(directory, 'config.py')
+        with open(config, 'w') as f:
+            f.write(CONFIG)
+        for name, code in COMMANDS.items():
+            elapsed, imports = run_command(code.format(page=page, config=config), repeat)
+            top_level = [cumulative for _, cumulative, line in imports.values()
+                         if not line.startswith('  ')]
+            print('{}: {:7.2f}ms wall, {:7.2f}ms importing {} modules{}'.format(
+                name, elapsed * 1e3, sum(top_level) / 1e3, len(imports),
+                ' (including jinja2)' if 'jinja2' in imports else ''))
+            slowest = sorted(imports.items(), key=lambda item: -item[1][0])[:num_slowest]
+            for module, (self_us, cumulative_us, _) in slowest:
+                print('  {:7.2f}ms self {:7.2f}ms cumulative  {}'.format(
+                    self_us / 1e3, cumulative_us / 1e3, module))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs of each command; the fastest is reported.')
+    parser.add_argument('--slowest', type=int, default=5,
+                        help='Number of slowest imports to print for each command.')
+    args = parser.parse_args()
+    bench_startup(args.repeat, args.slowest)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,602 @@
+"""
+The public API for building many pages with Templar.
+
+Users can use this module with the following import statement:
+
+    from templar.api import build
+"""
+
+from templar.api.config import Config
+from templar.api.publish import publish
+from templar.exceptions import TemplarError
+import templar
+
+from collections import namedtuple
+import fnmatch
+import hashlib
+import itertools
+import jinja2
+import jinja2.meta
+import json
+import os
+import pickle
+import sys
+import time
+
+# A page to publish. source and template are interpreted as they are by publish; at most one of
+# them can be None.
+Page = namedtuple('Page', ['source', 'template', 'destination'])
+
+# The outcome of building a Page. built is False if the page was up to date and was skipped;
+# written is False if the page was skipped, or if it was built but its destination already held the
+# same content and was left untouched; seconds is the time spent on the page, including checking
+# whether it was up to date.
+PageResult = namedtuple('PageResult', ['page', 'built', 'written', 'seconds'])
+
+def build(config, pages, state_path=None, config_path=None, jinja_env=None, workers=1,
+        chunksize=None):
+    """Publishes each of the pages to its destination, reusing the config's Linker and a single
+    Jinja Environment for all of them.
+
+    If state_path is given, the build is incremental: after a page is published, the inputs that
+    its destination was built from are recorded in the state file at state_path. These inputs are
+    the source, every file it (transitively) includes, the template, every template it
+    (transitively) extends, includes or imports, and the config file at config_path. A later build
+    skips a page whose destination exists and whose inputs are all unchanged.
+
+    A page is always rebuilt if its inputs cannot be determined, e.g. if its template refers to
+    other templates through variables.
+
+    If workers is greater than 1, pages are published in parallel by a pool of worker processes,
+    each of which publishes with its own copy of the config and jinja_env. On platforms that start
+    processes by spawning rather than forking (e.g. Windows and macOS), the config, its rules and
+    jinja_env must therefore be picklable; otherwise, a BuildError is raised before any page is
+    built.
+
+    A page that fails to publish, because of a TemplarError, a Jinja error or an OSError (e.g. if
+    its destination cannot be written), does not stop the build. Once every other page is built, a
+    BuildError that lists every failure is raised.
+
+    PARAMETERS:
+    config      -- Config; used to publish every page.
+    pages       -- iterable of Page; each destination must be unique.
+    state_path  -- str; path of the file in which the build state is kept. If None, every page is
+                   built.
+    config_path -- str; path of the config file, which is treated as an input of every page. If
+                   None, changes to the config are not detected.
+    jinja_env   -- jinja2.Environment; if None, the config's Jinja2 Environment is used.
+    workers     -- int; the number of processes that publish pages. If 1, pages are published in
+                   the current process.
+    chunksize   -- int; the number of pages sent to a worker process at a time. If None, pages are
+                   split into about four chunks per worker.
+
+    RETURNS:
+    list of PageResult; the results for the pages, in the same order as pages.
+    """
+    if not isinstance(config, Config):
+        raise BuildError(
+                "config must be a Config object, "
+                "but instead was type '{}'".format(type(config).__name__))
+    if not isinstance(workers, int) or workers < 1:
+        raise BuildError('workers must be a positive integer, but instead was: ' + repr(workers))
+    pages = list(pages)
+    destinations = set()
+    for page in pages:
+        if not page.destination:
+            raise BuildError('Every page must have a destination, but found: ' + repr(page))
+        elif page.destination in destinations:
+            raise BuildError('Found multiple pages with destination: ' + page.destination)
+        destinations.add(page.destination)
+
+    if state_path:
+        state = BuildState.load(state_path)
+    else:
+        state = BuildState()
+    results = []
+    stale_pages = []
+    for page in pages:
+        start = time.perf_counter()
+        if state_path and state.is_up_to_date(page):
+            results.append(PageResult(page, False, False, time.perf_counter() - start))
+        else:
+            results.append(None)
+            stale_pages.append((len(results) - 1, page))
+            state.forget(page.destination)  # In case publishing fails.
+
+    publisher = _PagePublisher(config, jinja_env, config_path, bool(state_path))
+    errors = []
+    try:
+        if workers == 1 or len(stale_pages) <= 1:
+            outcomes = map(publisher.publish, (page for _, page in stale_pages))
+            executor = None
+        else:
+            import concurrent.futures  # Only parallel builds need it.
+
+            if chunksize is None:
+                chunksize = max(1, len(stale_pages) // (workers * 4))
+            _check_picklable(publisher, workers)
+            pages_to_publish = [page for _, page in stale_pages]
+            if _POOL_INITIALIZER:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                        workers, initializer=_init_worker, initargs=(publisher,))
+                outcomes = executor.map(_publish_in_worker, pages_to_publish, chunksize=chunksize)
+            else:
+                # Worker processes cannot be initialized before Python 3.7, so the publisher is
+                # sent along with every chunk of pages instead.
+                executor = concurrent.futures.ProcessPoolExecutor(workers)
+                futures = [
+                    executor.submit(_publish_chunk, publisher, pages_to_publish[i:i + chunksize])
+                    for i in range(0, len(pages_to_publish), chunksize)
+                ]
+                outcomes = itertools.chain.from_iterable(future.result() for future in futures)
+        try:
+            for (index, page), (inputs, written, seconds, error) in zip(stale_pages, outcomes):
+                if error is not None:
+                    errors.append('{}: {}'.format(page.destination, error))
+                    continue
+                if state_path:
+                    state.record(page, inputs)
+                results[index] = PageResult(page, True, written, seconds)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    finally:
+        # Save progress even if some pages failed, so that pages built so far are not rebuilt.
+        if state_path:
+            state.save(state_path, destinations)
+
+    if errors:
+        raise BuildError('\n'.join(
+            ['Failed to build {} of {} pages:'.format(len(errors), len(pages))] + errors))
+    return results
+
+
+def load_manifest(manifest_path):
+    """Loads the Pages listed in a JSON manifest file. Paths in the manifest are relative to the
+    current working directory.
+
+    The manifest is an object with either or both of the following lists:
+
+        {
+            "pages": [
+                {"source": "index.md", "template": "index.html", "destination": "site/index.html"}
+            ],
+            "globs": [
+                {
+                    "root": "docs",
+                    "sources": "*.md",
+                    "template": "doc.html",
+                    "destination": "site/docs/{path}.html"
+                }
+            ]
+        }
+
+    Each entry of "pages" describes a single Page; "source" and "template" are optional, although
+    at least one of them must be present. Each entry of "globs" describes a Page for every file under
+    "root" whose path relative to "root" matches the "sources" pattern (in which * also matches
+    path separators). Its "destination" is formatted with {path}, the relative path of the source
+    without its extension; "template" is optional. Glob matches are sorted by path.
+
+    RETURNS:
+    list of Page; pages listed in "pages", followed by pages matched by "globs".
+    """
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except OSError:
+        raise BuildError('Could not read manifest file: ' + manifest_path)
+    except ValueError as e:
+        raise BuildError('Could not parse manifest file {}: {}'.format(manifest_path, e))
+    if not isinstance(manifest, dict):
+        raise BuildError('Manifest file must contain a JSON object: ' + manifest_path)
+
+    pages = []
+    for entry in manifest.get('pages', []):
+        _check_manifest_entry(entry, ['destination'], ['source', 'template'])
+        pages.append(Page(entry.get('source'), entry.get('template'), entry['destination']))
+    for entry in manifest.get('globs', []):
+        _check_manifest_entry(entry, ['root', 'sources', 'destination'], ['template'])
+        matches = []
+        for directory, _, filenames in os.walk(entry['root']):
+            for filename in filenames:
+                source = os.path.join(directory, filename)
+                relative_path = os.path.relpath(source, entry['root'])
+                if fnmatch.fnmatch(relative_path, entry['sources']):
+                    matches.append((relative_path, source))
+        for relative_path, source in sorted(matches):
+            destination = entry['destination'].format(path=os.path.splitext(relative_path)[0])
+            pages.append(Page(source, entry.get('template'), destination))
+    return pages
+
+
+def _check_manifest_entry(entry, required_keys, optional_keys):
+    if not isinstance(entry, dict):
+        raise BuildError('Manifest entries must be JSON objects, but found: ' + repr(entry))
+    for key in required_keys:
+        if key not in entry:
+            raise BuildError('Manifest entry is missing "{}": {}'.format(key, json.dumps(entry)))
+    for key, value in entry.items():
+        if key not in required_keys and key not in optional_keys:
+            raise BuildError('Unknown key "{}" in manifest entry: {}'.format(key, json.dumps(entry)))
+        elif not isinstance(value, str):
+            raise BuildError('"{}" must be a string in manifest entry: {}'.format(
+                key, json.dumps(entry)))
+
+
+def page_inputs(config, page, config_path, jinja_env):
+    """Returns the inputs of a page that was just published with the config, or None if they cannot
+    be determined.
+
+    RETURNS:
+    (list of str, list of str) or None; the paths of the files the page was built from, and the
+    paths that did not exist but would have changed the page if they did.
+    """
+    files = set()
+    missing_paths = set()
+    if config_path:
+        files.add(os.path.abspath(config_path))
+    if page.source:
+        source_files, source_missing_paths = config.linker.dependencies(page.source)
+        files.update(source_files)
+        missing_paths.update(os.path.abspath(path) for path in source_missing_paths)
+    if page.template:
+        template_files = template_dependencies(jinja_env, page.template)
+        if template_files is None:
+            return None
+        files.update(template_files)
+    return sorted(files), sorted(missing_paths)
+
+
+def template_dependencies(jinja_env, template):
+    """Returns the absolute paths of the template file and of every template it (transitively)
+    extends, includes or imports, or None if they cannot all be determined statically.
+    """
+    files = set()
+    visited = set()
+    stack = [template]
+    while stack:
+        name = stack.pop()
+        if name in visited:
+            continue
+        visited.add(name)
+        try:
+            source, filename, _ = jinja_env.loader.get_source(jinja_env, name)
+        except jinja2.TemplateNotFound:
+            return None
+        if filename is None:
+            return None  # The template does not come from a file.
+        files.add(os.path.abspath(filename))
+        for referenced in jinja2.meta.find_referenced_templates(jinja_env.parse(source)):
+            if referenced is None:
+                return None  # The template is chosen by an expression.
+            stack.append(referenced)
+    return files
+
+
+class _PagePublisher(object):
+    """Publishes single pages of a build. Worker processes each hold a copy."""
+    def __init__(self, config, jinja_env, config_path, record_inputs):
+        self._config = config
+        self._jinja_env = jinja_env
+        self._config_path = config_path
+        self._record_inputs = record_inputs
+
+    def publish(self, page):
+        """Publishes the page.
+
+        RETURNS:
+        (inputs, bool, float, str); the inputs of the page (see page_inputs) if they are recorded,
+        whether its destination was written, the time spent publishing it, and a description of the
+        error that prevented it from being published, or None. Errors are described by strings
+        because exceptions may not survive being sent back from a worker process.
+        """
+        start = time.perf_counter()
+        if self._jinja_env is None:
+            self._jinja_env = self._config.jinja_env
+        try:
+            write_result = publish(
+                    self._config,
+                    source=page.source,
+                    template=page.template,
+                    destination=page.destination,
+                    jinja_env=self._jinja_env,
+                    stream=True)
+        except (TemplarError, jinja2.TemplateError, OSError) as e:
+            return None, False, time.perf_counter() - start, '{}: {}'.format(type(e).__name__, e)
+        if self._record_inputs:
+            inputs = page_inputs(self._config, page, self._config_path, self._jinja_env)
+        else:
+            inputs = None
+        return inputs, write_result.written, time.perf_counter() - start, None
+
+
+_worker_publisher = None  # The _PagePublisher of a worker process.
+
+def _init_worker(publisher):
+    global _worker_publisher
+    _worker_publisher = publisher
+
+def _publish_in_worker(page):
+    return _worker_publisher.publish(page)
+
+def _publish_chunk(publisher, pages):
+    return [publisher.publish(page) for page in pages]
+
+def _check_picklable(publisher, workers):
+    """Raises a BuildError if the publisher has to be pickled to be sent to worker processes, but
+    cannot be, e.g. because the config holds rules whose classes are defined in the config file.
+    """
+    import multiprocessing
+
+    if _POOL_INITIALIZER and multiprocessing.get_start_method() == 'fork':
+        return  # Forked worker processes inherit the publisher.
+    try:
+        pickle.dumps(publisher)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise BuildError(
+                'Cannot build with {} workers, because the config cannot be sent to worker '
+                'processes ({}: {}). Define its rules in an importable module rather than in the '
+                'config file, or build with a single worker.'.format(workers, type(e).__name__, e))
+
+
+class Watcher(object):
+    """Publishes pages, then re-publishes only the pages whose inputs change.
+
+    The config and the pages are loaded by calling load_config and load_pages, and are loaded again
+    whenever a file at one of reload_paths (e.g. the config file or the manifest) changes, after
+    which every page is published again. Otherwise, each poll only publishes the pages that have an
+    edited, created or removed file among their inputs (see page_inputs). The config's Linker and
+    Jinja Environment are kept between polls, so that only the edited files are parsed again.
+
+    Files are polled for changes by modification time, size and inode number, so that editors that
+    save by replacing files are also detected. Every file under the config's template directories
+    is watched as well, so that pages whose inputs cannot be determined are published again when a
+    template is edited or added; these pages, and pages that failed to publish, are published again
+    after any change.
+
+    Example usage:
+
+        watcher = Watcher(
+                lambda: import_config('config.py'),
+                lambda: load_manifest('manifest.json'),
+                reload_paths=['config.py', 'manifest.json'])
+        watcher.run()
+    """
+    def __init__(self, load_config, load_pages, reload_paths=()):
+        self._load_config = load_config
+        self._load_pages = load_pages
+        self._reload_paths = {os.path.abspath(path) for path in reload_paths}
+        self._config = None
+        self._pages = []
+        self._publisher = None
+        self._inputs = {}  # Maps destinations to the set of paths of their inputs, or None.
+        self._stamps = None  # Maps watched paths to their stamps as of the last poll.
+
+    def poll(self):
+        """Publishes the pages affected by the changes since the last poll. The first poll loads
+        the config and the pages, and publishes every page.
+
+        RETURNS:
+        (list of PageResult, list of str); the results of the pages that were published, and
+        descriptions of the errors that prevented pages (or the config) from being loaded or
+        published.
+        """
+        if self._stamps is None:
+            changed = None
+            self._stamps = self._take_stamps()
+        else:
+            stamps = self._take_stamps()
+            changed = {path for path, stamp in stamps.items() if self._stamps.get(path) != stamp}
+            self._stamps = stamps
+            if not changed:
+                return [], []
+
+        if changed is None or not changed.isdisjoint(self._reload_paths):
+            error = self._reload()
+            if error is not None:
+                return [], [error]
+            affected_pages = self._pages
+            # The template directories of the new config are only watched from now on.
+            self._stamps = self._take_stamps()
+        else:
+            affected_pages = [page for page in self._pages if self._is_affected(page, changed)]
+
+        results = []
+        errors = []
+        for page in affected_pages:
+            inputs, written, seconds, error = self._publisher.publish(page)
+            if error is not None:
+                errors.append('{}: {}'.format(page.destination, error))
+                self._inputs[page.destination] = None
+                continue
+            if inputs is None:
+                self._inputs[page.destination] = None
+            else:
+                files, missing_paths = inputs
+                self._inputs[page.destination] = set(files).union(missing_paths)
+            results.append(PageResult(page, True, written, seconds))
+        # Start watching inputs that were just discovered.
+        for path in self._watched_paths():
+            if path not in self._stamps:
+                self._stamps[path] = _file_stamp(path)
+        return results, errors
+
+    def run(self, interval=None, report=None):
+        """Polls for changes every interval seconds until interrupted.
+
+        PARAMETERS:
+        interval -- float; the number of seconds between the end of a poll and the next one. If
+                    None, DEFAULT_POLL_INTERVAL is used.
+        report   -- function; if given, it is called with the results, errors and duration (in
+                    seconds) of every poll that published pages or found errors.
+        """
+        if interval is None:
+            interval = DEFAULT_POLL_INTERVAL
+        while True:
+            start = time.perf_counter()
+            results, errors = self.poll()
+            if report is not None and (results or errors):
+                report(results, errors, time.perf_counter() - start)
+            time.sleep(interval)
+
+    def _reload(self):
+        """Loads the config and the pages, returning a description of the error that prevented them
+        from being loaded, or None.
+        """
+        try:
+            config = self._load_config()
+            pages = list(self._load_pages())
+        except Exception as e:
+            # The config file is arbitrary Python code, which is likely to be mid-edit.
+            self._config = None
+            self._pages = []
+            self._inputs = {}
+            return 'Could not load the config and pages: {}: {}'.format(type(e).__name__, e)
+        self._config = config
+        self._pages = pages
+        self._inputs = {}
+        self._publisher = _PagePublisher(config, config.jinja_env, None, True)
+        return None
+
+    def _is_affected(self, page, changed):
+        inputs = self._inputs.get(page.destination)
+        return inputs is None or not inputs.isdisjoint(changed)
+
+    def _watched_paths(self):
+        paths = set(self._reload_paths)
+        # Sources are watched even if their pages failed to publish, so that fixing them is noticed.
+        paths.update(os.path.abspath(page.source) for page in self._pages if page.source)
+        for inputs in self._inputs.values():
+            if inputs is not None:
+                paths.update(inputs)
+        if self._config is not None:
+            for template_dir in self._config.template_dirs:
+                for directory, _, filenames in os.walk(template_dir):
+                    paths.update(
+                            os.path.abspath(os.path.join(directory, filename))
+                            for filename in filenames)
+        return paths
+
+    def _take_stamps(self):
+        paths = self._watched_paths()
+        if self._stamps is not None:
+            # Keep watching files that were removed from the template directories.
+            paths.update(self._stamps)
+        return {path: _file_stamp(path) for path in paths}
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class BuildState(object):
+    """The inputs from which each destination was last built.
+
+    The state maps destinations to the page that was published to them, along with a stamp of each
+    input: its modification time (ns), size and content hash, or None for paths that must remain
+    missing. An input whose modification time changed is compared by content hash, so that touching
+    a file without changing it does not cause rebuilds.
+    """
+    def __init__(self, destinations=None):
+        self._destinations = destinations if destinations is not None else {}
+        self._stamps = {}  # Memoizes input stamps, since many pages share inputs.
+
+    @classmethod
+    def load(cls, state_path):
+        """Loads the state saved at state_path. A missing, corrupt or outdated state file results
+        in an empty state, which causes every page to be built.
+        """
+        try:
+            with open(state_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+        if not isinstance(data, dict) or data.get('version') != _STATE_VERSION:
+            return cls()
+        return cls(data['destinations'])
+
+    def save(self, state_path, destinations):
+        """Saves the state of the given destinations to state_path."""
+        data = {
+            'version': _STATE_VERSION,
+            'destinations': {
+                destination: entry for destination, entry in self._destinations.items()
+                if destination in destinations
+            },
+        }
+        import tempfile
+
+        state_dir = os.path.dirname(state_path)
+        if state_dir != '' and not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        # Write to a temporary file first so that an interrupted save does not corrupt the state.
+        fd, temp_path = tempfile.mkstemp(dir=state_dir or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(temp_path, state_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def is_up_to_date(self, page):
+        entry = self._destinations.get(page.destination)
+        if entry is None or entry['page'] != list(page) or entry['inputs'] is None:
+            return False
+        elif not os.path.isfile(page.destination):
+            return False
+        for path, stamp in entry['inputs'].items():
+            if stamp is None:
+                if os.path.exists(path):
+                    return False
+            elif not self._matches(path, stamp):
+                return False
+        return True
+
+    def record(self, page, inputs):
+        """Records the inputs of a page that was just built. inputs is the result of page_inputs."""
+        if inputs is None:
+            stamps = None
+        else:
+            files, missing_paths = inputs
+            stamps = {path: self._stamp(path) for path in files}
+            stamps.update((path, None) for path in missing_paths)
+        self._destinations[page.destination] = {'page': list(page), 'inputs': stamps}
+
+    def forget(self, destination):
+        self._destinations.pop(destination, None)
+
+    def _matches(self, path, stamp):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        mtime, size, digest = stamp
+        if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+            return True
+        elif stat.st_size != size:
+            return False
+        return self._stamp(path)[2] == digest
+
+    def _stamp(self, path):
+        stamp = self._stamps.get(path)
+        if stamp is None:
+            stat = os.stat(path)
+            with open(path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            stamp = [stat.st_mtime_ns, stat.st_size, digest]
+            self._stamps[path] = stamp
+        return stamp
+
+
+class BuildError(TemplarError):
+    pass
+
+_STATE_VERSION = templar.__version__ + '/1'
+DEFAULT_POLL_INTERVAL = 0.05  # In seconds.
+# Whether worker processes can be initialized with the publisher (which needs Python 3.7).
+_POOL_INITIALIZER = sys.version_info >= (3, 7)
@@ -6,8 +6,15 @@ Users can use this module with the following import statement:
     from templar.api import config
 """
 
+from templar.api.rules.compiler_rules import DEFAULT_MARKDOWN_CACHE_SIZE
+from templar.api.rules.compiler_rules import MarkdownCache
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
 from templar.api.rules.core import Rule
+from templar.api.rules.core import RuleIndex
+from templar.api.rules.core import fuse_rules
 from templar.exceptions import TemplarError
+from templar.linker import LinkCache
+from templar.linker import Linker
 
 import importlib.machinery
 import os.path
@@ -21,6 +28,11 @@ class ConfigBuilder(object):
     - preprocess_rules
     - compiler_rules
     - postprocess_rules
+    - cache_dir
+    - resolve_symlinks
+    - template_cache_size
+    - markdown_cache_size
+    - fuse_substitution_rules
 
     Example usage:
 
@@ -38,13 +50,27 @@ class ConfigBuilder(object):
             recursively_evaluate_jinja_expressions=False,
             compiler_rules=None,
             preprocess_rules=None,
-            postprocess_rules=None):
+            postprocess_rules=None,
+            cache_dir=None,
+            resolve_symlinks=True,
+            template_cache_size=None,
+            markdown_cache_size=None,
+            fuse_substitution_rules=False):
         self._template_dirs = list(template_dirs) if template_dirs else []
         self._variables = variables.copy() if variables else {}
         self._recursively_evaluate_jinja_expressions = recursively_evaluate_jinja_expressions
         self._compiler_rules = list(compiler_rules) if compiler_rules else []
         self._preprocess_rules = list(preprocess_rules) if preprocess_rules else []
         self._postprocess_rules = list(postprocess_rules) if postprocess_rules else []
+        self._cache_dir = cache_dir
+        self._resolve_symlinks = resolve_symlinks
+        if template_cache_size is None:
+            template_cache_size = DEFAULT_TEMPLATE_CACHE_SIZE
+        self._template_cache_size = template_cache_size
+        if markdown_cache_size is None:
+            markdown_cache_size = DEFAULT_MARKDOWN_CACHE_SIZE
+        self._markdown_cache_size = markdown_cache_size
+        self._fuse_substitution_rules = fuse_substitution_rules
 
     def add_template_dirs(self, *template_dirs):
         for template_dir in template_dirs:
@@ -146,6 +172,64 @@ class ConfigBuilder(object):
         self._postprocess_rules = []
         return self
 
+    def set_cache_dir(self, cache_dir):
+        """Sets the directory in which Templar persists data between runs (e.g. parsed source files),
+        so that unchanged inputs are not processed again. If cache_dir is None, nothing is cached.
+        The directory is created when it is first written to.
+        """
+        if cache_dir is not None and not isinstance(cache_dir, str):
+            raise ConfigBuilderError(
+                    'cache_dir must be a string or None, but instead was: ' + repr(cache_dir))
+        self._cache_dir = cache_dir
+        return self
+
+    def set_resolve_symlinks(self, resolve_symlinks):
+        """Sets whether the linker resolves symbolic links when deciding if two include tags refer
+        to the same file. By default, symbolic links are resolved.
+        """
+        if not isinstance(resolve_symlinks, bool):
+            raise ConfigBuilderError(
+                    'resolve_symlinks must be a boolean, but instead was: ' + repr(resolve_symlinks))
+        self._resolve_symlinks = resolve_symlinks
+        return self
+
+    def set_template_cache_size(self, template_cache_size):
+        """Sets the maximum number of compiled templates that the Config's Jinja Environment keeps
+        in memory. If template_cache_size is 0, templates are compiled every time they are used.
+        """
+        if not isinstance(template_cache_size, int) or isinstance(template_cache_size, bool) \
+                or template_cache_size < 0:
+            raise ConfigBuilderError(
+                    'template_cache_size must be a non-negative integer, but instead was: ' + \
+                    repr(template_cache_size))
+        self._template_cache_size = template_cache_size
+        return self
+
+    def set_markdown_cache_size(self, markdown_cache_size):
+        """Sets the maximum number of bytes of converted HTML that Templar keeps in cache_dir (see
+        MarkdownToHtmlRule). Once the cache grows larger, the least recently used HTML is removed.
+        """
+        if not isinstance(markdown_cache_size, int) or isinstance(markdown_cache_size, bool) \
+                or markdown_cache_size < 0:
+            raise ConfigBuilderError(
+                    'markdown_cache_size must be a non-negative integer, but instead was: ' + \
+                    repr(markdown_cache_size))
+        self._markdown_cache_size = markdown_cache_size
+        return self
+
+    def set_fuse_substitution_rules(self, fuse_substitution_rules):
+        """Sets whether consecutive SubstitutionRules that apply to a page are applied in one pass
+        over its content instead of one pass per rule (see core.FusedSubstitutionRule). Only enable
+        this if no rule's replacements are meant to be transformed by later rules. By default, rules
+        are not fused.
+        """
+        if not isinstance(fuse_substitution_rules, bool):
+            raise ConfigBuilderError(
+                    'fuse_substitution_rules must be a boolean, but instead was: ' + \
+                    repr(fuse_substitution_rules))
+        self._fuse_substitution_rules = fuse_substitution_rules
+        return self
+
     def build(self):
         return Config(
                 self._template_dirs,
@@ -153,13 +237,21 @@ class ConfigBuilder(object):
                 self._recursively_evaluate_jinja_expressions,
                 self._compiler_rules,
                 self._preprocess_rules,
-                self._postprocess_rules)
+                self._postprocess_rules,
+                self._cache_dir,
+                self._resolve_symlinks,
+                self._template_cache_size,
+                self._markdown_cache_size,
+                self._fuse_substitution_rules)
 
 
 class Config(object):
     """An immutable Templar configuration.
 
     A Config object should not be created directly. Instead, use ConfigBuilder.
+
+    Although its settings cannot change, a Config lazily creates objects that are shared by every
+    publish that uses it (such as its Linker), so that work can be reused across publishes.
     """
     def __init__(self,
             template_dirs,
@@ -167,13 +259,30 @@ class Config(object):
             recursively_evaluate_jinja_expressions,
             compiler_rules,
             preprocess_rules,
-            postprocess_rules):
+            postprocess_rules,
+            cache_dir,
+            resolve_symlinks,
+            template_cache_size,
+            markdown_cache_size,
+            fuse_substitution_rules):
         self._template_dirs = template_dirs
         self._variables = variables
         self._recursively_evaluate_jinja_expressions = recursively_evaluate_jinja_expressions
         self._compiler_rules = compiler_rules
         self._preprocess_rules = preprocess_rules
         self._postprocess_rules = postprocess_rules
+        self._cache_dir = cache_dir
+        self._resolve_symlinks = resolve_symlinks
+        self._template_cache_size = template_cache_size
+        self._markdown_cache_size = markdown_cache_size
+        self._fuse_substitution_rules = fuse_substitution_rules
+        # Created lazily, and not pickled (see __getstate__).
+        self._linker = None
+        self._jinja_env = None
+        self._markdown_cache = None
+        self._rule_index = None
+        self._applicable_rules = {}  # Maps (src, dst) to the rules that apply to them.
+        self._fused_rules = {}  # Maps runs of rules to the FusedSubstitutionRules that fuse them.
 
     @property
     def template_dirs(self):
@@ -203,6 +312,115 @@ class Config(object):
     def rules(self):
         return self._preprocess_rules + self._compiler_rules + self._postprocess_rules
 
+    def applicable_rules(self, src, dst):
+        """Returns the rules that apply to the src and dst paths (see Rule.applies), in the order
+        of rules. The rules are selected with a RuleIndex, so that not every rule is checked, and
+        only the first time a pair of paths is given, since a Config is often used to publish the
+        same pages many times. If fuse_substitution_rules is set, consecutive SubstitutionRules are
+        returned as FusedSubstitutionRules. If cache_dir is set, MarkdownToHtmlRules without a cache
+        of their own are returned as copies that use markdown_cache.
+        """
+        key = (src, dst)
+        rules = self._applicable_rules.get(key)
+        if rules is None:
+            if self._rule_index is None:
+                self._rule_index = RuleIndex(self._rules_with_markdown_cache())
+            rules = self._rule_index.applicable_rules(src, dst)
+            if self._fuse_substitution_rules:
+                rules = fuse_rules(rules, self._fused_rules)
+            rules = tuple(rules)
+            self._applicable_rules[key] = rules
+        return rules
+
+    def _rules_with_markdown_cache(self):
+        rules = self.rules
+        cache = self.markdown_cache
+        if cache is None:
+            return rules
+        # The copies are made once, when the RuleIndex is built, rather than on every publish.
+        return [
+            rule.with_cache(cache)
+                if isinstance(rule, MarkdownToHtmlRule) and rule.cache is None else rule
+            for rule in rules
+        ]
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def resolve_symlinks(self):
+        return self._resolve_symlinks
+
+    @property
+    def template_cache_size(self):
+        return self._template_cache_size
+
+    @property
+    def markdown_cache_size(self):
+        return self._markdown_cache_size
+
+    @property
+    def fuse_substitution_rules(self):
+        return self._fuse_substitution_rules
+
+    @property
+    def linker(self):
+        """The Linker used to link sources published with this Config. If cache_dir is set, the
+        Linker persists parsed files in a subdirectory of it.
+        """
+        if self._linker is None:
+            if self._cache_dir:
+                cache = LinkCache(os.path.join(self._cache_dir, LINK_CACHE_DIR))
+            else:
+                cache = None
+            self._linker = Linker(cache, self._resolve_symlinks)
+        return self._linker
+
+    @property
+    def jinja_env(self):
+        """The Jinja2 Environment used to render templates published with this Config. It loads
+        templates from template_dirs and keeps up to template_cache_size compiled templates in
+        memory. If cache_dir is set, compiled templates are also persisted in a subdirectory of it.
+        """
+        if self._jinja_env is None:
+            import jinja2  # Publishing without templates never needs Jinja.
+
+            if self._cache_dir:
+                bytecode_cache_dir = os.path.join(self._cache_dir, JINJA_CACHE_DIR)
+                os.makedirs(bytecode_cache_dir, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+            else:
+                bytecode_cache = None
+            self._jinja_env = jinja2.Environment(
+                    loader=jinja2.FileSystemLoader(self._template_dirs),
+                    cache_size=self._template_cache_size,
+                    bytecode_cache=bytecode_cache)
+        return self._jinja_env
+
+    @property
+    def markdown_cache(self):
+        """The MarkdownCache in which MarkdownToHtmlRules persist converted HTML when publishing with
+        this Config, or None if cache_dir is not set.
+        """
+        if self._markdown_cache is None and self._cache_dir:
+            self._markdown_cache = MarkdownCache(
+                    os.path.join(self._cache_dir, MARKDOWN_CACHE_DIR),
+                    self._markdown_cache_size)
+        return self._markdown_cache
+
+    def __getstate__(self):
+        # The Linker, Jinja Environment, MarkdownCache, RuleIndex, applicable rules and fused rules
+        # only hold caches, which are recreated when needed.
+        state = self.__dict__.copy()
+        state['_linker'] = None
+        state['_jinja_env'] = None
+        state['_markdown_cache'] = None
+        state['_rule_index'] = None
+        state['_applicable_rules'] = {}
+        state['_fused_rules'] = {}
+        return state
+
     def to_builder(self):
         return ConfigBuilder(
                 self._template_dirs,
@@ -210,7 +428,12 @@ class Config(object):
                 self._recursively_evaluate_jinja_expressions,
                 self._compiler_rules,
                 self._preprocess_rules,
-                self._postprocess_rules)
+                self._postprocess_rules,
+                self._cache_dir,
+                self._resolve_symlinks,
+                self._template_cache_size,
+                self._markdown_cache_size,
+                self._fuse_substitution_rules)
 
 
 def import_config(config_path):
@@ -236,3 +459,8 @@ def import_config(config_path):
 class ConfigBuilderError(TemplarError):
     pass
 
+DEFAULT_TEMPLATE_CACHE_SIZE = 400  # The default of jinja2.Environment.
+LINK_CACHE_DIR = 'linker'  # Subdirectory of cache_dir for the linker's cache.
+JINJA_CACHE_DIR = 'jinja'  # Subdirectory of cache_dir for compiled Jinja templates.
+MARKDOWN_CACHE_DIR = 'markdown'  # Subdirectory of cache_dir for HTML converted from Markdown.
+
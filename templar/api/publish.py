@@ -6,16 +6,22 @@ Users can use this module with the following import statement:
     from templar.api import publish
 """
 
+from templar import lazy
 from templar import linker
 from templar.api.config import Config
 from templar.api.rules.core import VariableRule
 from templar.exceptions import TemplarError
 
-import jinja2
+from collections import namedtuple
+import functools
+import hashlib
+import itertools
 import os
-import re
+import random
+import shutil
 
-def publish(config, source=None, template=None, destination=None, jinja_env=None, no_write=False):
+def publish(config, source=None, template=None, destination=None, jinja_env=None, no_write=False,
+        stream=False):
     """Given a config, performs an end-to-end publishing pipeline and returns the result:
 
         linking -> compiling -> templating -> writing
@@ -35,14 +41,22 @@ def publish(config, source=None, template=None, destination=None, jinja_env=None
 
                    If template is None, the publisher effectively becomes a linker and compiler.
     destination -- str; path for the destination file.
-    jinja_env   -- jinja2.Environment; if None, a Jinja2 Environment is created with a
-                   FileSystemLoader that is configured with config.template_dirs. Otherwise, the
+    jinja_env   -- jinja2.Environment; if None, the config's Jinja2 Environment (which is configured
+                   with config.template_dirs, and reused across publishes) is used. Otherwise, the
                    given Jinja2 Environment is used to retrieve and render the template.
     no_write    -- bool; if True, the result is not written to a file or printed. If False and
-                   destination is provided, the result is written to the provided destination file.
+                   destination is provided, the result is written to the provided destination file,
+                   encoded as UTF-8. The result is written to a temporary file that then replaces
+                   the destination file, unless the destination file already holds the same result,
+                   in which case it is left untouched.
+    stream      -- bool; if True, the template is rendered in chunks that are written to the
+                   destination file as they are rendered, so that the whole result is never held in
+                   memory (unless Jinja expressions are evaluated recursively, which needs the whole
+                   result). Requires a destination, and cannot be used with no_write.
 
     RETURNS:
-    str; the result of the publishing pipeline.
+    str; the result of the publishing pipeline, or if stream is True, a WriteResult that holds the
+    SHA-1 hex digest of the UTF-8 encoded result and whether the destination file was written.
     """
     if not isinstance(config, Config):
         raise PublishError(
@@ -51,61 +65,229 @@ def publish(config, source=None, template=None, destination=None, jinja_env=None
 
     if source is None and template is None:
         raise PublishError('When publishing, source and template cannot both be omitted.')
+    if stream and (no_write or not destination):
+        raise PublishError('When streaming, a destination is required and no_write must be False.')
 
     variables = config.variables
     if source:
-        # Linking stage.
-        all_block, extracted_variables = linker.link(source)
+        # Linking stage. The config's Linker reuses files linked by previous publishes.
+        all_block, extracted_variables = config.linker.link(source)
         variables.update(extracted_variables)
 
-        # Compiling stage.
-        block_variables = {}
-        for rule in config.rules:
-            if rule.applies(source, destination):
-                if isinstance(rule, VariableRule):
-                    variables.update(rule.apply(str(all_block)))
-                else:
-                    all_block.apply_rule(rule)
-        block_variables.update(linker.get_block_dict(all_block))
-        variables['blocks'] = block_variables   # Blocks are namespaced with 'blocks'.
+        # Compiling stage. Rules that transform the content are applied together, in one traversal
+        # of the blocks, up to the next VariableRule; only VariableRules need the joined content.
+        pending_rules = []
+        for rule in config.applicable_rules(source, destination):
+            if isinstance(rule, VariableRule):
+                all_block.apply_rules(pending_rules)
+                pending_rules = []
+                variables.update(rule.apply(str(all_block)))
+            else:
+                pending_rules.append(rule)
+        all_block.apply_rules(pending_rules)
+        # Blocks are namespaced with 'blocks', and only joined if the template uses them.
+        variables['blocks'] = linker.get_block_dict(all_block)
 
     # Templating stage.
     if template:
         if not jinja_env:
-            jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader(config.template_dirs))
+            jinja_env = config.jinja_env
         jinja_template = jinja_env.get_template(template)
+        if stream and not config.recursively_evaluate_jinja_expressions:
+            return _write_chunks(destination, jinja_template.generate(variables))
         result = jinja_template.render(variables)
 
         # Handle recursive evaluation of Jinja expressions.
-        iterations = 0
-        while config.recursively_evaluate_jinja_expressions \
-                and iterations < _MAX_JINJA_RECURSIVE_DEPTH + 1 \
-                and  _jinja_expression_re.search(result):
-            if iterations == _MAX_JINJA_RECURSIVE_DEPTH:
-                raise PublishError('\n'.join([
-                    'Recursive Jinja expression evaluation exceeded the allowed '
-                        'number of iterations. Last state of template:',
-                    result]))
-            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'intermediate': result}))
-            jinja_template = jinja_env.get_template('intermediate')
-            result = jinja_template.render(variables)
-            iterations += 1
+        if config.recursively_evaluate_jinja_expressions:
+            result = _recursively_evaluate_jinja_expressions(result, variables)
     else:
         # template is None implies source is not None, so variables['blocks'] must exist.
         result = variables['blocks']['all']
 
     # Writing stage.
-    if not no_write and destination:
-        destination_dir = os.path.dirname(destination)
-        if destination_dir != '' and not os.path.isdir(destination_dir):
-            os.makedirs(destination_dir)
-        with open(destination, 'w') as f:
-            f.write(result)
+    if stream:
+        return _write_text(destination, result)
+    elif not no_write and destination:
+        _write_text(destination, result)
     return result
 
 
+# The outcome of writing a page. digest is the SHA-1 hex digest of the page's UTF-8 encoding, and
+# written is False if the destination already held exactly that content and was left untouched.
+WriteResult = namedtuple('WriteResult', ['digest', 'written'])
+
+def _write_text(destination, text):
+    """Writes text to destination (see _write_chunks). If destination already holds the same
+    content, nothing is written at all.
+
+    RETURNS:
+    WriteResult
+    """
+    data = text.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()
+    if _file_matches(destination, len(data), digest):
+        return WriteResult(digest, False)
+    _replace_file(destination, _write_temp_file(destination, [data]))
+    return WriteResult(digest, True)
+
+
+def _write_chunks(destination, chunks):
+    """Writes the chunks (an iterable of str) to destination as UTF-8, unless destination already
+    holds the same content, in which case it is left untouched (along with its modification time).
+
+    The chunks are written to a temporary file next to destination, which then replaces destination,
+    so that readers never see a partially written file. The temporary file is created with open
+    rather than tempfile, so that it gets the same permissions as a newly created destination, and
+    gets the permissions of destination instead if it already exists. Unlike writing destination in
+    place, replacing it does not keep its owner.
+
+    RETURNS:
+    WriteResult
+    """
+    digest = hashlib.sha1()
+    sizes = []
+
+    def encode_batches():
+        # Jinja renders many small chunks, which are joined and written in batches.
+        remaining = iter(chunks)
+        batch = list(itertools.islice(remaining, _WRITE_BATCH_SIZE))
+        while batch:
+            data = ''.join(batch).encode('utf-8')
+            digest.update(data)
+            sizes.append(len(data))
+            yield data
+            batch = list(itertools.islice(remaining, _WRITE_BATCH_SIZE))
+
+    temp_path = _write_temp_file(destination, encode_batches())
+    if _file_matches(destination, sum(sizes), digest.hexdigest()):
+        os.remove(temp_path)
+        return WriteResult(digest.hexdigest(), False)
+    _replace_file(destination, temp_path)
+    return WriteResult(digest.hexdigest(), True)
+
+
+def _write_temp_file(destination, blocks):
+    """Writes the blocks (an iterable of bytes) to a new temporary file next to destination.
+
+    RETURNS:
+    str; the path of the temporary file.
+    """
+    destination_dir = os.path.dirname(destination)
+    if destination_dir != '':
+        # Other processes of a parallel build may create the same directory at the same time.
+        os.makedirs(destination_dir, exist_ok=True)
+    temp_path = '{}.{:08x}.tmp'.format(destination, random.getrandbits(32))
+    f = open(temp_path, 'xb')
+    try:
+        with f:
+            for block in blocks:
+                f.write(block)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def _replace_file(destination, temp_path):
+    """Replaces destination with the temporary file at temp_path, keeping the permissions of
+    destination if it exists.
+    """
+    try:
+        try:
+            shutil.copymode(destination, temp_path)
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, destination)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _file_matches(path, size, digest):
+    """Returns True if the file at path has the given size and SHA-1 hex digest. The file is only
+    read if its size matches.
+    """
+    try:
+        if os.stat(path).st_size != size:
+            return False
+        file_digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(_READ_BLOCK_SIZE), b''):
+                file_digest.update(block)
+    except OSError:
+        return False
+    return file_digest.hexdigest() == digest
+
+
+def _recursively_evaluate_jinja_expressions(result, variables):
+    """Renders result as a Jinja template, repeatedly, until it no longer contains Jinja expressions.
+
+    Where possible, only the spans of result that contain expressions are rendered, and compiled
+    spans are reused across renders. If result also contains statements, comments, carriage returns
+    or whitespace control, all of result is rendered instead, since rendering spans would treat
+    those differently. Rendering stops early if it no longer changes result.
+    """
+    for _ in range(_MAX_JINJA_RECURSIVE_DEPTH):
+        expressions = list(_jinja_expression_re.finditer(result))
+        if not expressions:
+            return result
+        if _can_render_expressions_only(result, expressions):
+            pieces = []
+            end = 0
+            for match in expressions:
+                pieces.append(result[end:match.start()])
+                pieces.append(_compile_jinja_fragment(match.group(0)).render(variables))
+                end = match.end()
+            # Rendering all of result would strip a single trailing newline from its text.
+            tail = result[end:]
+            pieces.append(tail[:-1] if tail.endswith('\n') else tail)
+            rendered = ''.join(pieces)
+        else:
+            rendered = _jinja_fragment_env().from_string(result).render(variables)
+        if rendered == result:
+            break  # Rendering again would not change anything.
+        result = rendered
+    else:
+        if not _jinja_expression_re.search(result):
+            return result
+    raise PublishError('\n'.join([
+        'Recursive Jinja expression evaluation exceeded the allowed '
+            'number of iterations. Last state of template:',
+        result]))
+
+
+def _can_render_expressions_only(result, expressions):
+    """Returns True if rendering only the expressions matched in result is equivalent to rendering
+    all of result.
+    """
+    if '{%' in result or '{#' in result or '\r' in result:
+        return False
+    if '{{-' in result or '-}}' in result:
+        return False  # Whitespace control strips text around expressions.
+    # Every expression must be matched; expressions that span lines are not.
+    return result.count('{{') == sum(match.group(0).count('{{') for match in expressions)
+
+
+@functools.lru_cache(maxsize=None)
+def _jinja_fragment_env():
+    """Returns the Environment that renders intermediate results of recursive Jinja expression
+    evaluation. It is created when first needed, so that publishing without templates does not
+    import jinja2.
+    """
+    import jinja2
+    return jinja2.Environment()
+
+@functools.lru_cache(maxsize=1024)
+def _compile_jinja_fragment(fragment):
+    # Compiled fragments are memoized, since the same expressions tend to appear in many pages.
+    return _jinja_fragment_env().from_string(fragment)
+
+
 class PublishError(TemplarError):
     pass
 
-_jinja_expression_re = re.compile(r'\{\{.*\}\}')
+_jinja_expression_re = lazy.compile(r'\{\{.*\}\}')
 _MAX_JINJA_RECURSIVE_DEPTH = 10
+_WRITE_BATCH_SIZE = 1024  # Number of streamed chunks that are written at a time.
+_READ_BLOCK_SIZE = 64 * 1024  # Bytes read at a time when comparing a destination file.
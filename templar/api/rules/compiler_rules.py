@@ -1,11 +1,157 @@
 from templar import markdown
 from templar.api.rules import core
+import templar
+
+import copy
+import hashlib
+import os
 
 class MarkdownToHtmlRule(core.Rule):
-    def __init__(self, src=r'\.md', dst=r'\.html'):
+    """Converts Markdown content into HTML with the given markdown engine.
+
+    If cache is a MarkdownCache, HTML that was converted before (by this or any previous run) is
+    read from the cache instead of being converted again.
+    """
+    def __init__(self, src=r'\.md', dst=r'\.html', engine=markdown.REGEX_ENGINE, cache=None):
         super().__init__(src, dst)
+        self.engine = engine
+        self.cache = cache
 
     def apply(self, content):
+        if self.cache is not None:
+            html = self.cache.get(self.engine, content)
+            if html is None:
+                html = self._convert(content)
+                self.cache.put(self.engine, content, html)
+            return html
+        return self._convert(content)
+
+    def with_cache(self, cache):
+        """Returns a copy of this rule that uses the given MarkdownCache. The copy is shallow, so it
+        keeps the behaviour of subclasses, and shares the compiled patterns of this rule.
+        """
+        rule = copy.copy(self)
+        rule.cache = cache
+        return rule
+
+    def _convert(self, content):
         # TODO(wualbert): rewrite markdown parser, or use a library.
-        return markdown.convert(content)
+        return markdown.convert(content, self.engine)
+
+
+class MarkdownCache(object):
+    """A persistent, on-disk cache of HTML converted from Markdown.
+
+    Each entry is a file in cache_dir that is named after a hash of the Markdown it was converted
+    from, the markdown engine and the Templar version, so entries never need to be invalidated: a
+    change to any of them simply results in a different entry. Once the entries take up more than
+    max_size bytes, the least recently used entries (by modification time, which is updated when an
+    entry is read) are removed.
+
+    Example usage:
+
+        rule = MarkdownToHtmlRule(cache=MarkdownCache('.templar-cache/markdown'))
+    """
+    def __init__(self, cache_dir, max_size=None):
+        self._cache_dir = cache_dir
+        if max_size is None:
+            max_size = DEFAULT_MARKDOWN_CACHE_SIZE
+        self._max_size = max_size
+        self._size = None  # Total size of the entries, which is computed when first needed.
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def get(self, engine, content):
+        """Returns the HTML converted from content by engine, or None if the cache holds no entry."""
+        entry_path = self._entry_path(engine, content)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            os.utime(entry_path)  # Mark the entry as recently used.
+        except OSError:
+            # Missing entries, and entries that were evicted by another process, are cache misses.
+            self.misses += 1
+            return None
+        self.hits += 1
+        return html
+
+    def put(self, engine, content, html):
+        """Stores the HTML converted from content by engine, then evicts entries if the cache has
+        grown larger than max_size.
+        """
+        import tempfile  # Deferred until the first entry is written.
+
+        data = html.encode('utf-8')
+        if len(data) > self._max_size:
+            return
+        entry_path = self._entry_path(engine, content)
+        if os.path.exists(entry_path):
+            # Entries are named after the content they were converted from, so an existing entry
+            # (e.g. one stored by another process) already holds html and is counted in the size.
+            return
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, entry_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data)
+        if self._size > self._max_size:
+            self._evict()
+
+    def _evict(self):
+        # Evict down to a fraction of max_size, so that the entries are not listed on every put
+        # once the cache is full.
+        target_size = self._max_size * _EVICTION_TARGET
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass  # Already evicted by another process.
+            self._size -= size
+
+    def _entries(self):
+        """Yields the (modification time, size, path) of every entry in the cache."""
+        try:
+            names = os.listdir(self._cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(_ENTRY_SUFFIX):
+                continue
+            entry_path = os.path.join(self._cache_dir, name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            yield stat.st_mtime_ns, stat.st_size, entry_path
+
+    def _entry_path(self, engine, content):
+        key = hashlib.sha1('{}\0{}\0'.format(_CACHE_VERSION, engine).encode('utf-8'))
+        key.update(content.encode('utf-8'))
+        return os.path.join(self._cache_dir, key.hexdigest() + _ENTRY_SUFFIX)
+
 
+DEFAULT_MARKDOWN_CACHE_SIZE = 64 * 1024 * 1024  # In bytes.
+_CACHE_VERSION = (templar.__version__, 1)
+_ENTRY_SUFFIX = '.html'
+_EVICTION_TARGET = 0.75  # Fraction of max_size that eviction shrinks the cache to.
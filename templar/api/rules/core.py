@@ -8,6 +8,8 @@ Users can use this module with the following import statement:
 
 from templar.exceptions import TemplarError
 
+from collections import Counter
+from collections import defaultdict
 import re
 
 
@@ -17,6 +19,8 @@ class Rule:
 
     When constructing a rule, the arguments `src` and `dst` are regular expressions; Templar will
     only apply a rule if the source and destination of the publishing pipeline match the regexes.
+    The regexes are compiled when the rule is constructed, and whether the rule applies is
+    remembered for each pair of source and destination paths.
     """
     def __init__(self, src=None, dst=None):
         if src is not None and not isinstance(src, str):
@@ -29,6 +33,9 @@ class Rule:
                     "but was type '{}'".format(type(src).__name__))
         self._src_pattern = src
         self._dst_pattern = dst
+        self._src_regex = _compile_path_pattern(src, 'source')
+        self._dst_regex = _compile_path_pattern(dst, 'destination')
+        self._applies_cache = {}  # Maps (src, dst) to whether this rule applies.
 
     def applies(self, src, dst):
         """Checks if this rule applies to the given src and dst paths, based on the src pattern and
@@ -36,11 +43,17 @@ class Rule:
 
         If src pattern was None, this rule will apply to any given src path (same for dst).
         """
-        if self._src_pattern and (src is None or re.search(self._src_pattern, src) is None):
-            return False
-        elif self._dst_pattern and (dst is None or re.search(self._dst_pattern, dst) is None):
-            return False
-        return True
+        key = (src, dst)
+        applies = self._applies_cache.get(key)
+        if applies is None:
+            if self._src_regex and (src is None or self._src_regex.search(src) is None):
+                applies = False
+            elif self._dst_regex and (dst is None or self._dst_regex.search(dst) is None):
+                applies = False
+            else:
+                applies = True
+            self._applies_cache[key] = applies
+        return applies
 
     def apply(self, content):
         """Applies this rule to the given content. A rule can do one or more of the following:
@@ -53,6 +66,20 @@ class Rule:
         raise NotImplementedError
 
 
+def _compile_path_pattern(pattern, kind):
+    """Compiles a Rule's source or destination pattern. Empty patterns, like None, match any path,
+    so None is returned for them.
+    """
+    if not pattern:
+        return None
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise InvalidRule(
+                "Rule's {} pattern is not a valid regular expression: {!r} ({})".format(
+                    kind, pattern, e))
+
+
 class SubstitutionRule(Rule):
     """An abstract class that represents a rule that transforms the content that is being processed,
     based on a regex pattern and a substitution function. The substitution behaves exactly like
@@ -101,5 +128,347 @@ class VariableRule(Rule):
         return variables
 
 
+def fuse_rules(rules, cache=None):
+    """Returns rules with each run of two or more consecutive SubstitutionRules that can be fused
+    replaced by a single FusedSubstitutionRule. Other rules are returned unchanged and in order.
+
+    PARAMETERS:
+    rules -- list of Rules; the rules to fuse.
+    cache -- dict; if given, maps tuples of rules to the FusedSubstitutionRules that fuse them, so
+             that a run of rules shared by many calls is only fused (and compiled) once.
+
+    RETURNS:
+    list of Rules; the fused rules.
+    """
+    if cache is None:
+        cache = {}
+    fused = []
+    run = []
+    for rule in rules:
+        if _can_fuse(rule):
+            run.append(rule)
+            continue
+        fused.extend(_fuse_run(run, cache))
+        run = []
+        fused.append(rule)
+    fused.extend(_fuse_run(run, cache))
+    return fused
+
+
+def _fuse_run(run, cache):
+    if len(run) < 2:
+        return run
+    key = tuple(run)
+    if key not in cache:
+        cache[key] = FusedSubstitutionRule(run)
+    return [cache[key]]
+
+
+class FusedSubstitutionRule(Rule):
+    """Applies a sequence of SubstitutionRules in one pass over the content, instead of one pass per
+    rule, by searching for an alternation of their patterns and passing each match to the
+    substitute method of the rule whose pattern matched.
+
+    The result is the same as applying the rules one at a time, in order, as long as the rules are
+    independent: no replacement may form a match of a later rule, alone or with the text around it.
+    Only rules whose patterns look at nothing but the text they match can be fused (see
+    fuse_rules), and the rules are applied one at a time instead if, for the content at hand:
+
+    - a pattern matches the empty string;
+    - the match of a rule overlaps the match of an earlier rule, which would be replaced first;
+    - two matches are adjacent, so that their replacements may form a match together;
+    - a pattern matches the fused result, e.g. because a replacement contains text that a later
+      rule would replace.
+
+    A replacement that forms a match with text that a later rule replaces is not detected, which
+    is why fusing is opt-in (see ConfigBuilder.set_fuse_substitution_rules).
+    """
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = tuple(rules)
+        self._regexes = []
+        branches = []
+        for i, rule in enumerate(self.rules):
+            regex = _substitution_regex(rule)
+            self._regexes.append(regex)
+            flags = ''.join(flag for flag, value in _SCOPED_FLAGS if regex.flags & value)
+            # The empty group that follows each pattern is the last group to close when the pattern
+            # matches, so it identifies the rule. Unlike a group around the pattern, it lets the
+            # regex compiler factor out literal prefixes shared by the patterns.
+            branches.append('(?{}:{})(?P<_{}>)'.format(flags, regex.pattern, i))
+        self._regex = re.compile('|'.join(branches))
+        # Maps the index of the group that follows each rule's pattern to the rule's position.
+        self._branches = {index: int(name[1:]) for name, index in self._regex.groupindex.items()}
+
+    def apply(self, content):
+        result = self._apply_fused(content)
+        if result is None:
+            result = content
+            for rule in self.rules:
+                result = rule.apply(result)
+        return result
+
+    def _apply_fused(self, content):
+        """Returns the content with every rule applied in one pass, or None if the rules might
+        interact on this content.
+        """
+        pieces = []
+        last = 0
+        match = self._regex.search(content)
+        while match is not None:
+            start, end = match.span()
+            if start == end or (start == last and pieces):
+                return None
+            branch = self._branches[match.lastindex]
+            # Find the next match, checking that no earlier rule matches inside this one. Later
+            # rules (and this rule) may, since this match is replaced before they are applied.
+            following = self._regex.search(content, start + 1)
+            while following is not None and following.start() < end:
+                if self._branches[following.lastindex] < branch:
+                    return None
+                following = self._regex.search(content, following.start() + 1)
+            rule_match = self._regexes[branch].match(content, start)
+            pieces.append(content[last:start])
+            pieces.append(self.rules[branch].substitute(rule_match))
+            last = end
+            match = following
+        if not pieces:
+            return content
+        pieces.append(content[last:])
+        result = ''.join(pieces)
+        if self._regex.search(result) is not None:
+            return None
+        return result
+
+
+def _can_fuse(rule):
+    """Checks if rule is a SubstitutionRule whose pattern only depends on the text it matches, so
+    that whether it matches somewhere is unaffected by replacing text around it.
+    """
+    if not isinstance(rule, SubstitutionRule) or type(rule).apply is not SubstitutionRule.apply \
+            or type(rule).substitute is SubstitutionRule.substitute:
+        return False
+    try:
+        regex = _substitution_regex(rule)
+    except (re.error, TypeError):
+        return False
+    if not isinstance(regex.pattern, str) or regex.flags & ~_FUSABLE_FLAGS:
+        return False
+    return _is_context_free(regex.pattern)
+
+
+def _substitution_regex(rule):
+    if isinstance(rule.pattern, str):
+        return re.compile(rule.pattern)
+    elif isinstance(rule.pattern, _PATTERN_TYPE):
+        return rule.pattern
+    raise TypeError('{} is not a regular expression'.format(type(rule.pattern).__name__))
+
+
+def _is_context_free(pattern):
+    """Checks that the regular expression pattern has no anchors, word boundaries, lookarounds,
+    backreferences, named groups, conditionals or global inline flags.
+    """
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped in ('b', 'B', 'A', 'Z', 'g') or escaped.isdigit():
+                return False
+            i += 2
+        elif char == '[':
+            # Skip the character class, whose first character may be a literal ']'.
+            i += 1
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif char in '^$':
+            return False
+        elif pattern.startswith('(?', i):
+            if not re.match(r'\(\?(:|[aiLmsux-]+:|>)', pattern[i:]):
+                return False
+            i += 2
+        else:
+            i += 1
+    return True
+
+
+class RuleIndex(object):
+    """Selects the rules that apply to a pair of paths without checking every rule, which matters
+    for configs with hundreds of rules.
+
+    Each rule is filed under one of its patterns: its src pattern if it has one, otherwise its dst
+    pattern. Patterns are indexed by a trigram (three-character substring) of a literal that every
+    match of the pattern must contain, so that only the patterns that share a trigram with a path
+    are searched for in it. Patterns without such a literal (e.g. 'md|txt'), rules without patterns,
+    and rules that override Rule.applies are checked for every pair of paths.
+    """
+    def __init__(self, rules):
+        self._rules = list(rules)
+        self._custom = set()  # Positions of rules that override Rule.applies.
+        self._unconditional = []  # Positions of rules without patterns, and of custom rules.
+        self._by_src_pattern = defaultdict(list)  # Maps src patterns to positions of rules.
+        self._by_dst_pattern = defaultdict(list)  # Likewise for rules without src patterns.
+        src_regexes = {}
+        dst_regexes = {}
+        for position, rule in enumerate(self._rules):
+            if type(rule).applies is not Rule.applies or not hasattr(rule, '_src_regex'):
+                self._custom.add(position)
+                self._unconditional.append(position)
+                continue
+            if rule._src_regex is not None:
+                self._by_src_pattern[rule._src_pattern].append(position)
+                src_regexes[rule._src_pattern] = rule._src_regex
+            elif rule._dst_regex is not None:
+                self._by_dst_pattern[rule._dst_pattern].append(position)
+            else:
+                self._unconditional.append(position)
+            if rule._dst_regex is not None:
+                dst_regexes[rule._dst_pattern] = rule._dst_regex
+        self._src_patterns = _PatternIndex(src_regexes)
+        self._dst_patterns = _PatternIndex(dst_regexes)
+
+    def applicable_rules(self, src, dst):
+        """Returns the rules that apply to the src and dst paths, in the order that they were
+        given.
+        """
+        src_matches = self._src_patterns.matching(src)
+        dst_matches = self._dst_patterns.matching(dst)
+        positions = list(self._unconditional)
+        for pattern in src_matches:
+            positions.extend(self._by_src_pattern[pattern])
+        for pattern in dst_matches:
+            positions.extend(self._by_dst_pattern.get(pattern, ()))
+        positions.sort()
+        rules = []
+        for position in positions:
+            rule = self._rules[position]
+            if position in self._custom:
+                if rule.applies(src, dst):
+                    rules.append(rule)
+            elif rule._dst_regex is None or rule._dst_pattern in dst_matches:
+                rules.append(rule)
+        return rules
+
+
+class _PatternIndex(object):
+    """Finds which of a set of regular expressions match a path (see RuleIndex)."""
+    def __init__(self, regexes):
+        self._regexes = regexes  # Maps patterns to their compiled regexes.
+        self._unindexed = []
+        self._by_trigram = defaultdict(list)
+        trigrams = {pattern: _trigrams(_required_literals(pattern)) for pattern in regexes}
+        counts = Counter(trigram for pattern_trigrams in trigrams.values()
+                         for trigram in pattern_trigrams)
+        for pattern, pattern_trigrams in trigrams.items():
+            if pattern_trigrams:
+                # File the pattern under its rarest trigram, so that it is searched for as rarely as
+                # possible.
+                rarest = min(pattern_trigrams, key=lambda trigram: (counts[trigram], trigram))
+                self._by_trigram[rarest].append(pattern)
+            else:
+                self._unindexed.append(pattern)
+
+    def matching(self, path):
+        """Returns the set of patterns that are found in path, which may be None."""
+        matches = set()
+        if path is None:
+            return matches
+        candidates = list(self._unindexed)
+        for trigram in _trigrams([path]):
+            candidates.extend(self._by_trigram.get(trigram, ()))
+        for pattern in candidates:
+            if self._regexes[pattern].search(path) is not None:
+                matches.add(pattern)
+        return matches
+
+
+def _trigrams(strings):
+    return {string[i:i + 3] for string in strings for i in range(len(string) - 2)}
+
+
+def _required_literals(pattern):
+    """Returns literal strings that every match of the regular expression pattern contains.
+
+    The result is conservative: only characters outside of groups and character classes are
+    considered, and patterns that use alternation outside of groups or inline flags have no
+    required literals.
+    """
+    if re.search(r'\(\?[aiLmsux-]', pattern):
+        return []
+    literals = []
+    run = []
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == '\\':
+            escaped = pattern[i:i + 1]
+            i += 1
+            if escaped and not escaped.isalnum():
+                if depth == 0:
+                    run.append(escaped)
+                continue
+            # Skip the arguments of escapes, which are not literals themselves.
+            if escaped in _ESCAPE_ARGUMENT_LENGTHS:
+                i += _ESCAPE_ARGUMENT_LENGTHS[escaped]
+            elif escaped == 'N' and pattern[i:i + 1] == '{':
+                closing = pattern.find('}', i)
+                i = len(pattern) if closing == -1 else closing + 1
+            elif escaped.isdigit():
+                # Octal escapes and group references take at most two more digits.
+                end = min(i + 2, len(pattern))
+                while i < end and pattern[i].isdigit():
+                    i += 1
+        elif char == '[':
+            # Skip the character class, whose first character may be a literal ']'.
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return []
+        elif char in '*?' or (char == '{' and _QUANTIFIER_RE.match(pattern, i - 1)):
+            if run:
+                run.pop()  # The quantified character is optional.
+            if char == '{':
+                i = _QUANTIFIER_RE.match(pattern, i - 1).end()
+        elif char == '+':
+            pass  # The quantified character is still required once.
+        elif char not in '.^$':
+            if depth == 0:
+                run.append(char)
+            continue
+        # Any other syntax ends the current literal.
+        if run:
+            literals.append(''.join(run))
+        run = []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
 class InvalidRule(TemplarError):
     pass
+
+# Flags that fused patterns may be compiled with, and the inline flags that scope them to a pattern.
+_FUSABLE_FLAGS = re.UNICODE | re.IGNORECASE | re.MULTILINE | re.DOTALL
+_SCOPED_FLAGS = (('i', re.IGNORECASE), ('m', re.MULTILINE), ('s', re.DOTALL))
+# Repetitions, e.g. {2,3}; any other '{' is a literal character.
+_QUANTIFIER_RE = re.compile(r'\{\d*(,\d*)?\}')
+_PATTERN_TYPE = type(re.compile(''))  # re.Pattern, which is only exposed by Python 3.7 and later.
+# Numbers of characters that follow escapes with fixed-length arguments, e.g. \x2e.
+_ESCAPE_ARGUMENT_LENGTHS = {'x': 2, 'u': 4, 'U': 8}
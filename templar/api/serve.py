@@ -0,0 +1,219 @@
+"""
+The public API for serving pages rendered by Templar over HTTP.
+
+Users can use this module with the following import statement:
+
+    from templar.api import serve
+"""
+
+from templar.api.build import page_inputs
+from templar.api.publish import publish
+from templar.exceptions import TemplarError
+from templar.linker import file_stamp
+
+from collections import deque
+import json
+import math
+import os
+import posixpath
+import time
+import urllib.parse
+
+class PageRenderer(object):
+    """Renders pages on demand, keeping the config (along with its Linker, Jinja Environment and
+    Markdown caches) and the rendered pages warm between requests.
+
+    The config and the pages are loaded by calling load_config and load_pages, and are loaded again
+    (discarding every rendered page) when a file at one of reload_paths changes. Pages are served at
+    the paths of their destinations relative to site_dir, so that a page with destination
+    site/docs/a.html is served at /docs/a.html if site_dir is 'site'. The path of a directory is
+    served by the page with destination index.html in that directory. If site_dir is None, it is
+    the deepest directory that contains every destination.
+
+    A rendered page is reused until one of its inputs (see build.page_inputs) changes. Pages whose
+    inputs cannot be determined are rendered on every request.
+
+    PageRenderer is not thread-safe; requests must be rendered one at a time.
+    """
+    def __init__(self, load_config, load_pages, site_dir, reload_paths=()):
+        self._load_config = load_config
+        self._load_pages = load_pages
+        self._site_dir = site_dir
+        self._reload_paths = [os.path.abspath(path) for path in reload_paths]
+        self._reload_stamps = None  # The stamps of reload_paths when the config was last loaded.
+        self._config = None
+        self._pages = {}  # Maps URL paths to Pages.
+        self._directories = set()  # URL paths of the directories that contain pages.
+        self._rendered = {}  # Maps URL paths to rendered pages and the stamps of their inputs.
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, url_path):
+        """Renders the page served at url_path.
+
+        RETURNS:
+        str; the rendered page, or None if no page is served at url_path.
+        """
+        self._reload_if_changed()
+        url_path = posixpath.normpath(urllib.parse.unquote(url_path))
+        if url_path not in self._pages and url_path in self._directories:
+            url_path = posixpath.join(url_path, 'index.html')
+        page = self._pages.get(url_path)
+        if page is None:
+            return None
+
+        rendered = self._rendered.get(url_path)
+        if rendered is not None:
+            result, stamps = rendered
+            if all(file_stamp(path) == stamp for path, stamp in stamps.items()):
+                self.hits += 1
+                return result
+        self.misses += 1
+        self._rendered.pop(url_path, None)
+        jinja_env = self._config.jinja_env
+        try:
+            result = publish(
+                    self._config,
+                    source=page.source,
+                    template=page.template,
+                    destination=page.destination,
+                    jinja_env=jinja_env,
+                    no_write=True)
+            inputs = page_inputs(self._config, page, None, jinja_env)
+        except TemplarError:
+            raise
+        except Exception as e:
+            # Templates, sources and the rules of the config are likely to be mid-edit.
+            raise ServeError('Could not render {}: {}: {}'.format(url_path, type(e).__name__, e))
+        if inputs is not None:
+            files, missing_paths = inputs
+            stamps = {path: file_stamp(path) for path in files}
+            stamps.update((path, None) for path in missing_paths)
+            self._rendered[url_path] = (result, stamps)
+        return result
+
+    def _reload_if_changed(self):
+        stamps = [file_stamp(path) for path in self._reload_paths]
+        if self._config is not None and stamps == self._reload_stamps:
+            return
+        try:
+            config = self._load_config()
+            pages = list(self._load_pages())
+        except TemplarError:
+            raise
+        except Exception as e:
+            # The config file is arbitrary Python code, which is likely to be mid-edit.
+            raise ServeError('Could not load the config and pages: {}: {}'.format(
+                type(e).__name__, e))
+        site_dir = self._site_dir
+        if site_dir is None:
+            site_dir = _common_directory([
+                os.path.dirname(os.path.abspath(page.destination)) for page in pages
+            ]) if pages else '.'
+        self._pages = {}
+        for page in pages:
+            relative_path = os.path.relpath(page.destination, site_dir)
+            self._pages['/' + relative_path.replace(os.sep, '/')] = page
+        self._directories = {posixpath.dirname(url_path) for url_path in self._pages}
+        self._config = config
+        self._rendered = {}
+        self._reload_stamps = stamps
+
+
+def _common_directory(directories):
+    """Returns the deepest directory that contains every one of the absolute directories (like
+    os.path.commonpath, which needs Python 3.5).
+    """
+    parts = os.path.commonprefix([directory.split(os.sep) for directory in directories])
+    return os.sep.join(parts) or os.sep
+
+
+class LatencyStats(object):
+    """Keeps the durations of the most recent max_samples requests, and reports percentiles of
+    them.
+    """
+    def __init__(self, max_samples=10000):
+        self._samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, percent):
+        """Returns the duration (in seconds) that percent of the recent requests took at most, or
+        None if no request was recorded.
+        """
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        rank = max(1, int(math.ceil(percent / 100 * len(samples))))
+        return samples[rank - 1]
+
+    def summary(self):
+        """Returns the count of requests and the percentiles of their durations, in milliseconds."""
+        summary = {'count': self.count}
+        for percent in REPORTED_PERCENTILES:
+            seconds = self.percentile(percent)
+            summary['p{}'.format(percent)] = None if seconds is None else round(seconds * 1e3, 3)
+        return summary
+
+
+def make_server(renderer, host='127.0.0.1', port=8000):
+    """Returns an HTTP server that serves the pages of the renderer, and statistics about the
+    latency of its requests and the reuse of rendered pages as JSON at STATS_PATH. The server
+    handles one request at a time; call its serve_forever method to start serving.
+
+    PARAMETERS:
+    renderer -- PageRenderer; renders the pages to serve.
+    host     -- str; the address to listen on.
+    port     -- int; the port to listen on. If 0, an unused port is chosen.
+
+    RETURNS:
+    http.server.HTTPServer; the server, whose latency attribute is the LatencyStats of its requests.
+    """
+    import http.server  # Deferred until a server is actually made.
+
+    latency = LatencyStats()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            start = time.perf_counter()
+            url_path = urllib.parse.urlsplit(self.path).path
+            if url_path == STATS_PATH:
+                stats = dict(latency.summary(), hits=renderer.hits, misses=renderer.misses)
+                self._respond(200, 'application/json', json.dumps(stats, sort_keys=True))
+                return
+            try:
+                result = renderer.render(url_path)
+            except TemplarError as e:
+                self._respond(500, 'text/plain', '{}: {}'.format(type(e).__name__, e))
+            else:
+                if result is None:
+                    self._respond(404, 'text/plain', 'No page is served at ' + url_path)
+                else:
+                    self._respond(200, 'text/html', result)
+            finally:
+                latency.record(time.perf_counter() - start)
+
+        def _respond(self, status, content_type, body):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type + '; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # Latency is reported at STATS_PATH instead.
+
+    server = http.server.HTTPServer((host, port), Handler)
+    server.latency = latency
+    return server
+
+
+class ServeError(TemplarError):
+    pass
+
+STATS_PATH = '/_templar/stats'
+REPORTED_PERCENTILES = (50, 90, 99, 100)
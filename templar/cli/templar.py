@@ -1,13 +1,14 @@
 """Command-line interface for templar."""
 
-from templar.api import config
-from templar.api import publish
+# The API modules are imported by the commands that use them, so that commands such as --version
+# start quickly.
 from templar.exceptions import TemplarError
 import templar
 
 import argparse
 import logging
 import sys
+import time
 
 LOGGING_FORMAT = '%(levelname)s %(filename)s:%(lineno)d> %(message)s'
 logging.basicConfig(format=LOGGING_FORMAT)
@@ -26,6 +27,14 @@ def flags(args=None):
     parser.add_argument('--print', action='store_true',
                         help='Forces printing of result to stdout, '
                         'even if --destination is specified')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Do not read from or write to the config's cache directory.")
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running, and publish again whenever the source, the files it '
+                        'includes, the templates or the config change. Requires --destination.')
+    parser.add_argument('--interval', type=float,
+                        help='Number of seconds between checks for changes when watching '
+                        '(default: 0.05).')
     parser.add_argument('--debug', action='store_true',
                         help='Enable debugging messages.')
     parser.add_argument('--version', action='store_true',
@@ -41,8 +50,19 @@ def run(args):
 
     log.setLevel(logging.DEBUG if args.debug else logging.ERROR)
 
+    if args.watch:
+        if not args.destination or args.print:
+            print('--watch requires --destination, and cannot be used with --print',
+                  file=sys.stderr)
+            exit(1)
+        from templar.api import build
+        page = build.Page(args.source, args.template, args.destination)
+        watch(args, lambda: [page], [args.config])
+        return
+
+    from templar.api import publish
     try:
-        configuration = config.import_config(args.config)
+        configuration = load_config(args)
         result = publish.publish(
                 configuration,
                 source=args.source,
@@ -59,6 +79,158 @@ def run(args):
         if not args.destination or args.print:
             print(result)
 
+def load_config(args):
+    """Imports the config at args.config. If args.no_cache is set, its cache_dir is removed."""
+    from templar.api import config
+    configuration = config.import_config(args.config)
+    if args.no_cache:
+        configuration = configuration.to_builder().set_cache_dir(None).build()
+    return configuration
+
+def build_flags(args=None):
+    parser = argparse.ArgumentParser(
+            prog='templar build',
+            description='Publishes every page listed in a manifest in a single process.')
+    parser.add_argument('-m', '--manifest', default='manifest.json',
+                        help='Path to a JSON manifest of the pages to publish.')
+    parser.add_argument('-c', '--config', default='config.py',
+                        help='Path to a Templar configuration file.')
+    parser.add_argument('--state',
+                        help='Path to a build state file. If provided, pages whose inputs have '
+                        'not changed since the last build are skipped.')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='Number of processes that publish pages in parallel.')
+    parser.add_argument('--chunksize', type=int,
+                        help='Number of pages sent to a worker process at a time.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Do not read from or write to the config's cache directory.")
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running, and publish the pages affected by changes to their '
+                        'inputs, the templates, the config or the manifest. --state and --workers '
+                        'are ignored.')
+    parser.add_argument('--interval', type=float,
+                        help='Number of seconds between checks for changes when watching '
+                        '(default: 0.05).')
+    parser.add_argument('--debug', action='store_true',
+                        help='Enable debugging messages.')
+    if args is not None:
+        return parser.parse_args(args)
+    return parser.parse_args()
+
+def run_build(args):
+    log.setLevel(logging.DEBUG if args.debug else logging.ERROR)
+    from templar.api import build
+
+    if args.watch:
+        watch(args, lambda: build.load_manifest(args.manifest), [args.config, args.manifest])
+        return
+
+    start = time.perf_counter()
+    try:
+        configuration = load_config(args)
+        pages = build.load_manifest(args.manifest)
+        results = build.build(
+                configuration,
+                pages,
+                state_path=args.state,
+                config_path=args.config,
+                workers=args.workers,
+                chunksize=args.chunksize)
+    except TemplarError as e:
+        if args.debug:
+            raise
+        else:
+            print('{}: {}'.format(type(e).__name__, str(e)), file=sys.stderr)
+            exit(1)
+    else:
+        print_build_summary(results, time.perf_counter() - start)
+
+def print_build_summary(results, total_seconds):
+    """Prints the time spent on each page, slowest first, followed by totals."""
+    for result in sorted(results, key=lambda result: -result.seconds):
+        if not result.built:
+            status = 'skipped'
+        elif result.written:
+            status = 'written'
+        else:
+            status = 'unchanged'
+        print('{:9.3f}s  {:9}  {}'.format(result.seconds, status, result.page.destination))
+    num_built = sum(1 for result in results if result.built)
+    num_written = sum(1 for result in results if result.written)
+    print('Built {} of {} pages ({} skipped) in {:.3f}s; wrote {} files ({} unchanged)'.format(
+        num_built, len(results), len(results) - num_built, total_seconds,
+        num_written, num_built - num_written))
+
+def watch(args, load_pages, reload_paths):
+    """Publishes the pages returned by load_pages whenever their inputs change, until interrupted.
+    The config and the pages are loaded again when a file at one of reload_paths changes.
+    """
+    from templar.api import build
+
+    def report(results, errors, seconds):
+        if results:
+            print_build_summary(results, seconds)
+        for error in errors:
+            print(error, file=sys.stderr)
+        sys.stdout.flush()
+
+    watcher = build.Watcher(lambda: load_config(args), load_pages, reload_paths)
+    print('Watching for changes. Press Ctrl-C to stop.')
+    try:
+        watcher.run(args.interval, report)
+    except KeyboardInterrupt:
+        pass
+
+def serve_flags(args=None):
+    parser = argparse.ArgumentParser(
+            prog='templar serve',
+            description='Serves every page listed in a manifest over HTTP, rendering pages when '
+            'they are requested and again only after their inputs change.')
+    parser.add_argument('-m', '--manifest', default='manifest.json',
+                        help='Path to a JSON manifest of the pages to serve.')
+    parser.add_argument('-c', '--config', default='config.py',
+                        help='Path to a Templar configuration file.')
+    parser.add_argument('--site-dir',
+                        help='Directory that URL paths are relative to. Defaults to the '
+                        'deepest directory that contains every destination.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on.')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help='Port to listen on.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Do not read from or write to the config's cache directory.")
+    parser.add_argument('--debug', action='store_true',
+                        help='Enable debugging messages.')
+    if args is not None:
+        return parser.parse_args(args)
+    return parser.parse_args()
+
+def run_serve(args):
+    log.setLevel(logging.DEBUG if args.debug else logging.ERROR)
+    from templar.api import build
+    from templar.api import serve
+
+    renderer = serve.PageRenderer(
+            lambda: load_config(args),
+            lambda: build.load_manifest(args.manifest),
+            args.site_dir,
+            [args.config, args.manifest])
+    server = serve.make_server(renderer, args.host, args.port)
+    print('Serving on http://{}:{}/ (latency statistics at {}). Press Ctrl-C to stop.'.format(
+        args.host, server.server_port, serve.STATS_PATH))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
 def main():
-    run(flags())
+    if sys.argv[1:2] == ['build']:
+        run_build(build_flags(sys.argv[2:]))
+    elif sys.argv[1:2] == ['serve']:
+        run_serve(serve_flags(sys.argv[2:]))
+    else:
+        run(flags())
 
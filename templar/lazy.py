@@ -0,0 +1,47 @@
+"""Defers work that modules would otherwise do when they are imported.
+
+Usage:
+
+    from templar import lazy
+
+    word_re = lazy.compile(r'\w+')
+"""
+
+import re
+
+def compile(pattern, flags=0):
+    """Returns a LazyPattern for the regular expression pattern, which can be used in place of
+    re.compile(pattern, flags).
+    """
+    return LazyPattern(pattern, flags)
+
+
+class LazyPattern(object):
+    """A regular expression that is only compiled when it is first used, so that importing a module
+    that defines many regular expressions does not pay for compiling all of them.
+
+    Once compiled, the attributes of the compiled pattern are copied onto the LazyPattern, so that
+    using it is as fast as using the compiled pattern.
+    """
+    def __init__(self, pattern, flags=0):
+        self._source = pattern
+        self._flags = flags
+
+    def __getattr__(self, name):
+        # Only called for attributes that were not found, i.e. before the pattern is compiled.
+        if name.startswith('__'):
+            raise AttributeError(name)
+        compiled = re.compile(self._source, self._flags)
+        for attribute in _PATTERN_ATTRIBUTES:
+            if hasattr(compiled, attribute):  # fullmatch needs Python 3.4.
+                setattr(self, attribute, getattr(compiled, attribute))
+        return getattr(compiled, name)
+
+    def __repr__(self):
+        return 'lazy.compile({!r}, {!r})'.format(self._source, self._flags)
+
+
+_PATTERN_ATTRIBUTES = (
+    'findall', 'finditer', 'flags', 'fullmatch', 'groupindex', 'groups', 'match', 'pattern',
+    'scanner', 'search', 'split', 'sub', 'subn',
+)
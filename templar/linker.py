@@ -2,38 +2,74 @@
 Linker utilities.
 """
 
+from templar import lazy
 from templar.exceptions import TemplarError
+import templar
 
+from collections import namedtuple
+from collections.abc import Mapping
+import hashlib
 import os
+import pickle
 import re
+import time
 
-def link(source_path):
-    """Links the content found at source_path and represents a Block that represents the content."""
+def link(source_path, cache=None, resolve_symlinks=True):
+    """Links the content found at source_path and represents a Block that represents the content.
+
+    If cache is a LinkCache, files are parsed at most once across calls: a file whose parsed form is
+    in the cache, and that has not changed since, is not read or parsed again.
+
+    Files are identified by their normalized absolute paths, so that a file is parsed at most once
+    per call no matter how include tags spell its path. If resolve_symlinks is True, symbolic links
+    are resolved as well, so that a file and the links to it are also treated as the same file.
+    """
     if not os.path.isfile(source_path):
         raise SourceNotFound(source_path)
-    with open(source_path, 'r') as f:
-        content = f.read()
-    block_map = BlockMap()  # The map will be populated with the following function call.
-    all_block = convert_lines_to_block(
-            content.splitlines(), block_map, LinkStack(source_path), source_path)
+    # The map will be populated with the following function call.
+    block_map = BlockMap(cache, resolve_symlinks)
+    link_stack = LinkStack(source_path, resolve_symlinks)
+    all_block = load_file(source_path, block_map, link_stack)
     return all_block, block_map.get_variables()
 
 
 def get_block_dict(top_level_block):
-    """Returns a dictionary of block names (str) to block contents (str) for all child blocks, as
+    """Returns a BlockDict of block names (str) to block contents (str) for all child blocks, as
     well as the original block itself.
+    """
+    return BlockDict(top_level_block)
+
+
+class BlockDict(Mapping):
+    """A read-only mapping of block names (str) to block contents (str) for a block and all of its
+    nested blocks.
 
-    The block_dict argument is only used for recursive calls and should not 
+    The contents of a block are only joined when the block is first looked up, since templates
+    usually use only a few of a page's blocks. Looking up a block does not join the contents of its
+    nested blocks separately (see Block.__str__), so that the text of a deeply nested block is not
+    copied once for every block that contains it.
     """
-    block_stack = [top_level_block]
-    block_dict = {}
-    while block_stack:
-        block = block_stack.pop()
-        block_dict[block.name] = str(block)
-        for segment in block.segments:
-            if isinstance(segment, Block):
-                block_stack.append(segment)
-    return block_dict
+    def __init__(self, top_level_block):
+        self._blocks = {}
+        block_stack = [top_level_block]
+        while block_stack:
+            block = block_stack.pop()
+            self._blocks[block.name] = block
+            for segment in block.segments:
+                if isinstance(segment, Block):
+                    block_stack.append(segment)
+
+    def __getitem__(self, name):
+        return str(self._blocks[name])
+
+    def __iter__(self):
+        return iter(self._blocks)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __repr__(self):
+        return 'BlockDict({!r})'.format(list(self._blocks))
 
 
 class Block(object):
@@ -44,82 +80,426 @@ class Block(object):
         self._str = None  # Cache the str representation of this block.
 
     def apply_rule(self, rule):
+        self.apply_rules((rule,))
+
+    def apply_rules(self, rules):
+        """Applies each of the rules, in order, to every str segment of this block and its nested
+        blocks. This is equivalent to calling apply_rule with each rule in turn, except that the
+        blocks are traversed once rather than once per rule.
+        """
+        if not rules:
+            return
         self._str = None  # Clear str cache.
         for i, segment in enumerate(self.segments):
             assert isinstance(segment, str) or isinstance(segment, Block)
             if isinstance(segment, str):
-                self.segments[i] = rule.apply(segment)
+                for rule in rules:
+                    segment = rule.apply(segment)
+                self.segments[i] = segment
             else:
-                segment.apply_rule(rule)  # Recursively apply rule onto nested blocks.
+                segment.apply_rules(rules)  # Recursively apply rules onto nested blocks.
 
     def __str__(self):
         if self._str is None:
-            self._str = '\n'.join(str(segment) for segment in self.segments)
+            self._str = '\n'.join(self._lines())
         return self._str
 
+    def _lines(self):
+        """Yields the strings that make up this block, including those of nested blocks, which are
+        joined with newlines to form the block's contents. The contents of nested blocks are not
+        joined (or cached) on their own, unless they already were.
+        """
+        segment_stack = [iter(self.segments)]
+        while segment_stack:
+            segment = next(segment_stack[-1], None)
+            if segment is None:
+                segment_stack.pop()
+            elif isinstance(segment, str):
+                yield segment
+            elif segment._str is not None or not segment.segments:
+                yield str(segment)  # An empty block still contributes an empty line.
+            else:
+                segment_stack.append(iter(segment.segments))
+
+
+class LinkCache(object):
+    """A persistent, on-disk cache of parsed files.
+
+    Each entry holds the parsed form of a single file: its Block tree with include tags and variable
+    definitions left unresolved. Entries are keyed by the file's canonical path and are only used
+    if the file's modification time and size are unchanged, or failing that, if its content hash is
+    unchanged. Since includes are resolved when linking, an entry never depends on other files.
+
+    Example usage:
+
+        cache = LinkCache('.templar-cache/linker')
+        all_block, variables = link('docs/index.md', cache=cache)
+    """
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    def get(self, filename):
+        """Returns the parsed Block for filename, or None if the cache holds no usable entry."""
+        entry_path = self._entry_path(filename)
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+        except Exception:
+            # Missing, unreadable or corrupt entries are treated as cache misses.
+            return None
+        if entry.get('version') != _CACHE_VERSION or entry.get('path') != canonical_path(filename):
+            return None
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        mtime, size, digest = entry['stamp']
+        if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+            return entry['block']
+        elif stat.st_size != size:
+            return None
+
+        # The file was touched but may not have changed, so fall back to comparing content hashes.
+        with open(filename, 'r') as f:
+            content = f.read()
+        if content_digest(content) != digest:
+            return None
+        self.put(filename, stat, content, entry['block'])  # Refresh the stamp.
+        return entry['block']
+
+    def put(self, filename, stat, content, block):
+        """Stores the parsed Block for filename.
+
+        PARAMETERS:
+        filename -- str; path of the parsed file.
+        stat     -- os.stat_result; the result of os.stat(filename), taken before the file was read.
+        content  -- str; the content of the file that was parsed.
+        block    -- Block; the parsed (unlinked) form of the file.
+        """
+        entry = {
+            'version': _CACHE_VERSION,
+            'path': canonical_path(filename),
+            'stamp': (stat.st_mtime_ns, stat.st_size, content_digest(content)),
+            'block': block,
+        }
+        import tempfile  # Imported here to keep importing the linker fast.
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._entry_path(filename))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _entry_path(self, filename):
+        key = hashlib.sha1(canonical_path(filename).encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir, key + '.pickle')
+
+
+class Linker(object):
+    """Links source files, reusing work across calls.
+
+    A Linker remembers the files that it parses, as well as the files that it links as includes, so
+    that partials shared by many sources are read, parsed and linked once instead of once per
+    source. Before a remembered file is reused, it and every file it (transitively) includes are
+    checked for changes by modification time and size (and content hash, for files modified too
+    recently for their modification time to reveal further changes); if any of them changed, the
+    file is parsed and linked again.
+
+    Remembered files are never modified. link always returns new Blocks, which callers are free to
+    modify (e.g. by applying rules).
+
+    Example usage:
+
+        linker = Linker()
+        for source_path in source_paths:
+            all_block, variables = linker.link(source_path)
+    """
+    def __init__(self, cache=None, resolve_symlinks=True):
+        self._cache = cache
+        self._resolve_symlinks = resolve_symlinks
+        # Maps canonical paths to (stamp, parsed Block).
+        self._parsed_files = {}
+        # Maps canonical paths to LinkedFiles, for files that were linked as includes.
+        self._linked_files = {}
+        # Maps canonical paths to lists of Includes, as of the last time each file was linked.
+        self._include_graph = {}
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def resolve_symlinks(self):
+        return self._resolve_symlinks
+
+    def link(self, source_path):
+        """Links the content found at source_path, like the module-level link function."""
+        if not os.path.isfile(source_path):
+            raise SourceNotFound(source_path)
+        block_map = BlockMap(self._cache, self._resolve_symlinks, linker=self)
+        link_stack = LinkStack(source_path, self._resolve_symlinks)
+        all_block = load_file(source_path, block_map, link_stack)
+        self._include_graph.update(block_map.include_graph)
+        return all_block, block_map.get_variables()
+
+    def clear(self):
+        """Forgets all remembered files."""
+        self._parsed_files.clear()
+        self._linked_files.clear()
+        self._include_graph.clear()
+
+    def get_includes(self, filename):
+        """Returns the Includes of the file at filename, as of the last time it was linked, or None
+        if this Linker has never linked the file.
+        """
+        return self._include_graph.get(canonical_path(filename, self._resolve_symlinks))
+
+    def dependencies(self, source_path):
+        """Returns the files that the content of source_path depends on, as of the last time it was
+        linked: linking it again produces the same result as long as none of these files change.
+
+        RETURNS:
+        (set of str, set of str); the canonical paths of source_path and of every file it
+        (transitively) includes, and the paths that did not exist when include tags were resolved
+        and must remain missing.
+        """
+        files = set()
+        missing_paths = set()
+        stack = [canonical_path(source_path, self._resolve_symlinks)]
+        while stack:
+            key = stack.pop()
+            if key in files:
+                continue
+            files.add(key)
+            for include in self._include_graph.get(key, ()):
+                stack.append(include.path)
+                if include.missing_path is not None:
+                    missing_paths.add(include.missing_path)
+        return files, missing_paths
+
+    def get_parsed_file(self, filename, block_map):
+        """Returns the parsed (unlinked) 'all' Block of the file at filename, parsing the file only
+        if it changed since it was last parsed.
+        """
+        key = block_map.key(filename)
+        stamp = linker_stamp(key)
+        parsed_file = self._parsed_files.get(key)
+        if stamp is not None and parsed_file is not None and parsed_file[0] == stamp:
+            return parsed_file[1]
+        parsed_block = parse_file(filename, self._cache)
+        if stamp is not None:
+            self._parsed_files[key] = (stamp, parsed_block)
+        return parsed_block
+
+    def reuse_file(self, filename, block_map, link_stack):
+        """Adds the blocks and variables of a remembered file (and of the files it includes) to the
+        block_map, exactly as linking the file would.
+
+        RETURNS:
+        bool; False if the file cannot be reused, in which case the block_map is not modified.
+        """
+        key = block_map.key(filename)
+        if not self._is_unchanged(key, block_map.checked_files):
+            return False
+        if link_stack.contains_any(self._included_files(key)):
+            return False  # The file includes itself; let linking report the cycle.
+        self._replay(key, block_map)
+        return True
+
+    def remember_file(self, filename, block_map):
+        """Remembers a file that was just linked as an include, so that it can be reused."""
+        key = block_map.key(filename)
+        if key not in self._parsed_files:
+            return  # The file could not be checked for changes, so it cannot be reused safely.
+        stamp, parsed_block = self._parsed_files[key]
+
+        # Replaying a file must define the same variables and include the same files, in the same
+        # order, as linking it.
+        events = []
+        missing_paths = []
+        cwd = None
+        for tag in iter_tags(parsed_block):
+            if isinstance(tag, VariableTag):
+                events.append(tag)
+                continue
+            included_path = resolve_include(filename, tag.path)
+            relative_to_source = os.path.join(os.path.dirname(filename), tag.path)
+            if included_path != relative_to_source:
+                # The include resolved relative to the working directory, which is only correct
+                # while no file exists relative to the source.
+                missing_paths.append(relative_to_source)
+                cwd = os.getcwd()
+            events.append(block_map.key(included_path))
+
+        file_blocks = block_map.get_file_blocks(filename)
+        blocks = [(name, str(block)) for name, block in file_blocks.items() if name != ALL_BLOCK_NAME]
+        blocks.append((ALL_BLOCK_NAME, str(file_blocks[ALL_BLOCK_NAME])))
+        self._linked_files[key] = LinkedFile(
+                stamp,
+                events,
+                frozenset(event for event in events if isinstance(event, str)),
+                blocks,
+                missing_paths,
+                cwd,
+                block_map.include_graph[key])
+
+    def _is_unchanged(self, key, checked_files):
+        """Returns True if the file with the given canonical path is remembered, and neither it nor
+        the files it includes have changed. Results are memoized in checked_files.
+        """
+        if key in checked_files:
+            return checked_files[key]
+        checked_files[key] = False  # Guards against cycles.
+        linked_file = self._linked_files.get(key)
+        unchanged = linked_file is not None \
+                and linker_stamp(key) == linked_file.stamp \
+                and not any(os.path.isfile(path) for path in linked_file.missing_paths) \
+                and (linked_file.cwd is None or linked_file.cwd == os.getcwd()) \
+                and all(self._is_unchanged(path, checked_files) for path in linked_file.includes)
+        checked_files[key] = unchanged
+        return unchanged
+
+    def _included_files(self, key):
+        """Returns the canonical paths of all files transitively included by a remembered file."""
+        included = set()
+        stack = list(self._linked_files[key].includes)
+        while stack:
+            path = stack.pop()
+            if path not in included:
+                included.add(path)
+                stack.extend(self._linked_files[path].includes)
+        return included
+
+    def _replay(self, key, block_map):
+        linked_file = self._linked_files[key]
+        block_map.include_graph[key] = linked_file.edges
+        for event in linked_file.events:
+            if isinstance(event, VariableTag):
+                block_map.add_variable(event.name, event.value)
+            elif not block_map.has_file(event):
+                self._replay(event, block_map)
+        for name, content in linked_file.blocks:
+            block_map.add_block(Block(key, name, [content]))
+
 
 ###########
 # Private #
 ###########
 
 class BlockMap(object):
-    """A map of block names to block contents (str -> str)."""
-    def __init__(self):
+    """A map of block names to block contents (str -> str).
+
+    Files are keyed by their canonical paths (see canonical_path), rather than by the paths that were
+    used to reach them.
+    """
+    def __init__(self, cache=None, resolve_symlinks=True, linker=None):
         # _blocks will be a nested dictionary. Specifically,
-        # { filename : { block_name : block_contents } }
+        # { canonical filename : { block_name : block_contents } }
         self._blocks = {}
         self._variables = {}
+        self.cache = cache  # LinkCache or None.
+        self.linker = linker  # The Linker performing the link, or None.
+        self.checked_files = {}  # Used by the Linker to check each remembered file once per link.
+        # Maps the canonical path of every linked file to the list of Includes in that file.
+        self.include_graph = {}
+        self._resolve_symlinks = resolve_symlinks
+        self._canonical_paths = {}  # Memoizes canonical_path, which may hit the file system.
 
     def get_variables(self):
         return self._variables
 
     def add_block(self, block):
-        file_blocks = self._blocks.setdefault(block.source_path, {})
+        file_blocks = self._blocks.setdefault(self.key(block.source_path), {})
         if block.name in file_blocks:
             raise InvalidBlockName(
                 'Found multiple blocks with name "{}" in {}'.format(block.name, block.source_path))
         file_blocks[block.name] = block
 
+    def has_file(self, filename):
+        """Returns True if the file has been completely linked, i.e. all of its blocks are in the
+        map. The 'all' block of a file is always the last of its blocks to be added.
+        """
+        return self.has_block(filename, ALL_BLOCK_NAME)
+
     def has_block(self, filename, block_name):
-        return filename in self._blocks and block_name in self._blocks[filename]
+        key = self.key(filename)
+        return key in self._blocks and block_name in self._blocks[key]
 
     def get_block(self, filename, block_name):
         assert self.has_block(filename, block_name)
-        return self._blocks[filename][block_name]
+        return self._blocks[self.key(filename)][block_name]
+
+    def get_file_blocks(self, filename):
+        """Returns a dict of block names to Blocks for all blocks of the file."""
+        return self._blocks[self.key(filename)]
 
     def add_variable(self, variable, value):
         self._variables[variable] = value
 
+    def key(self, filename):
+        """Returns the canonical path under which the file is stored."""
+        key = self._canonical_paths.get(filename)
+        if key is None:
+            key = canonical_path(filename, self._resolve_symlinks)
+            self._canonical_paths[filename] = key
+        return key
+
 
 class LinkStack(object):
-    """A stack used for keeping track of link dependencies, detecting cycles if they appear."""
-    def __init__(self, filename):
+    """A stack used for keeping track of link dependencies, detecting cycles if they appear.
+
+    Cycles are detected using canonical paths (see canonical_path), but are reported using the paths
+    that were used to reach each file.
+    """
+    def __init__(self, filename, resolve_symlinks=True):
+        self._resolve_symlinks = resolve_symlinks
         self._stack = [filename]
+        self._keys = [self._key(filename)]
 
     def push(self, filename):
-        if filename in self._stack:
+        key = self._key(filename)
+        if key in self._keys:
             raise CyclicalIncludeError(self._stack, filename)
         self._stack.append(filename)
+        self._keys.append(key)
 
     def pop(self):
         self._stack.pop()
+        self._keys.pop()
+
+    def contains_any(self, keys):
+        """Returns True if any of the given canonical paths is on the stack."""
+        return not keys.isdisjoint(self._keys)
+
+    def _key(self, filename):
+        return canonical_path(filename, self._resolve_symlinks)
 
 
 ALL_BLOCK_NAME = 'all'
 
-BLOCK_OPEN_REGEX = re.compile("""
+BLOCK_OPEN_REGEX = lazy.compile("""
 ^.*?<\s*block\s+
 ([\w -]+)           # \1 is the block name
 \s*>.*$
 """, re.X)
 
-BLOCK_CLOSE_REGEX = re.compile("""
+BLOCK_CLOSE_REGEX = lazy.compile("""
 ^.*?<\s*/\s*block\s+
 ([\w -]+)           # \1 is the block name
 \s*>.*$
 """, re.X)
 
-INCLUDE_REGEX = re.compile(r"""
+INCLUDE_REGEX = lazy.compile(r"""
 ^([ \t]*)       # \1 is leading whitespace
 <\s*include\s+
     (.+?)       # \2 is filename
@@ -127,7 +507,7 @@ INCLUDE_REGEX = re.compile(r"""
 \s*>.*$
 """, re.X)
 
-VARIABLE_REGEX = re.compile(r"""
+VARIABLE_REGEX = lazy.compile(r"""
 ^~\s*        # Begins with ~
 (.+?)        # \1 is variable name
 \s*:\s*      # Colon delimiter
@@ -136,6 +516,34 @@ VARIABLE_REGEX = re.compile(r"""
 """, re.X)
 
 
+# Unresolved tags in a parsed Block. Parsed Blocks contain these tags alongside str and Block
+# segments; linking replaces them with the content they refer to.
+IncludeTag = namedtuple('IncludeTag', ['leading_whitespace', 'path', 'block_name'])
+VariableTag = namedtuple('VariableTag', ['name', 'value'])
+
+# What a Linker remembers about a file that it linked as an include:
+# stamp         -- tuple; the linker_stamp of the file when it was parsed.
+# events        -- list; in order, the VariableTags and the canonical paths of the included files.
+# includes      -- frozenset of str; canonical paths of the included files.
+# blocks        -- list of (str, str); the content of every block in the file, 'all' last.
+# missing_paths -- list of str; paths that did not exist when include tags were resolved.
+# cwd           -- str or None; the working directory, if it was used to resolve include tags.
+# edges         -- list of Include; the include tags of the file, resolved.
+LinkedFile = namedtuple('LinkedFile',
+        ['stamp', 'events', 'includes', 'blocks', 'missing_paths', 'cwd', 'edges'])
+
+# An edge of the include graph: a resolved include tag.
+# path         -- str; the canonical path of the included file.
+# block_name   -- str; the name of the included block.
+# missing_path -- str or None; if the include tag was resolved relative to the working directory,
+#                 the path relative to the including file, which did not exist.
+Include = namedtuple('Include', ['path', 'block_name', 'missing_path'])
+
+_CACHE_VERSION = (templar.__version__, 1)
+# The coarsest granularity of modification times among common filesystems (FAT's two seconds).
+_MTIME_GRANULARITY_NS = 2 * 10 ** 9
+
+
 def convert_lines_to_block(lines, block_map, link_stack, source_path, block_name=ALL_BLOCK_NAME):
     """Converts the specified block content lines (list of strings) into a Block object.
 
@@ -144,7 +552,7 @@ def convert_lines_to_block(lines, block_map, link_stack, source_path, block_name
     nested blocks.
 
     PARAMETERS:
-    lines       -- str; content lines to be converted into a Block.
+    lines       -- list of str; content lines to be converted into a Block.
     block_map   -- BlockMap
     link_stack  -- LinkStack
     source_path -- str; the path of the file from which this content came, relative to the current
@@ -155,10 +563,63 @@ def convert_lines_to_block(lines, block_map, link_stack, source_path, block_name
     RETURNS:
     Block; the result of converting the block content.
     """
+    parsed_block, _ = scan_block(lines, 0, source_path, block_name)
+    return link_block(parsed_block, block_map, link_stack, source_path)
+
+
+def load_file(filename, block_map, link_stack):
+    """Parses (or retrieves the parsed form of) the file at filename and links it, adding all of
+    its blocks to the block_map.
+
+    RETURNS:
+    Block; the linked 'all' block of the file.
+    """
+    block_map.include_graph[block_map.key(filename)] = []
+    if block_map.linker is not None:
+        parsed_block = block_map.linker.get_parsed_file(filename, block_map)
+    else:
+        parsed_block = parse_file(filename, block_map.cache)
+    return link_block(parsed_block, block_map, link_stack, filename)
+
+
+def parse_file(filename, cache=None):
+    """Returns the parsed (unlinked) 'all' Block of the file at filename, using the cache if one is
+    provided.
+    """
+    if cache is not None:
+        block = cache.get(filename)
+        if block is not None:
+            return block
+        stat = os.stat(filename)
+    with open(filename, 'r') as f:
+        content = f.read()
+    block, _ = scan_block(content.splitlines(), 0, filename, ALL_BLOCK_NAME)
+    if cache is not None:
+        cache.put(filename, stat, content, block)
+    return block
+
+
+def scan_block(lines, index, source_path, block_name):
+    """Scans lines starting at index until the closing tag of block_name (or the end of lines, for
+    the 'all' block) and parses the scanned lines into a Block.
+
+    The lines list is never modified; instead, a cursor is advanced through it so that scanning is
+    linear in the number of lines. Consecutive lines of text are collected in a list and joined
+    once, when a nested block, include tag or variable interrupts them, or when the block ends.
+
+    The parsed Block is not linked: include tags and variable definitions are kept as IncludeTag and
+    VariableTag segments, and are resolved by link_block.
+
+    RETURNS:
+    (Block, int); the parsed Block and the index of the first line after the closing tag.
+    """
     found_closing_block = False
     segments = []
-    while lines:
-        line = lines.pop(0)
+    text_lines = []  # Lines of the text segment that is currently being built.
+    num_lines = len(lines)
+    while index < num_lines:
+        line = lines[index]
+        index += 1
 
         # Check if the line is a closing tag. This should only occur if we encounter the closing
         # block tag that matches the block_name parameter.
@@ -166,7 +627,7 @@ def convert_lines_to_block(lines, block_map, link_stack, source_path, block_name
         if close_tag_match:
             if close_tag_match.group(1) != block_name:
                 raise InvalidBlockName('Expected closing block ' + block_name + \
-                    'but found block named "' + block_tag_match.group(1) + '" in ' + source_path)
+                    ' but found block named "' + close_tag_match.group(1) + '" in ' + source_path)
             # If the block name is valid, we are done processing this block.
             found_closing_block = True
             break
@@ -181,69 +642,92 @@ def convert_lines_to_block(lines, block_map, link_stack, source_path, block_name
                     '"{0}" is a reserved block name, but found block named "{0}" in {1}'.format(
                         ALL_BLOCK_NAME, source_path))
 
-            # Recursively convert nested block contents to a Block.
-            inner_block = convert_lines_to_block(
-                lines,
-                block_map,
-                link_stack,
-                source_path,
-                inner_block_name)
-            segments.append(inner_block)
-            continue
-
-        # Otherwise, check if the line is a variable. The line should be omitted.
-        variable_match = VARIABLE_REGEX.match(line)
-        if variable_match:
-            process_variable(variable_match, block_map)
-            continue
-
-        # Otherwise, check if the line is an include tag.
-        include_match = INCLUDE_REGEX.match(line)
-        if include_match:
-            included_content = process_links(include_match, block_map, link_stack, source_path)
-            # Omit empty content.
-            if included_content != '':
-                append_text_to_segments(segments, included_content)
+            # Recursively parse nested block contents.
+            tag, index = scan_block(lines, index, source_path, inner_block_name)
         else:
-            append_text_to_segments(segments, line)
+            # Otherwise, check if the line is a variable or an include tag.
+            tag = parse_tag(line)
+            if tag is None:
+                text_lines.append(line)
+                continue
+
+        if text_lines:
+            segments.append('\n'.join(text_lines))
+            text_lines = []
+        segments.append(tag)
 
     if block_name != ALL_BLOCK_NAME and not found_closing_block:
         raise InvalidBlockName(
                 'Expected closing block called "{0}" in {1}'.format(block_name, source_path))
 
-    block = Block(source_path, block_name, segments)
-    block_map.add_block(block)
-    return block
+    if text_lines:
+        segments.append('\n'.join(text_lines))
+    return Block(source_path, block_name, segments), index
 
 
-def append_text_to_segments(segments, text):
-    if segments and not isinstance(segments[-1], Block):
-        segments[-1] = segments[-1] + '\n' + text
-    else:
-        segments.append(text)
+def link_block(parsed_block, block_map, link_stack, source_path):
+    """Links a parsed Block: variables are added to the block_map and include tags are replaced by
+    the (indented) content of the blocks they refer to. The linked Block, and every Block nested in
+    it, is added to the block_map.
 
+    The parsed Block is not modified, so it can be linked any number of times.
 
-def process_variable(variable_match, block_map):
-    variable = variable_match.group(1)
-    value = variable_match.group(2)
-    block_map.add_variable(variable, value)
+    PARAMETERS:
+    parsed_block -- Block; a Block returned by scan_block.
+    block_map    -- BlockMap
+    link_stack   -- LinkStack
+    source_path  -- str; the path of the file from which the parsed Block came, relative to the
+                    current working directory.
 
+    RETURNS:
+    Block; the linked Block.
+    """
+    segments = []
+    text_lines = []  # Lines of the text segment that is currently being built.
+    for segment in parsed_block.segments:
+        if isinstance(segment, str):
+            text_lines.append(segment)
+        elif isinstance(segment, VariableTag):
+            # Variable definitions are omitted from the content.
+            block_map.add_variable(segment.name, segment.value)
+        elif isinstance(segment, IncludeTag):
+            included_content = retrieve_block_from_map(
+                    source_path,
+                    segment.path,
+                    segment.block_name,
+                    segment.leading_whitespace,
+                    block_map,
+                    link_stack)
+            # Omit empty content.
+            if included_content != '':
+                text_lines.append(included_content)
+        else:
+            inner_block = link_block(segment, block_map, link_stack, source_path)
+            if text_lines:
+                segments.append('\n'.join(text_lines))
+                text_lines = []
+            segments.append(inner_block)
 
-def process_links(include_match, block_map, link_stack, source_path):
-    """Process a string of content for include tags.
+    if text_lines:
+        segments.append('\n'.join(text_lines))
+    block = Block(source_path, parsed_block.name, segments)
+    block_map.add_block(block)
+    return block
 
-    This function assumes there are no blocks in the content. The content is split into segments,
-    with include tags being replaced by Block objects.
 
-    PARAMETERS:
-    content     -- str; content to be converted into a Block.
-    block_map   -- BlockMap
-    link_stack  -- LinkStack
-    source_path -- str; the filepath of the file from which this content came.
+def parse_tag(line):
+    """Returns the VariableTag or IncludeTag defined by the line, or None if the line is text."""
+    variable_match = VARIABLE_REGEX.match(line)
+    if variable_match:
+        return VariableTag(variable_match.group(1), variable_match.group(2))
+    include_match = INCLUDE_REGEX.match(line)
+    if include_match:
+        return parse_include(include_match)
+    return None
 
-    RETURNS:
-    list of str; segments that the comprise the content.
-    """
+
+def parse_include(include_match):
+    """Converts a match of INCLUDE_REGEX into an IncludeTag."""
     leading_whitespace = include_match.group(1)
     include_path = include_match.group(2)
 
@@ -254,13 +738,18 @@ def process_links(include_match, block_map, link_stack, source_path):
     else:
         block_name = ALL_BLOCK_NAME
 
-    return retrieve_block_from_map(
-            source_path,
-            include_path.strip(),
-            block_name.strip(),
-            leading_whitespace,
-            block_map,
-            link_stack)
+    return IncludeTag(leading_whitespace, include_path.strip(), block_name.strip())
+
+
+def iter_tags(parsed_block):
+    """Yields the IncludeTags and VariableTags of a parsed Block (including those in nested
+    blocks), in the order in which they appear.
+    """
+    for segment in parsed_block.segments:
+        if isinstance(segment, Block):
+            yield from iter_tags(segment)
+        elif not isinstance(segment, str):
+            yield segment
 
 
 def retrieve_block_from_map(
@@ -282,23 +771,29 @@ def retrieve_block_from_map(
     detected, an exception is raised.
     """
     # Check if the included file exists.
-    relative_to_source = os.path.join(os.path.dirname(source_path), include_path)
-    if os.path.isfile(relative_to_source):
-        filename = relative_to_source
-    elif os.path.isfile(include_path):
-        filename = include_path
-    else:
+    filename = resolve_include(source_path, include_path)
+    if filename is None:
         raise IncludeNonExistentBlock(
             source_path + ' tried to include a non-existent file: ' + include_path)
+    relative_to_source = os.path.join(os.path.dirname(source_path), include_path)
+    include = Include(
+            block_map.key(filename),
+            block_name,
+            relative_to_source if filename != relative_to_source else None)
+    block_map.include_graph.setdefault(block_map.key(source_path), []).append(include)
 
     # Add included file to stack, checking for cycles in the process.
     link_stack.push(filename)
 
-    # Process the block's file if it hasn't been processed before.
-    if not block_map.has_block(filename, block_name):
-        with open(filename, 'r') as f:
-            content = f.read()
-        convert_lines_to_block(content.splitlines(), block_map, link_stack, filename)
+    # Process the block's file if it hasn't been processed before. A Linker may be able to reuse
+    # the file from a previous link.
+    if not block_map.has_file(filename):
+        linker = block_map.linker
+        if linker is None:
+            load_file(filename, block_map, link_stack)
+        elif not linker.reuse_file(filename, block_map, link_stack):
+            load_file(filename, block_map, link_stack)
+            linker.remember_file(filename, block_map)
 
     # If the block is not in the map even after converting, then the block doesn't exist.
     if not block_map.has_block(filename, block_name):
@@ -310,6 +805,58 @@ def retrieve_block_from_map(
     return indent(str(block_map.get_block(filename, block_name)), leading_whitespace)
 
 
+def resolve_include(source_path, include_path):
+    """Returns the path of the file that an include tag in source_path refers to, or None if there
+    is no such file. See retrieve_block_from_map for how include paths are interpreted.
+    """
+    relative_to_source = os.path.join(os.path.dirname(source_path), include_path)
+    if os.path.isfile(relative_to_source):
+        return relative_to_source
+    elif os.path.isfile(include_path):
+        return include_path
+    return None
+
+
+def file_stamp(path):
+    """Returns the modification time (ns) and size of the file at path, or None if the file cannot
+    be accessed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def linker_stamp(path):
+    """Returns the file_stamp of the file at path, or None if the file cannot be accessed. If the
+    file was modified so recently that it could be modified again without changing its modification
+    time, the digest of its content is appended to the stamp, so that such changes are detected.
+    """
+    stamp = file_stamp(path)
+    if stamp is None or stamp[0] < time.time() * 1e9 - _MTIME_GRANULARITY_NS:
+        return stamp
+    try:
+        with open(path, 'r') as f:
+            content = f.read()
+    except (OSError, ValueError):
+        return None
+    return stamp + (content_digest(content),)
+
+
+def canonical_path(path, resolve_symlinks=True):
+    """Returns a normalized, absolute version of path. If resolve_symlinks is True, symbolic links
+    are resolved as well.
+    """
+    if resolve_symlinks:
+        return os.path.realpath(path)
+    return os.path.abspath(path)
+
+
+def content_digest(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
 def indent(content, whitespace):
     lines = content.splitlines()
     indented_lines = map(lambda line: whitespace + line, lines)
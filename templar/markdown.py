@@ -1,31 +1,122 @@
-import argparse
+from templar import lazy
+
 import html
 import os
 import re
+from bisect import bisect_right
 from collections import OrderedDict
-from hashlib import sha1
+from collections import namedtuple
 from random import randint
 
 ##############
 # Public API #
 ##############
 
-def convert(text):
-    return Markdown(text).text
+REGEX_ENGINE = 'regex'
+TOKEN_ENGINE = 'token'
+ENGINES = (REGEX_ENGINE, TOKEN_ENGINE)
+
+def convert(text, engine=REGEX_ENGINE):
+    return Markdown(text, engine=engine).text
+
+class ConversionCache:
+    """A bounded cache of converted Markdown fragments, which evicts the
+    least recently used fragment once it holds maxsize fragments.
+
+    hits and misses count the lookups that found and did not find a
+    converted fragment, respectively.
+    """
+    def __init__(self, maxsize=1024):
+        if maxsize < 0:
+            raise ValueError('Cache size must be non-negative: {}'.format(maxsize))
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()
+
+    def get(self, key):
+        """Returns the converted fragment stored under key, or None."""
+        result = self._fragments.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._fragments.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        """Stores the converted fragment result under key."""
+        if self.maxsize == 0:
+            return
+        self._fragments[key] = result
+        self._fragments.move_to_end(key)
+        if len(self._fragments) > self.maxsize:
+            self._fragments.popitem(last=False)
+
+    def clear(self):
+        """Removes all fragments and resets the counters."""
+        self._fragments.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._fragments)
 
 class Markdown:
-    def __init__(self, text, pre_hook=None, post_hook=None):
+    """Converts Markdown text into HTML.
+
+    Two engines are available. The regex engine (the default) hashes
+    and substitutes over the whole text, one syntax element at a time.
+    The token engine scans the lines of the text once into block tokens
+    and the text of each paragraph once into inline tokens (see
+    render_tokens). Both engines produce the same HTML, except that
+    emphasis and code in the token engine do not span separate blocks.
+
+    Converted fragments (list items, table cells, block quotes and link
+    labels) are memoized in cache, which is shared by all Markdown
+    objects unless another ConversionCache is given (a cache with a
+    maxsize of 0, or setting Markdown.cache to None, disables
+    memoization). The whole text is not memoized, so that the cache
+    does not keep entire documents alive for the life of the process.
+    Fragments that contain a "[" are keyed on the link references and
+    footnotes of the text as well, since only they can refer to either.
+    """
+    cache = ConversionCache()
+
+    def __init__(self, text, pre_hook=None, post_hook=None, engine=REGEX_ENGINE,
+                 cache=None):
+        if engine not in ENGINES:
+            raise ValueError('Unknown Markdown engine: {}'.format(engine))
+        self.engine = engine
+        self.cache = cache if cache is not None else Markdown.cache
         if pre_hook:
             text = pre_hook(text)
         self.text, self.variables, self.references, self.footnotes = preprocess(text, self)
-        self.text = self.convert(self.text, footnotes=True).strip()
+        self.context = (tuple(sorted(self.references.items())), tuple(self.footnotes.items()))
+        self.text = self.convert_uncached(self.text, footnotes=True).strip()
         if post_hook:
             self.text = post_hook(self.text)
 
     def convert(self, text, footnotes=False):
-        text, hashes = apply_hashes(text, self)
-        text = apply_substitutions(text)
-        text = unhash(text, hashes)
+        if self.cache is None:
+            return self.convert_uncached(text, footnotes)
+        if footnotes or '[' in text:
+            key = (self.engine, text, footnotes, self.context)
+        else:
+            key = (self.engine, text)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.convert_uncached(text, footnotes)
+            self.cache.put(key, result)
+        return result
+
+    def convert_uncached(self, text, footnotes=False):
+        if self.engine == TOKEN_ENGINE:
+            text = render_tokens(text, self)
+        else:
+            text, hashes = apply_hashes(text, self)
+            text = apply_substitutions(text)
+            text = unhash(text, hashes)
         text = postprocess(text, self, footnotes)
         return text
 
@@ -74,7 +165,7 @@ def preprocess(text, markdown_obj):
 
 TAB_SIZE = 4
 
-re_retab = re.compile(r"""
+re_retab = lazy.compile(r"""
     ([^\t]*?)   # \1 is string before the tab(s)
     (\t+)       # \2 is consecutive string of tabs
 """, re.M)
@@ -99,18 +190,21 @@ def sub_retab(match):
     before = match.group(1)
     tabs = len(match.group(2))
     return before + (' ' * (TAB_SIZE * tabs - len(before) % TAB_SIZE))
-re_whitespace = re.compile(r'^\s+$', re.M)
+re_whitespace = lazy.compile(r'^\s+$', re.M)
 def handle_whitespace(text):
     r"""Handles whitespace cleanup.
 
     Tabs are "smartly" retabbed (see sub_retab). Lines that contain
     only whitespace are truncated to a single newline.
     """
-    text = re_retab.sub(sub_retab, text)
+    # Only retab up to the last tab, since re_retab otherwise scans to
+    # the end of the text from every position after it.
+    last_tab = text.rfind('\t') + 1
+    text = re_retab.sub(sub_retab, text[:last_tab]) + text[last_tab:]
     text = re_whitespace.sub('', text).strip()
     return text
 
-re_vars = re.compile(r"""
+re_vars = lazy.compile(r"""
     (?:\n|\A)   # beginning of line or string
     ~[ \t]+     # ~ followed by at least one space
     (.*?)       # \1 is variable name
@@ -136,7 +230,7 @@ def get_variables(text):
     text = re_vars.sub('', text)
     return text, variables
 
-re_references = re.compile(r"""
+re_references = lazy.compile(r"""
     (?:\n|\A)
     [ ]{0,3}                # up to three spaces
     \[
@@ -179,7 +273,7 @@ def get_references(text):
     text = re_references.sub('', text)
     return text, references
 
-re_footnote_backreferences = re.compile(r"""
+re_footnote_backreferences = lazy.compile(r"""
     (?:\n|\A)
     [ ]{0,3}                # up to three spaces
     \[\^
@@ -220,7 +314,7 @@ def get_footnote_backreferences(text, markdown_obj):
     text = re_footnote_backreferences.sub('', text)
     return text, footnotes
 
-re_pandoc_comment = re.compile(r"""
+re_pandoc_comment = lazy.compile(r"""
 <!---
 .*?
 -->
@@ -228,7 +322,7 @@ re_pandoc_comment = re.compile(r"""
 def remove_pandoc_comments(text):
     return re_pandoc_comment.sub('', text)
 
-re_block_tag = re.compile(r"""
+re_block_tag = lazy.compile(r"""
     (\n|\A)[^\n]*?<\s*/?\s*block\s+[^\n]+?\s*>.*?(\n|\Z)
 """, re.X | re.S)
 def space_out_block_tags(text):
@@ -254,15 +348,30 @@ def apply_hashes(text, markdown_obj):
     text = hash_tags(text, hashes)
     return text, hashes
 
-SALT = bytes(randint(0, 1000000))
-def hash_text(s, label):
-    return label + '-' + sha1(SALT + s.encode("utf-8")).hexdigest() + '-' + label
+SALT = '{:06x}'.format(randint(0, 0xffffff))
+def hash_text(s, label, hashes):
+    """Stores s in hashes under a new placeholder, and returns the
+    placeholder.
+
+    Placeholders are numbered sequentially within each hashes
+    dictionary, in hexadecimal after a random salt, so that ordinary
+    text is unlikely to contain one by accident (see re_hash).
+
+    PARAMETERS:
+    s      -- str; the text to hash
+    label  -- str; the type of the hashed text (see re_hash)
+    hashes -- dict; a dictionary of all hashes, where keys are hashes
+              and values are their unhashed versions.
+    """
+    hashed = '{0}-{1}{2:x}-{0}'.format(label, SALT, len(hashes))
+    hashes[hashed] = s
+    return hashed
 
 html_block_tags = "article|aside|audio|canvas|figcaption|figure|footer|header|hgroup|output|section|video"
 block_tags = "blockquote|div|form|hr|noscript|ol|p|pre|table"
 
 block_tags += '|' + html_block_tags
-re_block = re.compile(r"""
+re_block = lazy.compile(r"""
 (?:\n+|\A)               # begin with newline or start of string
 (                        # \1 is entire block
     <
@@ -293,8 +402,7 @@ def hash_blocks(text, hashes):
     """
     def sub(match):
         block = match.group(1)
-        hashed = hash_text(block, 'block')
-        hashes[hashed] = block
+        hashed = hash_text(block, 'block', hashes)
         return '\n\n' + hashed + '\n\n'
     return re_block.sub(sub, text)
 
@@ -317,6 +425,11 @@ re_list = r"""
 )
 \n*
 """
+list_markers = (('u', '[+*-]'), ('o', r'\d+\.'))
+re_lists = [(style, lazy.compile(re_list % (marker, marker), re.S | re.X))
+            for style, marker in list_markers]
+re_list_markers = {style: lazy.compile(r'(?:\n|\A) {0,3}%s ' % marker)
+                   for style, marker in list_markers}
 def hash_lists(text, hashes, markdown_obj):
     """Hashes ordered and unordered lists.
 
@@ -342,34 +455,40 @@ def hash_lists(text, hashes, markdown_obj):
     list items in <p> tags if list items are separated by one or more
     blank lines.
     """
-    for style, marker in (('u', '[+*-]'), ('o', r'\d+\.')):
-        list_re = re.compile(re_list % (marker, marker), re.S | re.X)
-        # import pdb
-        # pdb.set_trace()
-        for match in list_re.finditer(text):
-            if not match:
-                continue
-            lst = match.group(1)
-            items = re.split(r'(?:\n|\A) {0,3}%s ' % marker, lst)[1:]
-            whole_list = ''
-            for item in items:
-                item = re.sub(r'^ {1,4}', '', item, flags=re.M)
-                item = markdown_obj.convert(item)
-                par_match = re.match('<p>(.*?)</p>', item, flags=re.S)
-                if par_match and par_match.group(0) == item.strip():
-                    item = par_match.group(1)
-                whole_list += '<li>{}</li>\n'.format(item)
-            whole_list = '<{0}l>\n{1}\n</{0}l>'.format(
-                    style,
-                    re.sub('^', '  ', whole_list.strip(), flags=re.M))
-            hashed = hash_text(whole_list, 'list')
-            hashes[hashed] = whole_list
-            start = text.index(match.group(0))
-            end = start + len(match.group(0))
-            text = text[:start] + '\n\n' + hashed + '\n\n' + text[end:]
+    for style, list_re in re_lists:
+        def sub(match):
+            items = re_list_markers[style].split(match.group(1))[1:]
+            whole_list = list_html(style, items, markdown_obj)
+            hashed = hash_text(whole_list, 'list', hashes)
+            return '\n\n' + hashed + '\n\n'
+        text = list_re.sub(sub, text)
     return text
 
-re_codeblock = re.compile(r"""
+re_item_indent = lazy.compile(r'^ {1,4}', re.M)
+re_item_paragraph = lazy.compile('<p>(.*?)</p>', re.S)
+re_line_start = lazy.compile('^', re.M)
+def list_html(style, items, markdown_obj):
+    """Returns the HTML for a list.
+
+    PARAMETERS:
+    style        -- str; 'u' for unordered lists, 'o' for ordered lists
+    items        -- list of str; the Markdown text of each list item,
+                    without its list marker
+    markdown_obj -- Markdown; used to convert the list items
+    """
+    whole_list = []
+    for item in items:
+        item = re_item_indent.sub('', item)
+        item = markdown_obj.convert(item)
+        par_match = re_item_paragraph.match(item)
+        if par_match and par_match.group(0) == item.strip():
+            item = par_match.group(1)
+        whole_list.append('<li>{}</li>\n'.format(item))
+    return '<{0}l>\n{1}\n</{0}l>'.format(
+            style,
+            re_line_start.sub('  ', ''.join(whole_list).strip()))
+
+re_codeblock = lazy.compile(r"""
 (?:\n+|\A)    # newline or start of string
 (                       # \1 is entire codeblock
     (?:
@@ -398,16 +517,21 @@ def hash_codeblocks(text, hashes):
     to accomodate (and even look) for this type of conversion.
     """
     def sub(match):
-        block = match.group(1).rstrip('\n')
-        block = re.sub(r'(?:(?<=\n)|(?<=\A)) {4}', '', block)
-        block = escape(block)
-        block = '<pre><code>{}</code></pre>'.format(block)
-        hashed = hash_text(block, 'pre')
-        hashes[hashed] = block
+        block = codeblock_html(match.group(1))
+        hashed = hash_text(block, 'pre', hashes)
         return '\n\n' + hashed + '\n\n'
     return re_codeblock.sub(sub, text)
 
-re_blockquote = re.compile(r"""
+def codeblock_html(block):
+    """Returns the HTML for the lines of a codeblock, including their
+    four spaces of indentation.
+    """
+    block = block.rstrip('\n')
+    block = re.sub(r'(?:(?<=\n)|(?<=\A)) {4}', '', block)
+    block = escape(block)
+    return '<pre><code>{}</code></pre>'.format(block)
+
+re_blockquote = lazy.compile(r"""
 (?:\n+|\A)                      # newline or start of string
 (                               # \1 is entire blockquote
     (?:
@@ -428,16 +552,21 @@ def hash_blockquotes(text, hashes, markdown_obj):
     recursively converted.
     """
     def sub(match):
-        block = match.group(1).strip()
-        block = re.sub(r'(?:(?<=\n)|(?<=\A))> ?', '', block)
-        block = markdown_obj.convert(block)
-        block = '<blockquote>{}</blockquote>'.format(block)
-        hashed = hash_text(block, 'blockquote')
-        hashes[hashed] = block
+        block = blockquote_html(match.group(1), markdown_obj)
+        hashed = hash_text(block, 'blockquote', hashes)
         return '\n\n' + hashed + '\n\n'
     return re_blockquote.sub(sub, text)
 
-re_table = re.compile(r"""
+def blockquote_html(block, markdown_obj):
+    """Returns the HTML for the lines of a block quote, including their
+    "> " prefixes.
+    """
+    block = block.strip()
+    block = re.sub(r'(?:(?<=\n)|(?<=\A))> ?', '', block)
+    block = markdown_obj.convert(block)
+    return '<blockquote>{}</blockquote>'.format(block)
+
+re_table = lazy.compile(r"""
     [^\n]*\|[^\n]*\n
     (?:
         [:\t -|]*\|[:\t -|]*
@@ -446,41 +575,46 @@ re_table = re.compile(r"""
 """, re.S | re.X)
 def hash_tables(text, hashes, markdown_obj):
     def sub(match):
-        table = '<table>\n'
-        aligns = []
-        for i, line in enumerate(match.group(0).split('\n')):
-            if i == 1:
-                assert set(line).issubset(set(' :|-\n'))
-                for col in line.strip('|').split('|'):
-                    if col.startswith(':') and col.endswith(':'):
-                        aligns.append('center')
-                    elif col.startswith(':'):
-                        aligns.append('left')
-                    elif col.endswith(':'):
-                        aligns.append('right')
-                    else:
-                        aligns.append('')
-                continue
-            row = ''
-            for col, cell in enumerate(line.strip('|').split('|')):
-                cell = markdown_obj.convert(cell.strip())
-                cell = cell.replace('<p>', '').replace('</p>', '')
-                if col < len(aligns) and aligns[col]:
-                    td_align = ' align="' + aligns[col] + '"'
-                else:
-                    td_align = ''
-                row += '    <t{0}{1}>{2}</t{0}>\n'.format(
-                        'h' if i == 0 else 'd',
-                        td_align,
-                        cell)
-            table += '  <tr>\n' + row + '  </tr>\n'
-        table += '</table>'
-        hashed = hash_text(table, 'table')
-        hashes[hashed] = table
+        table = table_html(match.group(0).split('\n'), markdown_obj)
+        hashed = hash_text(table, 'table', hashes)
         return '\n\n' + hashed + '\n\n'
     return re_table.sub(sub, text)
 
-re_code = re.compile(r"""
+def table_html(lines, markdown_obj):
+    """Returns the HTML for the lines of a table: the header row, the
+    alignment row, and any number of body rows.
+    """
+    table = '<table>\n'
+    aligns = []
+    for i, line in enumerate(lines):
+        if i == 1:
+            assert set(line).issubset(set(' :|-\n'))
+            for col in line.strip('|').split('|'):
+                if col.startswith(':') and col.endswith(':'):
+                    aligns.append('center')
+                elif col.startswith(':'):
+                    aligns.append('left')
+                elif col.endswith(':'):
+                    aligns.append('right')
+                else:
+                    aligns.append('')
+            continue
+        row = ''
+        for col, cell in enumerate(line.strip('|').split('|')):
+            cell = markdown_obj.convert(cell.strip())
+            cell = cell.replace('<p>', '').replace('</p>', '')
+            if col < len(aligns) and aligns[col]:
+                td_align = ' align="' + aligns[col] + '"'
+            else:
+                td_align = ''
+            row += '    <t{0}{1}>{2}</t{0}>\n'.format(
+                    'h' if i == 0 else 'd',
+                    td_align,
+                    cell)
+        table += '  <tr>\n' + row + '  </tr>\n'
+    return table + '</table>'
+
+re_code = lazy.compile(r"""
     (?<!\\)     # avoid escaped ticks
     (`+)        # \1 is opening ticks (could be multiple ticks)
     [ ]?        # leading space is optional
@@ -500,12 +634,11 @@ def hash_codes(text, hashes):
     """
     def sub(match):
         code = '<code>{}</code>'.format(escape(match.group(2)))
-        hashed = hash_text(code, 'code')
-        hashes[hashed] = code
+        hashed = hash_text(code, 'code', hashes)
         return hashed
     return re_code.sub(sub, text)
 
-re_inline_link = re.compile(r"""
+re_inline_link = lazy.compile(r"""
     (?<!\\)         # avoid escapes
     (!?)            # \1 is whether or not this is an img
     \[([^^\[\]]*?)\] # \2 is <a> text or <img> alt text
@@ -533,27 +666,28 @@ def hash_inline_links(text, hashes, markdown_obj):
     For reference style links, see hash_reference_links
     """
     def sub(match):
-        is_img = match.group(1) != ''
-        content = match.group(2)
-        link = match.group(3)
-        title = match.group(5)
-        if title:
-            title = ' title="{0}"'.format(title.strip())
-        else:
-            title = ''
-        if is_img:
-            result = '<img src="{0}" alt="{1}"{2}>'.format(
-                    link, content, title)
-        else:
-            result = '<a href="{0}"{2}>{1}</a>'.format(link,
-                    markdown_obj.convert(content).replace('<p>', '').replace('</p>', ''),
-                    title)
-        hashed = hash_text(result, 'link')
-        hashes[hashed] = result
+        result = inline_link_html(match, markdown_obj)
+        hashed = hash_text(result, 'link', hashes)
         return hashed
     return re_inline_link.sub(sub, text)
 
-re_reference_link = re.compile(r"""
+def inline_link_html(match, markdown_obj):
+    """Returns the HTML for a match of re_inline_link."""
+    is_img = match.group(1) != ''
+    content = match.group(2)
+    link = match.group(3)
+    title = match.group(5)
+    if title:
+        title = ' title="{0}"'.format(title.strip())
+    else:
+        title = ''
+    if is_img:
+        return '<img src="{0}" alt="{1}"{2}>'.format(link, content, title)
+    return '<a href="{0}"{2}>{1}</a>'.format(link,
+            markdown_obj.convert(content).replace('<p>', '').replace('</p>', ''),
+            title)
+
+re_reference_link = lazy.compile(r"""
     (?<!\\)             # avoid escapes
     (!?)                # \1 is whether or not link is an <img>
     \[([^^\[\]]*?)\]    # \2 is link text or img alt text
@@ -580,31 +714,32 @@ def hash_reference_links(text, hashes, markdown_obj):
     This is known as an "implicit link" reference.
     """
     def sub(match):
-        is_img = match.group(1) != ''
-        content = match.group(2)
-        ref = match.group(3).strip().lower()
-        if not ref:
-            ref = content.strip().lower()
-        ref = ref.replace('\n', ' ')
-        if ref not in markdown_obj.references:
-            link, title = '', ''
-        else:
-            link, title = markdown_obj.references[ref]
-        if title:
-            title = ' title="{0}"'.format(title)
-        if is_img:
-            result = '<img src="{0}" alt="{1}"{2}>'.format(
-                    link, content, title)
-        else:
-            result = '<a href="{0}"{2}>{1}</a>'.format(link,
-                    markdown_obj.convert(content).replace('<p>', '').replace('</p>', '').strip(),
-                    title)
-        hashed = hash_text(result, 'link')
-        hashes[hashed] = result
+        result = reference_link_html(match, markdown_obj)
+        hashed = hash_text(result, 'link', hashes)
         return hashed
     return re_reference_link.sub(sub, text)
 
-re_footnote = re.compile(r"""
+def reference_link_html(match, markdown_obj):
+    """Returns the HTML for a match of re_reference_link."""
+    is_img = match.group(1) != ''
+    content = match.group(2)
+    ref = match.group(3).strip().lower()
+    if not ref:
+        ref = content.strip().lower()
+    ref = ref.replace('\n', ' ')
+    if ref not in markdown_obj.references:
+        link, title = '', ''
+    else:
+        link, title = markdown_obj.references[ref]
+    if title:
+        title = ' title="{0}"'.format(title)
+    if is_img:
+        return '<img src="{0}" alt="{1}"{2}>'.format(link, content, title)
+    return '<a href="{0}"{2}>{1}</a>'.format(link,
+            markdown_obj.convert(content).replace('<p>', '').replace('</p>', '').strip(),
+            title)
+
+re_footnote = lazy.compile(r"""
     (?<!\\)             # avoid escapes
     \[\^([^\[\]]*?)\]   # \1 is footnote id
 """, re.X | re.S)
@@ -625,12 +760,11 @@ def hash_footnote_reference(text, hashes, markdown_obj):
             return ''
         number = numbers[footnote_id]
         result = '<sup><a href="#fnref-{0}">{0}</a></sup>'.format(number)
-        hashed = hash_text(result, 'footnote')
-        hashes[hashed] = result
+        hashed = hash_text(result, 'footnote', hashes)
         return hashed
     return re_footnote.sub(sub, text)
 
-re_tag = re.compile(r"""<[^>]+?>""", re.S)
+re_tag = lazy.compile(r"""<[^>]+?>""", re.S)
 def hash_tags(text, hashes):
     """Hashes any non-block tags.
 
@@ -644,12 +778,11 @@ def hash_tags(text, hashes):
     (see link.py) is applied to them.
     """
     def sub(match):
-        hashed = hash_text(match.group(0), 'tag')
-        hashes[hashed] = match.group(0)
+        hashed = hash_text(match.group(0), 'tag', hashes)
         return hashed
     return re_tag.sub(sub, text)
 
-re_hash = re.compile(r"""
+re_hash = lazy.compile(r"""
     (                   # \1 is hash type
         blockquote  |
         block       |
@@ -664,25 +797,64 @@ re_hash = re.compile(r"""
     -[\da-f]+-          # hash
     \1                  # closing hash type
 """, re.X)
-re_pre_tag = re.compile(r"""
-([ ]*)  # \1 is leading whitespace
-<pre>
-.*?
-</pre>
-""", re.S | re.X)
 def unhash(text, hashes):
     """Unhashes all hashed entites in the hashes dictionary.
 
-    The pattern for hashes is defined by re_hash. After everything is
-    unhashed, <pre> blocks are "pulled out" of whatever indentation
-    level in which they used to be (e.g. in a list).
+    The pattern for hashes is defined by re_hash. The text is scanned
+    only once: hashes nested inside a hashed value are resolved from
+    the hashes dictionary, and each value is resolved at most once.
+    Text that looks like a hash but is not in the dictionary is left
+    as-is. After everything is unhashed, <pre> blocks are "pulled out"
+    of whatever indentation level in which they used to be (e.g. in a
+    list).
     """
+    resolved = {}
     def retrieve_match(match):
-        return hashes[match.group(0)]
-    while re_hash.search(text):
-        text = re_hash.sub(retrieve_match, text)
-    text = re_pre_tag.sub(lambda m: re.sub('^' + m.group(1), '', m.group(0), flags=re.M), text)
-    return text
+        hashed = match.group(0)
+        if hashed in resolved:
+            return resolved[hashed]
+        if hashed not in hashes:
+            return hashed
+        # A value only contains hashes created before it, so the
+        # recursion always terminates.
+        value = resolved[hashed] = re_hash.sub(retrieve_match, hashes[hashed])
+        return value
+    return pull_out_pre_tags(re_hash.sub(retrieve_match, text))
+
+def pull_out_pre_tags(text):
+    """Removes the indentation of <pre> blocks, which are otherwise
+    indented along with the list items that contain them.
+
+    A <pre> block extends from a <pre> tag to the first </pre> tag
+    after it, and its indentation is the run of spaces right before
+    the <pre> tag. That indentation is removed from the start of the
+    block and from every line of the block that starts with it.
+
+    The blocks are located with str.find rather than a regex, since
+    a regex that starts with the optional indentation would be tried
+    at every position of the text, and most texts have no <pre>
+    blocks at all.
+    """
+    start = text.find('<pre>')
+    if start == -1:
+        return text
+    pieces = []
+    last = 0
+    while start != -1:
+        end = text.find('</pre>', start + len('<pre>'))
+        if end == -1:
+            break
+        end += len('</pre>')
+        indent_start = start
+        while indent_start > last and text[indent_start - 1] == ' ':
+            indent_start -= 1
+        indent = text[indent_start:start]
+        pieces.append(text[last:indent_start])
+        pieces.append(text[start:end].replace('\n' + indent, '\n') if indent else text[start:end])
+        last = end
+        start = text.find('<pre>', end)
+    pieces.append(text[last:])
+    return ''.join(pieces)
 
 #################
 # Substitutions #
@@ -698,7 +870,7 @@ def apply_substitutions(text):
     text = paragraph_re.sub(paragraph_sub, text)
     return text
 
-hr_re = re.compile(r"""
+hr_re = lazy.compile(r"""
     \n\n                    # leading blank line
     (
         (?:\*[ ]?){3,}  |   # either * * * (spaces optional)
@@ -710,7 +882,7 @@ def hr_sub(match):
     """Matches a horizontal rule."""
     return '\n\n<hr/>\n\n'
 
-emphasis_re = re.compile(r"""
+emphasis_re = lazy.compile(r"""
     (?<!\\)             # avoid escapes
     (\*{1,3}|_{1,3})    # \1 is the emphasis marker
     (?!\s+)             # emphasis cannot contain leading whitespace
@@ -728,12 +900,12 @@ def emphasis_sub(match):
     elif level == 1:
         return '<em>{0}</em>'.format(content)
 
-auto_escape_re = re.compile(r"&(?!#[xX]?[0-9a-fA-F]+)(?!\w+;)")
+auto_escape_re = lazy.compile(r"&(?!#[xX]?[0-9a-fA-F]+)(?!\w+;)")
 def auto_escape_sub(match):
     """Escapes ampersands (&) in normal text."""
     return escape(match.group(0))
 
-escape_re = re.compile(r"""
+escape_re = lazy.compile(r"""
     \\(         # escapes are preceded by a backslash
         \*  |
         `   |
@@ -756,7 +928,7 @@ def escapes_sub(match):
     """Substitutes escaped characters."""
     return match.group(1)
 
-atx_header_re = re.compile(r"""
+atx_header_re = lazy.compile(r"""
     ^(\#{1,6})  # \1 is leading #s
     [ \t]*
     (.*?)       # \2 is header title
@@ -773,18 +945,9 @@ def atx_header_sub(match):
     """Substitutes atx headers (headers defined using #'s)."""
     level = len(match.group(1))
     title = match.group(2)
+    return header_html(level, title, match.group(3))
 
-    id_class = ''
-    ids = match.group(3) if match.group(3) else ''
-    id_match = re.search('#([\w-]+)', ids)
-    if id_match:
-        id_class += ' id="' + id_match.group(1) + '"'
-    classes = ' '.join(re.findall('\.([\w-]+)', ids))
-    if classes:
-        id_class += ' class="' + classes + '"'
-    return '\n<h{0}{2}>{1}</h{0}>\n'.format(level, title, id_class)
-
-setext_header_re = re.compile(r"""
+setext_header_re = lazy.compile(r"""
     (?:(?<=\n)|(?<=\A))     # begin at newline
     ([^\n]+?)               # \1 is header title
     [ \t]*(?:
@@ -800,9 +963,18 @@ def setext_header_sub(match):
     """Substitutes setext headers (defined with underscores)."""
     title = match.group(1)
     level = 1 if '=' in match.group(3) else 2
+    return header_html(level, title, match.group(2))
 
+def header_html(level, title, ids):
+    """Returns the HTML for a header, surrounded by newlines.
+
+    PARAMETERS:
+    level -- int; the header level, from 1 to 6
+    title -- str; the header title
+    ids   -- str or None; optional id/class attributes, e.g. "#id .class"
+    """
     id_class = ''
-    ids = match.group(2) if match.group(2) else ''
+    ids = ids if ids else ''
     id_match = re.search('#([\w-]+)', ids)
     if id_match:
         id_class += ' id="' + id_match.group(1) + '"'
@@ -832,7 +1004,7 @@ avoids = r"""
 </h\2>              |
 <hr/?>
 """
-paragraph_re = re.compile(r"""
+paragraph_re = lazy.compile(r"""
 (?:(?<=\n\n)|(?<=\A))   # begin at newline
 (?!\n)                  # but don't include newlines in paragraph
 (?!%s)                  # avoid certain strings
@@ -859,7 +1031,7 @@ def postprocess(text, markdown_obj, footnotes=False):
         text += generate_footnotes(markdown_obj)
     return text
 
-slug_re = re.compile(r"""
+slug_re = lazy.compile(r"""
     <
         \s*
         (h[0-6])     # \1 is the opening header level
@@ -895,11 +1067,555 @@ def generate_footnotes(markdown_obj):
         return ''
     text = '\n\n<hr/>\n\n<div id="footnotes">\n  <ol>\n'
     for i, footnote in enumerate(footnotes.values()):
-        text += '    <li id="fnref-{0}">{1}</li>\n'.format(i+1, convert(footnote))
+        footnote = Markdown(footnote, engine=markdown_obj.engine, cache=markdown_obj.cache)
+        text += '    <li id="fnref-{0}">{1}</li>\n'.format(i+1, footnote.text)
     text += '  </ol>\n</div>'
     return text
 
+################
+# Token Engine #
+################
+
+def render_tokens(text, markdown_obj):
+    """Converts Markdown text into HTML using the token engine.
+
+    Instead of hashing and substituting over the whole text once for
+    every syntax element, the token engine scans the lines of the text
+    once into block tokens (see BlockScanner), and scans the text of
+    each paragraph and header once into inline tokens (see
+    render_inline). Containers (lists, block quotes and table cells)
+    are converted recursively, just like in the regex engine.
+
+    The HTML for each block is produced by the same functions the regex
+    engine uses, and the newlines between blocks follow the regex
+    engine (see token_gap), so that both engines produce the same HTML.
+    """
+    scanner = BlockScanner(text, markdown_obj.footnotes)
+    tokens = scanner.scan()
+    html = ''
+    i = 0
+    gap_change = 0
+    while i < len(tokens):
+        if i > 0:
+            html += '\n' * (token_gap(tokens[i - 1], tokens[i], scanner.removed) + gap_change)
+        gap_change = 0
+        if tokens[i].kind != 'paragraph':
+            html += render_block(tokens[i], scanner.lines, markdown_obj)
+            i += 1
+        elif is_horizontal_rule(tokens, i, scanner):
+            html += '<hr/>'
+            i += 1
+        else:
+            paragraph, i, gap_change = render_paragraph(tokens, i, scanner, markdown_obj)
+            html += paragraph
+    return pull_out_pre_tags(html)
+
+Token = namedtuple('Token', ['kind', 'start', 'stop', 'data'])
+Token.__doc__ = """A block of Markdown text.
+
+kind  -- str; one of 'block', 'list', 'blockquote', 'pre', 'table',
+         'header' or 'paragraph'
+start -- int; index of the first line of the block
+stop  -- int; index after the last non-blank line of the block
+data  -- kind-specific data, e.g. the list style and the number of
+         newlines after its last item, or the level, title and id/class
+         attributes of a header
+"""
+
+# Blocks that the regex engine hashes before tables, replacing the
+# newlines around them with a blank line on each side.
+ABSORBING_BLOCKS = ('block', 'list', 'blockquote', 'pre')
+
+def token_gap(before, after, removed=()):
+    """Returns the number of newlines between two consecutive blocks.
+
+    Newlines in the Markdown text are kept, except next to blocks that
+    the regex engine hashes: those leave a blank line, and tables add
+    another blank line on their side. Headers carry their own
+    surrounding newlines (see header_html).
+
+    Lines in removed (see BlockScanner.removed_line) are only emptied
+    after blocks are hashed, so the blank lines that a hashed block
+    absorbs stop at them.
+    """
+    if before.kind in ABSORBING_BLOCKS or after.kind in ABSORBING_BLOCKS:
+        gap = 2
+        between = [j for j in range(before.stop, after.start) if j in removed]
+        if between:
+            first, last = between[0], between[-1]
+            if before.kind not in ABSORBING_BLOCKS:
+                gap = first - before.stop + 1
+            gap += last - first + (2 if after.kind in ABSORBING_BLOCKS else after.start - last)
+    else:
+        gap = after.start - before.stop + 1
+    return gap + (before.kind == 'table') * 2 + (after.kind == 'table') * 2
+
+re_html_block = lazy.compile(r"""
+<
+    \s*
+    (%s)                 # \1 is block_tags
+    (?:.*?)              # any attributes
+>
+.*?                      # contents in block element
+\n<                      # close must start at front of newline
+    \s*/\s*
+    \1                   # matching close tag
+    \s*
+>
+""" % block_tags, re.S | re.X)
+re_list_start = {
+    'u': lazy.compile(r' {0,3}[+*-](?! [+*-] ) '),
+    'o': lazy.compile(r' {0,3}\d+\.(?! \d+\. ) '),
+}
+re_list_item = {
+    'u': lazy.compile(r' {0,3}[+*-] '),
+    'o': lazy.compile(r' {0,3}\d+\. '),
+}
+re_table_separator = lazy.compile(r'[ :|-]*\|[ :|-]*$')
+re_setext_underline = lazy.compile(r'(?:=+|-+)$')
+re_hr_line = lazy.compile(r'(?:(?:\*[ ]?){3,}|(?:-[ ]?){3,})$')
+
+class BlockScanner:
+    """Scans the lines of Markdown text into a list of Tokens.
+
+    Block elements take precedence over each other in the same order as
+    in the regex engine: HTML blocks, unordered lists, ordered lists,
+    block quotes, codeblocks and tables. A block ends where a block of
+    higher precedence starts; the remaining lines are paragraphs and
+    headers.
+    """
+    def __init__(self, text, footnotes=()):
+        self.text = text
+        self.footnotes = footnotes
+        self.lines = text.split('\n')
+        self.removed = set()  # Indices of the lines that removed_line skipped.
+        self.offsets = []
+        offset = 0
+        for line in self.lines:
+            self.offsets.append(offset)
+            offset += len(line) + 1
+        self._html_blocks = {}
+        # Lines that cannot start an HTML block: text after the closing
+        # tag of an HTML block, and the first line after the blank lines
+        # that follow an HTML block.
+        self._not_html = set()
+
+    def scan(self):
+        lines = self.lines
+        tokens = []
+        i = 0
+        while i < len(lines):
+            if not lines[i]:
+                i += 1
+                continue
+            elif self.removed_line(i):
+                self.removed.add(i)
+                i += 1
+                continue
+            kind = self.block_start(i)
+            if kind == 'block':
+                token, i = self.scan_html_block(i)
+                tokens.append(token)
+            elif kind in ('ulist', 'olist'):
+                stop = self.scan_list(i, kind[0])
+                trailing_newlines = self.list_trailing_newlines(stop, kind[0])
+                tokens.append(Token('list', i, stop, (kind[0], trailing_newlines)))
+                i = stop
+            elif kind == 'blockquote':
+                stop = self.scan_blockquote(i)
+                tokens.append(Token('blockquote', i, stop, None))
+                i = stop
+            elif kind == 'pre':
+                stop = self.scan_codeblock(i)
+                tokens.append(Token('pre', i, stop, None))
+                i = stop
+            elif self.table_start(i):
+                stop = self.scan_table(i)
+                tokens.append(Token('table', i, stop, None))
+                i = stop
+            else:
+                stop = self.scan_text(i)
+                self.split_text(i, stop, tokens)
+                i = stop
+        return tokens
+
+    def block_start(self, i):
+        """Returns the kind of block (other than a table) that starts on
+        line i, or None.
+        """
+        line = self.lines[i]
+        if line.startswith('<') and self.html_block(i):
+            return 'block'
+        elif re_list_start['u'].match(line):
+            return 'ulist'
+        elif re_list_start['o'].match(line):
+            return 'olist'
+        elif line.startswith('> '):
+            return 'blockquote'
+        elif line.startswith('    ') and len(line) > 4:
+            return 'pre'
+        return None
+
+    def table_start(self, i):
+        """Returns True if a table header is on line i."""
+        lines = self.lines
+        return '|' in lines[i] and i + 1 < len(lines) \
+                and re_table_separator.match(lines[i + 1]) is not None \
+                and self.block_start(i + 1) is None
+
+    def html_block(self, i):
+        """Returns the re_html_block match that starts on line i, or
+        None.
+        """
+        if i in self._not_html:
+            return None
+        if i not in self._html_blocks:
+            self._html_blocks[i] = re_html_block.match(self.text, self.offsets[i])
+        return self._html_blocks[i]
+
+    def scan_html_block(self, i):
+        """Returns the Token for the HTML block on line i, and the index
+        of the line to scan next.
+
+        Any text after the closing tag is scanned as a line of its own.
+        """
+        match = self.html_block(i)
+        end = match.end()
+        last = bisect_right(self.offsets, end - 1) - 1
+        remainder = self.text[end:self.offsets[last] + len(self.lines[last])]
+        token = Token('block', i, last + 1, match.group(0))
+        if not remainder:
+            self._not_html.add(self.skip_blank_lines(last + 1))
+            return token, last + 1
+        self.lines[last] = remainder
+        self.offsets[last] = end
+        self._not_html.add(last)
+        return token, last
+
+    def scan_list(self, i, style):
+        """Returns the index after the last line of the list on line i.
+
+        List items continue across blank lines if the next line is
+        indented by at least two spaces or starts another item.
+        """
+        lines = self.lines
+        stop = i + 1
+        j = i + 1
+        while j < len(lines):
+            if not lines[j]:
+                j = self.skip_blank_lines(j)
+                if j == len(lines) or not (lines[j].startswith('  ')
+                        or re_list_start[style].match(lines[j])):
+                    break
+                continue
+            kind = self.block_start(j)
+            if kind == 'block' or (style == 'o' and kind == 'ulist'):
+                break
+            j += 1
+            stop = j
+        return stop
+
+    def list_trailing_newlines(self, stop, style):
+        """Returns the number of newlines that the regex engine keeps
+        at the end of the last item of the list that ends before line
+        stop.
+        """
+        j = self.skip_blank_lines(stop)
+        if j == len(self.lines):
+            return j - stop
+        kind = self.block_start(j)
+        if kind == 'block' or (style == 'o' and kind == 'ulist'):
+            return 2  # The block is hashed first, leaving a blank line before it.
+        return j - stop + 1
+
+    def scan_blockquote(self, i):
+        """Returns the index after the last line of the block quote on
+        line i.
+
+        Sections of a block quote are separated by a blank line and
+        start with "> ".
+        """
+        lines = self.lines
+        stop = i + 1
+        j = i + 1
+        while j < len(lines):
+            if not lines[j]:
+                j = self.skip_blank_lines(j)
+                if j == len(lines) or not lines[j].startswith('> '):
+                    break
+                continue
+            if self.block_start(j) in ('block', 'ulist', 'olist'):
+                break
+            j += 1
+            stop = j
+        return stop
+
+    def scan_codeblock(self, i):
+        """Returns the index after the last line of the codeblock on
+        line i.
+        """
+        lines = self.lines
+        stop = i + 1
+        j = i + 1
+        while j < len(lines):
+            if lines[j].startswith('    ') and len(lines[j]) > 4:
+                j += 1
+                stop = j
+            elif not lines[j]:
+                j += 1
+            else:
+                break
+        return stop
+
+    def scan_table(self, i):
+        """Returns the index after the last row of the table on line i."""
+        lines = self.lines
+        j = i + 2
+        while j < len(lines) and '|' in lines[j] and self.block_start(j) is None:
+            j += 1
+        return j
+
+    def scan_text(self, i):
+        """Returns the index after the last line of text that starts on
+        line i.
+        """
+        lines = self.lines
+        j = i + 1
+        while j < len(lines) and lines[j] and self.block_start(j) is None \
+                and not self.table_start(j) and not self.removed_line(j):
+            j += 1
+        return j
+
+    def removed_line(self, i):
+        """Returns True if line i only holds references to undefined
+        footnotes. The regex engine removes them after it hashes blocks,
+        so that the line separates paragraphs like a blank line.
+        """
+        line = self.lines[i]
+        return line.startswith('[^') and not re_footnote.sub(
+                lambda match: '' if match.group(1) not in self.footnotes else match.group(0),
+                line)
+
+    def skip_blank_lines(self, i):
+        while i < len(self.lines) and not self.lines[i]:
+            i += 1
+        return i
+
+    def split_text(self, start, stop, tokens):
+        """Splits lines of text into headers and paragraphs, and appends
+        them to tokens.
+        """
+        lines = self.lines
+        paragraph = start
+        i = start
+        while i < stop:
+            if lines[i].startswith('#'):
+                match = atx_header_re.match(lines[i])
+                header_lines = 1
+                header = (len(match.group(1)), match.group(2), match.group(3))
+            elif i + 1 < stop and re_setext_underline.match(lines[i + 1]):
+                match = setext_header_re.match(lines[i] + '\n' + lines[i + 1])
+                header_lines = 2
+                header = (1 if '=' in match.group(3) else 2, match.group(1), match.group(2))
+            else:
+                i += 1
+                continue
+            if paragraph < i:
+                tokens.append(Token('paragraph', paragraph, i, None))
+            tokens.append(Token('header', i, i + header_lines, header))
+            i += header_lines
+            paragraph = i
+        if paragraph < stop:
+            tokens.append(Token('paragraph', paragraph, stop, None))
+
+def render_block(token, lines, markdown_obj):
+    """Returns the HTML for a Token other than a paragraph."""
+    kind = token.kind
+    if kind == 'block':
+        return token.data
+    elif kind == 'list':
+        items = []
+        for line in lines[token.start:token.stop]:
+            match = re_list_item[token.data[0]].match(line)
+            if match:
+                items.append(line[match.end():])
+            else:
+                items[-1] += '\n' + line
+        style, trailing_newlines = token.data
+        items[-1] += '\n' * trailing_newlines
+        return list_html(style, items, markdown_obj)
+    elif kind == 'blockquote':
+        return blockquote_html('\n'.join(lines[token.start:token.stop]), markdown_obj)
+    elif kind == 'pre':
+        return codeblock_html('\n'.join(lines[token.start:token.stop]))
+    elif kind == 'table':
+        return table_html(lines[token.start:token.stop], markdown_obj)
+    elif kind == 'header':
+        level, title, ids = token.data
+        return header_html(level, render_inline(title, markdown_obj), ids)
+
+def is_horizontal_rule(tokens, i, scanner):
+    """Returns True if the paragraph tokens[i] is a horizontal rule: a
+    line of three or more *'s or -'s surrounded by blank lines.
+    """
+    token = tokens[i]
+    if token.stop - token.start != 1 or re_hr_line.match(scanner.lines[token.start]) is None:
+        return False
+    # At the ends of the text, the lines before the first block and after
+    # the last one count (e.g. removed lines, see BlockScanner.removed_line).
+    if i > 0:
+        before = token_gap(tokens[i - 1], token, scanner.removed)
+    else:
+        before = token.start
+    if i < len(tokens) - 1:
+        after = token_gap(token, tokens[i + 1], scanner.removed)
+    else:
+        after = len(scanner.lines) - token.stop
+    if before < 2 or after < 2:
+        return False
+    # The regex engine takes the blank line after a horizontal rule along
+    # with it, so a horizontal rule cannot directly follow another one.
+    return i == 0 or tokens[i - 1].kind != 'paragraph' \
+            or not is_horizontal_rule(tokens, i - 1, scanner)
+
+def render_paragraph(tokens, i, scanner, markdown_obj):
+    """Returns the HTML for the paragraph tokens[i].
+
+    Like in the regex engine, a paragraph that starts with a tag or
+    that follows a single leading newline is not wrapped in <p> tags,
+    and a paragraph whose last line ends in a line break continues past
+    a single blank line, taking in the blocks that follow it.
+
+    RETURNS:
+    html       -- str; the HTML of the paragraph
+    i          -- int; the index of the next token to render
+    gap_change -- int; the change in the number of newlines before the
+                  next token
+    """
+    token = tokens[i]
+    lines = scanner.lines
+    text, atoms = tokenize_inline('\n'.join(lines[token.start:token.stop]), markdown_obj)
+    # Removed footnote references can leave newlines at the start.
+    content = text.lstrip('\n')
+    newlines = len(text) - len(content) + (token.start if i == 0 else 2)
+    first_atom = re_atom.match(content)
+    if (first_atom and atoms[int(first_atom.group(1))][1]) or newlines == 1:
+        return restore_atoms(text, atoms), i + 1, 0
+    elif not content:
+        return text, i + 1, 0
+    gap_change = 0
+    while token.kind == 'paragraph' and lines[token.stop - 1].endswith('  ') \
+            and i + 1 < len(tokens):
+        following = tokens[i + 1]
+        gap = token_gap(token, following, scanner.removed)
+        if gap + (following.kind == 'header') > 2:
+            # The paragraph ends after the newline of its line break.
+            gap_change = -1
+            break
+        i += 1
+        if following.kind == 'paragraph' and not is_horizontal_rule(tokens, i, scanner):
+            following_text = '\n'.join(lines[following.start:following.stop])
+            text += '\n' * gap + tokenize_inline(following_text, markdown_obj, atoms)[0]
+        else:
+            if following.kind == 'paragraph':
+                block = '<hr/>'
+            else:
+                block = render_block(following, lines, markdown_obj)
+            # The newline after a header follows the paragraph.
+            if block.endswith('\n'):
+                block = block[:-1]
+                gap_change = 1
+            text += '\n' * gap + '\ue000{}\ue001'.format(len(atoms))
+            atoms.append((block, False))
+        token = following
+    leading = text[:len(text) - len(text.lstrip('\n'))]
+    text = re.sub(r'  \n', r'\n<br/>\n', text.strip())
+    return leading + '<p>{}</p>'.format(restore_atoms(text, atoms)), i + 1, gap_change
+
+def render_inline(text, markdown_obj):
+    """Returns the HTML for inline Markdown text (e.g. a header title)."""
+    text, atoms = tokenize_inline(text, markdown_obj)
+    return restore_atoms(text, atoms)
+
+re_inline_start = lazy.compile('[`\\[!<\ue000\ue001]')
+re_atom = lazy.compile('\ue000(\\d+)\ue001')
+def tokenize_inline(text, markdown_obj, atoms=None):
+    """Scans inline Markdown text once for links, code, footnote
+    references and tags.
+
+    PARAMETERS:
+    text         -- str; inline Markdown text
+    markdown_obj -- Markdown; used to convert links
+    atoms        -- list or None; if given, new inline elements are
+                    appended to it
+
+    RETURNS:
+    text  -- str; the text with emphasis, escapes and ampersands
+             converted, and with every inline element replaced by a
+             placeholder
+    atoms -- list of (str, bool); the HTML of each inline element, and
+             whether the element is a tag
+    """
+    if atoms is None:
+        atoms = []
+    pieces = []
+    start = pos = 0
+    while True:
+        match = re_inline_start.search(text, pos)
+        if not match:
+            break
+        pos = match.start()
+        atom, is_tag, end = scan_inline_element(text, pos, markdown_obj)
+        if atom is None:
+            pos += 1
+            continue
+        pieces.append(text[start:pos])
+        if atom:
+            pieces.append('\ue000{}\ue001'.format(len(atoms)))
+            atoms.append((atom, is_tag))
+        start = pos = end
+    pieces.append(text[start:])
+    text = ''.join(pieces)
+    text = emphasis_re.sub(emphasis_sub, text)
+    text = escape_re.sub(escapes_sub, text)
+    text = auto_escape_re.sub(auto_escape_sub, text)
+    return text, atoms
+
+def scan_inline_element(text, pos, markdown_obj):
+    """Returns the HTML of the inline element at text[pos], whether it
+    is a tag, and the index after the element. The HTML is None if no
+    element starts at pos, and empty if the element is removed.
+    """
+    char = text[pos]
+    if char == '`':
+        match = re_code.match(text, pos)
+        if match:
+            return '<code>{}</code>'.format(escape(match.group(2))), False, match.end()
+    elif char == '<':
+        match = re_tag.match(text, pos)
+        if match:
+            return match.group(0), True, match.end()
+    elif char in '[!':
+        match = re_footnote.match(text, pos)
+        if match:
+            footnotes = list(markdown_obj.footnotes)
+            if match.group(1) not in footnotes:
+                return '', False, match.end()
+            number = footnotes.index(match.group(1)) + 1
+            return '<sup><a href="#fnref-{0}">{0}</a></sup>'.format(number), False, match.end()
+        match = re_inline_link.match(text, pos)
+        if match:
+            return inline_link_html(match, markdown_obj), False, match.end()
+        match = re_reference_link.match(text, pos)
+        if match:
+            return reference_link_html(match, markdown_obj), False, match.end()
+    else:
+        # Placeholder characters in the source are kept as they are.
+        return char, False, pos + 1
+    return None, False, pos
 
+def restore_atoms(text, atoms):
+    return re_atom.sub(lambda match: atoms[int(match.group(1))][0], text)
 
 ##########################
 # Command-line Interface #
@@ -910,9 +1626,12 @@ def cmd_options(parser):
                         help="Convert contents of Markdown file")
     parser.add_argument('-d', '--destination', type=str,
                         help="Store result in destination file")
+    parser.add_argument('--engine', choices=ENGINES, default=REGEX_ENGINE,
+                        help="Markdown engine to convert with")
 
 def main(args=None):
     if not args:
+        import argparse  # Only the command line needs it.
         parser = argparse.ArgumentParser()
         cmd_options(parser)
         args = parser.parse_args()
@@ -932,7 +1651,7 @@ def main(args=None):
             exit(1)
         with open(args.source, 'r') as f:
             text = f.read()
-    result = convert(text)
+    result = convert(text, args.engine)
     if args.destination:
         with open(args.destination, 'w') as f:
             f.write(result)
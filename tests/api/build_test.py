@@ -0,0 +1,369 @@
+"""Integration tests using templar/api/build.py"""
+
+from templar.api.build import BuildError
+from templar.api.build import Page
+from templar.api.build import Watcher
+from templar.api.build import build
+from templar.api.build import load_manifest
+from templar.api.config import ConfigBuilder
+from templar.api.rules.core import Rule
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+class BuildTest(unittest.TestCase):
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        self.write('pageA.md', self.join_lines(
+            '<include partial.md:nav>',
+            'page A'))
+        self.write('pageB.md', 'page B')
+        self.write('partial.md', self.join_lines(
+            '<block nav>',
+            'nav',
+            '</block nav>'))
+        self.write('config.py', 'config = None')
+        self.write('base.html', '<body>{% block body %}{% endblock %}</body>')
+        self.write('page.html', self.join_lines(
+            '{% extends "base.html" %}',
+            '{% block body %}{{ blocks.all }}{% endblock %}'))
+        self.write('plain.html', '{{ blocks.all }}')
+        self.config = ConfigBuilder().add_template_dirs(self.staging_dir).build()
+        self.pages = [
+            Page(self.path('pageA.md'), 'page.html', self.path('out', 'a.html')),
+            Page(self.path('pageB.md'), 'plain.html', self.path('out', 'b.html')),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.staging_dir)
+
+    def testBuildAllPages(self):
+        results = build(self.config, self.pages)
+        self.assertEqual([True, True], [result.built for result in results])
+        self.assertEqual('<body>nav\npage A</body>', self.read('out', 'a.html'))
+        self.assertEqual('page B', self.read('out', 'b.html'))
+
+    def testBuildAllPages_withoutState(self):
+        build(self.config, self.pages)
+        results = build(self.config, self.pages)
+        self.assertEqual([True, True], [result.built for result in results])
+
+    def testBuildAllPages_skipUnchangedWrites(self):
+        results = build(self.config, self.pages)
+        self.assertEqual([True, True], [result.written for result in results])
+        self.write('pageB.md', 'new page B')
+        results = build(self.config, self.pages)
+        self.assertEqual([True, True], [result.built for result in results])
+        self.assertEqual([False, True], [result.written for result in results])
+        self.assertEqual('new page B', self.read('out', 'b.html'))
+
+    def testIncremental_skipUnchangedPages(self):
+        self.assertEqual([True, True], self.build_incrementally())
+        self.assertEqual([False, False], self.build_incrementally())
+
+    def testIncremental_changedInclude(self):
+        self.build_incrementally()
+        self.write('partial.md', self.join_lines(
+            '<block nav>',
+            'new nav',
+            '</block nav>'))
+        self.assertEqual([True, False], self.build_incrementally())
+        self.assertEqual('<body>new nav\npage A</body>', self.read('out', 'a.html'))
+
+    def testIncremental_touchedInclude(self):
+        self.build_incrementally()
+        with open(self.path('partial.md'), 'r') as f:
+            self.write('partial.md', f.read())
+        self.assertEqual([False, False], self.build_incrementally())
+
+    def testIncremental_changedTemplate(self):
+        self.build_incrementally()
+        self.write('base.html', '<main>{% block body %}{% endblock %}</main>')
+        self.assertEqual([True, False], self.build_incrementally())
+        self.assertEqual('<main>nav\npage A</main>', self.read('out', 'a.html'))
+
+    def testIncremental_changedConfig(self):
+        self.build_incrementally()
+        self.write('config.py', 'config = 1')
+        self.assertEqual([True, True], self.build_incrementally())
+
+    def testIncremental_changedPage(self):
+        self.build_incrementally()
+        self.pages[1] = Page(self.path('pageB.md'), 'page.html', self.path('out', 'b.html'))
+        self.assertEqual([False, True], self.build_incrementally())
+
+    def testIncremental_missingDestination(self):
+        self.build_incrementally()
+        os.remove(self.path('out', 'b.html'))
+        self.assertEqual([False, True], self.build_incrementally())
+
+    def testIncremental_dynamicTemplateReference(self):
+        self.write('plain.html', '{% include blocks.all %}')
+        self.write('pageB.md', 'base.html')
+        self.build_incrementally()
+        self.assertEqual([False, True], self.build_incrementally())
+
+    def testIncremental_corruptState(self):
+        self.build_incrementally()
+        self.write('state.json', '{')
+        self.assertEqual([True, True], self.build_incrementally())
+
+    def testParallel(self):
+        self.pages.extend(
+                Page(self.path('pageB.md'), 'plain.html', self.path('out', '{}.html'.format(i)))
+                for i in range(10))
+        results = build(self.config, self.pages, workers=2, chunksize=3)
+        self.assertEqual(self.pages, [result.page for result in results])
+        self.assertEqual('<body>nav\npage A</body>', self.read('out', 'a.html'))
+        self.assertEqual('page B', self.read('out', '9.html'))
+
+    def testParallel_incremental(self):
+        self.assertEqual([True, True], self.build_incrementally(workers=2))
+        self.write('partial.md', self.join_lines(
+            '<block nav>',
+            'new nav',
+            '</block nav>'))
+        self.assertEqual([True, False], self.build_incrementally(workers=2))
+
+    def testParallel_withoutInitializer(self):
+        self.pages.extend(
+                Page(self.path('pageB.md'), 'plain.html', self.path('out', '{}.html'.format(i)))
+                for i in range(10))
+        with mock.patch('templar.api.build._POOL_INITIALIZER', False):
+            results = build(self.config, self.pages, workers=2, chunksize=3)
+        self.assertEqual(self.pages, [result.page for result in results])
+        self.assertEqual('<body>nav\npage A</body>', self.read('out', 'a.html'))
+        self.assertEqual('page B', self.read('out', '9.html'))
+
+    def testParallel_unpicklableConfig(self):
+        class ConfigFileRule(Rule):
+            # Like rules defined in a config file, this class cannot be pickled.
+            def apply(self, content):
+                return content
+
+        config = self.config.to_builder().append_compiler_rules(ConfigFileRule()).build()
+        with mock.patch('multiprocessing.get_start_method', return_value='spawn'):
+            with self.assertRaises(BuildError) as cm:
+                build(config, self.pages, workers=2)
+        self.assertTrue(str(cm.exception).startswith(
+            'Cannot build with 2 workers, because the config cannot be sent to worker processes'))
+        self.assertFalse(os.path.exists(self.path('out')))
+        # Forked worker processes do not need to pickle the config.
+        with mock.patch('multiprocessing.get_start_method', return_value='fork'):
+            build(config, self.pages, workers=2)
+        self.assertEqual('page B', self.read('out', 'b.html'))
+
+    def testAggregateErrors(self):
+        self.write('pageC.md', '<include missing.md>')
+        self.pages.insert(0, Page(self.path('pageC.md'), None, self.path('out', 'c.html')))
+        self.pages.append(Page(None, 'missing.html', self.path('out', 'd.html')))
+        for workers in (1, 2):
+            with self.assertRaises(BuildError) as cm:
+                build(self.config, self.pages, workers=workers)
+            lines = str(cm.exception).splitlines()
+            self.assertEqual(3, len(lines))
+            self.assertEqual('Failed to build 2 of 4 pages:', lines[0])
+            self.assertEqual(
+                    self.path('out', 'c.html') + ': IncludeNonExistentBlock: ' + \
+                            self.path('pageC.md') + ' tried to include a non-existent file: missing.md',
+                    lines[1])
+            self.assertTrue(lines[2].startswith(
+                self.path('out', 'd.html') + ': TemplateNotFound: '))
+            # Other pages are still built.
+            self.assertEqual('page B', self.read('out', 'b.html'))
+            os.remove(self.path('out', 'b.html'))
+
+    def testAggregateErrors_unwritableDestination(self):
+        self.pages.insert(0, Page(self.path('pageB.md'), None, self.path('pageB.md', 'c.html')))
+        for workers in (1, 2):
+            with self.assertRaises(BuildError) as cm:
+                build(self.config, self.pages, workers=workers)
+            lines = str(cm.exception).splitlines()
+            self.assertEqual(2, len(lines))
+            self.assertEqual('Failed to build 1 of 3 pages:', lines[0])
+            self.assertTrue(lines[1].startswith(
+                self.path('pageB.md', 'c.html') + ': FileExistsError: '))
+            self.assertEqual('page B', self.read('out', 'b.html'))
+            os.remove(self.path('out', 'b.html'))
+
+    def testPreventInvalidWorkers(self):
+        with self.assertRaises(BuildError) as cm:
+            build(self.config, self.pages, workers=0)
+        self.assertEqual('workers must be a positive integer, but instead was: 0', str(cm.exception))
+
+    def testPreventDuplicateDestinations(self):
+        pages = [self.pages[0], self.pages[0]]
+        with self.assertRaises(BuildError) as cm:
+            build(self.config, pages)
+        self.assertEqual(
+                'Found multiple pages with destination: ' + self.path('out', 'a.html'),
+                str(cm.exception))
+
+    def testPreventMissingDestination(self):
+        with self.assertRaises(BuildError) as cm:
+            build(self.config, [Page(self.path('pageB.md'), None, None)])
+        self.assertEqual(
+                'Every page must have a destination, but found: ' + \
+                        repr(Page(self.path('pageB.md'), None, None)),
+                str(cm.exception))
+
+    def testWatch_firstPollBuildsAllPages(self):
+        watcher = self.watcher()
+        results, errors = watcher.poll()
+        self.assertEqual(self.pages, [result.page for result in results])
+        self.assertEqual([], errors)
+        self.assertEqual('<body>nav\npage A</body>', self.read('out', 'a.html'))
+        self.assertEqual(([], []), watcher.poll())
+
+    def testWatch_changedInclude(self):
+        watcher = self.watcher()
+        watcher.poll()
+        self.write('partial.md', self.join_lines(
+            '<block nav>',
+            'new nav',
+            '</block nav>'))
+        self.assertEqual([self.pages[0]], self.poll_pages(watcher))
+        self.assertEqual('<body>new nav\npage A</body>', self.read('out', 'a.html'))
+
+    def testWatch_changedTemplate(self):
+        watcher = self.watcher()
+        watcher.poll()
+        self.write('plain.html', '<p>{{ blocks.all }}</p>')
+        self.assertEqual([self.pages[1]], self.poll_pages(watcher))
+        self.assertEqual('<p>page B</p>', self.read('out', 'b.html'))
+
+    def testWatch_replacedSource(self):
+        watcher = self.watcher()
+        watcher.poll()
+        with open(self.path('new.md'), 'w') as f:
+            f.write('new page B')
+        os.replace(self.path('new.md'), self.path('pageB.md'))
+        self.assertEqual([self.pages[1]], self.poll_pages(watcher))
+        self.assertEqual('new page B', self.read('out', 'b.html'))
+
+    def testWatch_createdMissingInclude(self):
+        self.write('pageB.md', '<include other.md>')
+        watcher = self.watcher()
+        self.assertEqual(
+                [self.path('out', 'b.html')],
+                [error.split(':')[0] for error in watcher.poll()[1]])
+        self.write('other.md', 'other')
+        self.assertEqual([self.pages[1]], self.poll_pages(watcher))
+        self.assertEqual('other', self.read('out', 'b.html'))
+
+    def testWatch_dynamicTemplateReference(self):
+        self.write('plain.html', '{% include blocks.all %}')
+        self.write('pageB.md', 'base.html')
+        watcher = self.watcher()
+        watcher.poll()
+        self.write('pageA.md', 'new page A')
+        self.assertEqual(self.pages, self.poll_pages(watcher))
+
+    def testWatch_changedReloadPath(self):
+        loaded_configs = []
+        def load_config():
+            loaded_configs.append(self.config)
+            return self.config
+        watcher = Watcher(load_config, lambda: self.pages, [self.path('config.py')])
+        watcher.poll()
+        self.write('config.py', 'config = 1')
+        self.assertEqual(self.pages, self.poll_pages(watcher))
+        self.assertEqual(2, len(loaded_configs))
+
+    def testWatch_configError(self):
+        def load_config():
+            raise SyntaxError('invalid syntax')
+        watcher = Watcher(load_config, lambda: self.pages, [self.path('config.py')])
+        self.assertEqual(
+                ([], ['Could not load the config and pages: SyntaxError: invalid syntax']),
+                watcher.poll())
+        self.assertEqual(([], []), watcher.poll())
+
+    def testLoadManifest(self):
+        os.mkdir(self.path('docs'))
+        os.mkdir(self.path('docs', 'nested'))
+        self.write(os.path.join('docs', 'b.md'), '')
+        self.write(os.path.join('docs', 'nested', 'a.md'), '')
+        self.write(os.path.join('docs', 'ignored.txt'), '')
+        self.write('manifest.json', json.dumps({
+            'pages': [
+                {'source': 'index.md', 'template': 'index.html', 'destination': 'index.html'},
+                {'template': 'about.html', 'destination': 'about.html'},
+            ],
+            'globs': [
+                {'root': self.path('docs'), 'sources': '*.md', 'destination': 'site/{path}.html'},
+            ],
+        }))
+        self.assertEqual([
+            Page('index.md', 'index.html', 'index.html'),
+            Page(None, 'about.html', 'about.html'),
+            Page(self.path('docs', 'b.md'), None, 'site/b.html'),
+            Page(self.path('docs', 'nested', 'a.md'), None, os.path.join('site', 'nested', 'a.html')),
+        ], load_manifest(self.path('manifest.json')))
+
+    def testLoadManifest_preventMissingKeys(self):
+        self.write('manifest.json', json.dumps({'pages': [{'source': 'index.md'}]}))
+        with self.assertRaises(BuildError) as cm:
+            load_manifest(self.path('manifest.json'))
+        self.assertEqual(
+                'Manifest entry is missing "destination": {"source": "index.md"}',
+                str(cm.exception))
+
+    def testLoadManifest_preventUnknownKeys(self):
+        self.write('manifest.json', json.dumps({'pages': [{'destination': 'a', 'sauce': 'b'}]}))
+        with self.assertRaises(BuildError) as cm:
+            load_manifest(self.path('manifest.json'))
+        self.assertEqual(
+                'Unknown key "sauce" in manifest entry: {"destination": "a", "sauce": "b"}',
+                str(cm.exception))
+
+    def testLoadManifest_preventInvalidJson(self):
+        self.write('manifest.json', '{')
+        with self.assertRaises(BuildError) as cm:
+            load_manifest(self.path('manifest.json'))
+        self.assertTrue(str(cm.exception).startswith(
+            'Could not parse manifest file ' + self.path('manifest.json')))
+
+    ##################
+    # Test utilities #
+    ##################
+
+    def build_incrementally(self, workers=1):
+        results = build(
+                self.config,
+                self.pages,
+                state_path=self.path('state.json'),
+                config_path=self.path('config.py'),
+                workers=workers)
+        return [result.built for result in results]
+
+    def watcher(self):
+        return Watcher(lambda: self.config, lambda: self.pages, [self.path('config.py')])
+
+    def poll_pages(self, watcher):
+        results, errors = watcher.poll()
+        self.assertEqual([], errors)
+        return [result.page for result in results]
+
+    def path(self, *parts):
+        return os.path.join(self.staging_dir, *parts)
+
+    def read(self, *parts):
+        with open(self.path(*parts), 'r') as f:
+            return f.read()
+
+    def write(self, filename, content):
+        """Writes a file, making sure that its modification time changes."""
+        path = self.path(filename)
+        mtime = os.stat(path).st_mtime if os.path.exists(path) else None
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime + 1, mtime + 1))
+
+    def join_lines(self, *lines):
+        return '\n'.join(lines)
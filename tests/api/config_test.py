@@ -2,8 +2,15 @@
 
 from templar.api.config import ConfigBuilder
 from templar.api.config import ConfigBuilderError
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
+from templar.api.rules.core import FusedSubstitutionRule
 from templar.api.rules.core import Rule
+from templar.api.rules.core import SubstitutionRule
 
+import os.path
+import pickle
+import shutil
+import tempfile
 import unittest
 import mock
 
@@ -148,6 +155,185 @@ class ConfigBuilderTest(unittest.TestCase):
         builder.append_postprocess_rules(rule3)
         self.assertSequenceEqual([rule1, rule2, rule3], builder.build().rules)
 
+    def testApplicableRules(self):
+        rule1, rule2, rule3 = Rule(src=r'\.md'), Rule(dst=r'\.txt'), Rule()
+        config = ConfigBuilder() \
+                .append_preprocess_rules(rule1) \
+                .append_compiler_rules(rule2) \
+                .append_postprocess_rules(rule3) \
+                .build()
+        self.assertSequenceEqual([rule1, rule3], config.applicable_rules('a.md', 'a.html'))
+        self.assertSequenceEqual([rule2, rule3], config.applicable_rules('a.rst', 'a.txt'))
+        self.assertSequenceEqual([rule3], config.applicable_rules(None, None))
+
+    def testApplicableRules_selectedOnce(self):
+        rule = Rule()
+        config = ConfigBuilder().append_compiler_rules(rule).build()
+        with mock.patch('templar.api.config.RuleIndex') as mock_rule_index:
+            mock_rule_index.return_value.applicable_rules.return_value = [rule]
+            self.assertSequenceEqual([rule], config.applicable_rules('a.md', 'a.html'))
+            self.assertSequenceEqual([rule], config.applicable_rules('a.md', 'a.html'))
+            config.applicable_rules('b.md', 'b.html')
+        mock_rule_index.assert_called_once_with([rule])
+        self.assertEqual(2, mock_rule_index.return_value.applicable_rules.call_count)
+
+    def testApplicableRules_markdownCache(self):
+        rule1, rule2 = MarkdownToHtmlRule(), Rule()
+        builder = ConfigBuilder().append_compiler_rules(rule1, rule2)
+        self.assertSequenceEqual([rule1, rule2], builder.build().applicable_rules('a.md', 'a.html'))
+
+        config = builder.set_cache_dir('cache/dir').build()
+        cached_rule, rule = config.applicable_rules('a.md', 'a.html')
+        self.assertIs(config.markdown_cache, cached_rule.cache)
+        self.assertIsNone(rule1.cache)
+        self.assertIs(rule2, rule)
+        # The rule is copied once per Config, rather than once per page.
+        self.assertIs(cached_rule, config.applicable_rules('b.md', 'b.html')[0])
+
+    def testFuseSubstitutionRules(self):
+        class TestRule(SubstitutionRule):
+            pattern = 'a'
+            def substitute(self, match):
+                return 'b'
+
+        rule1, rule2, rule3 = TestRule(), TestRule(), Rule()
+        builder = ConfigBuilder().append_compiler_rules(rule1, rule2, rule3)
+        # Default should be False.
+        self.assertFalse(builder.build().fuse_substitution_rules)
+        self.assertSequenceEqual(
+                [rule1, rule2, rule3], builder.build().applicable_rules('a.md', 'a.html'))
+
+        builder.set_fuse_substitution_rules(True)
+        config = builder.build()
+        self.assertTrue(config.fuse_substitution_rules)
+        self.assertTrue(config.to_builder().build().fuse_substitution_rules)
+        fused, rule = config.applicable_rules('a.md', 'a.html')
+        self.assertIsInstance(fused, FusedSubstitutionRule)
+        self.assertSequenceEqual([rule1, rule2], fused.rules)
+        self.assertIs(rule3, rule)
+        # Pages to which the same rules apply share the fused rule.
+        self.assertIs(fused, config.applicable_rules('b.md', 'b.html')[0])
+
+    def testFuseSubstitutionRules_preventNonBooleans(self):
+        with self.assertRaises(ConfigBuilderError) as cm:
+            ConfigBuilder().set_fuse_substitution_rules(1)
+        self.assertEqual(
+                'fuse_substitution_rules must be a boolean, but instead was: 1', str(cm.exception))
+
+    def testCacheDir(self):
+        builder = ConfigBuilder()
+        # Default should be None, which disables caching.
+        self.assertIsNone(builder.build().cache_dir)
+
+        builder.set_cache_dir('cache/dir')
+        self.assertEqual('cache/dir', builder.build().cache_dir)
+        self.assertEqual('cache/dir', builder.build().to_builder().build().cache_dir)
+
+        builder.set_cache_dir(None)
+        self.assertIsNone(builder.build().cache_dir)
+
+    def testCacheDir_preventNonStrings(self):
+        with self.assertRaises(ConfigBuilderError) as cm:
+            ConfigBuilder().set_cache_dir(4)
+        self.assertEqual('cache_dir must be a string or None, but instead was: 4', str(cm.exception))
+
+    def testResolveSymlinks(self):
+        builder = ConfigBuilder()
+        # Default should be True.
+        self.assertTrue(builder.build().resolve_symlinks)
+
+        builder.set_resolve_symlinks(False)
+        self.assertFalse(builder.build().resolve_symlinks)
+        self.assertFalse(builder.build().to_builder().build().resolve_symlinks)
+
+    def testLinker(self):
+        config = ConfigBuilder().build()
+        self.assertIs(config.linker, config.linker)
+        self.assertIsNone(config.linker.cache)
+        self.assertTrue(config.linker.resolve_symlinks)
+
+        config = ConfigBuilder().set_cache_dir('cache/dir').set_resolve_symlinks(False).build()
+        self.assertEqual(os.path.join('cache/dir', 'linker'), config.linker.cache.cache_dir)
+        self.assertFalse(config.linker.resolve_symlinks)
+
+    def testTemplateCacheSize(self):
+        builder = ConfigBuilder()
+        self.assertEqual(400, builder.build().template_cache_size)
+
+        builder.set_template_cache_size(0)
+        self.assertEqual(0, builder.build().template_cache_size)
+        self.assertEqual(0, builder.build().to_builder().build().template_cache_size)
+
+    def testTemplateCacheSize_preventInvalidSizes(self):
+        for size in ('4', -1, True):
+            with self.assertRaises(ConfigBuilderError) as cm:
+                ConfigBuilder().set_template_cache_size(size)
+            self.assertEqual(
+                    'template_cache_size must be a non-negative integer, but instead was: ' + \
+                            repr(size),
+                    str(cm.exception))
+
+    def testMarkdownCacheSize(self):
+        builder = ConfigBuilder()
+        self.assertEqual(64 * 1024 * 1024, builder.build().markdown_cache_size)
+
+        builder.set_markdown_cache_size(1024)
+        self.assertEqual(1024, builder.build().markdown_cache_size)
+        self.assertEqual(1024, builder.build().to_builder().build().markdown_cache_size)
+
+    def testMarkdownCacheSize_preventInvalidSizes(self):
+        for size in ('4', -1, True):
+            with self.assertRaises(ConfigBuilderError) as cm:
+                ConfigBuilder().set_markdown_cache_size(size)
+            self.assertEqual(
+                    'markdown_cache_size must be a non-negative integer, but instead was: ' + \
+                            repr(size),
+                    str(cm.exception))
+
+    def testMarkdownCache(self):
+        self.assertIsNone(ConfigBuilder().build().markdown_cache)
+
+        config = ConfigBuilder().set_cache_dir('cache/dir').set_markdown_cache_size(1024).build()
+        self.assertIs(config.markdown_cache, config.markdown_cache)
+        self.assertEqual(os.path.join('cache/dir', 'markdown'), config.markdown_cache.cache_dir)
+        self.assertEqual(1024, config.markdown_cache.max_size)
+
+    def testJinjaEnv(self):
+        with mock.patch('os.path.isdir', lambda s: True):
+            config = ConfigBuilder().add_template_dirs('template/path').build()
+        self.assertIs(config.jinja_env, config.jinja_env)
+        self.assertEqual(['template/path'], config.jinja_env.loader.searchpath)
+        self.assertIsNone(config.jinja_env.bytecode_cache)
+
+    def testJinjaEnv_withCacheDir(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            config = ConfigBuilder().set_cache_dir(cache_dir).build()
+            self.assertEqual(
+                    os.path.join(cache_dir, 'jinja'),
+                    config.jinja_env.bytecode_cache.directory)
+            self.assertTrue(os.path.isdir(os.path.join(cache_dir, 'jinja')))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def testPickle_dropsCaches(self):
+        config = ConfigBuilder().add_variable('var', 'value').build()
+        config.linker, config.jinja_env  # Create the caches.
+        copy = pickle.loads(pickle.dumps(config))
+        self.assertEqual({'var': 'value'}, copy.variables)
+        self.assertIsNot(config.linker, copy.linker)
+        self.assertIsNot(config.jinja_env, copy.jinja_env)
+
+        config = ConfigBuilder().set_cache_dir('cache/dir').build()
+        config.markdown_cache.hits = 1
+        copy = pickle.loads(pickle.dumps(config))
+        self.assertEqual(0, copy.markdown_cache.hits)
+
+    def testResolveSymlinks_preventNonBooleans(self):
+        with self.assertRaises(ConfigBuilderError) as cm:
+            ConfigBuilder().set_resolve_symlinks(4)
+        self.assertEqual('resolve_symlinks must be a boolean, but instead was: 4', str(cm.exception))
+
     def testConfigIsImmutable(self):
         with mock.patch('os.path.isdir', lambda s: True):
             builder = ConfigBuilder().add_template_dirs('template/path1', 'template/path2')
@@ -1,12 +1,20 @@
 """Integration tests using templar/api/publish.py"""
 
+from templar.api import publish as publish_module
 from templar.api.config import ConfigBuilder
 from templar.api.publish import PublishError
+from templar.api.publish import WriteResult
 from templar.api.publish import publish
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
 from templar.api.rules.core import Rule
 from templar.api.rules.core import VariableRule
 
+import hashlib
 import jinja2
+import os
+import shutil
+import stat
+import tempfile
 import unittest
 import mock
 
@@ -126,6 +134,45 @@ class PublishTest(unittest.TestCase):
                 'segment 3: outer content'),
             result)
 
+    def testOnlySource_variableRulesBetweenRules(self):
+        file_map = {
+            'docA.md': self.join_lines(
+                'outer content',
+                '<block blockA>',
+                'inner content',
+                '</block blockA>'),
+        }
+        class UpperCaseRule(Rule):
+            def apply(self, content):
+                return content.upper()
+        class SuffixRule(Rule):
+            def apply(self, content):
+                return content + '!'
+        class ContentRule(VariableRule):
+            def extract(self, content):
+                return {'content': content}
+        config = ConfigBuilder() \
+                .append_preprocess_rules(UpperCaseRule(), ContentRule()) \
+                .append_postprocess_rules(SuffixRule()) \
+                .build()
+
+        jinja_env = jinja2.Environment(loader=jinja2.DictLoader({
+            'some/path': '{{ content }}|{{ blocks.all }}',
+        }))
+
+        with self.mock_open(file_map):
+            result = publish(
+                    config,
+                    source='docA.md',
+                    template='some/path',
+                    jinja_env=jinja_env,
+                    no_write=True)
+        # The VariableRule sees the content transformed by the rules before it, but not after it.
+        self.assertEqual(
+                self.join_lines('OUTER CONTENT', 'INNER CONTENT') + '|' + \
+                        self.join_lines('OUTER CONTENT!', 'INNER CONTENT!'),
+                result)
+
     def testOnlySource_preserveNewlinesOutsideOfBlocks(self):
         file_map = {
             'docA.md':
@@ -157,6 +204,53 @@ two
 three""",
             result)
 
+    def testOnlySource_reuseLinkerAcrossPublishes(self):
+        file_map = {
+            'docA.md': 'content',
+        }
+        config = ConfigBuilder().build()
+        with self.mock_open(file_map):
+            publish(config, source='docA.md', no_write=True)
+        linker = config.linker
+        with self.mock_open(file_map):
+            result = publish(config, source='docA.md', no_write=True)
+        self.assertEqual('content', result)
+        self.assertIs(linker, config.linker)
+
+    def testOnlySource_markdownCache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(temp_dir, 'doc.md')
+            with open(source, 'w') as f:
+                f.write('Some *content*')
+            config = ConfigBuilder() \
+                    .append_compiler_rules(MarkdownToHtmlRule(dst=None)) \
+                    .set_cache_dir(os.path.join(temp_dir, 'cache')) \
+                    .build()
+            self.assertEqual('<p>Some <em>content</em></p>', publish(config, source=source))
+            self.assertEqual(1, config.markdown_cache.misses)
+            with mock.patch('templar.markdown.convert') as mock_convert:
+                result = publish(config, source=source)
+            self.assertFalse(mock_convert.called)
+            self.assertEqual('<p>Some <em>content</em></p>', result)
+            self.assertEqual(1, config.markdown_cache.hits)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testOnlyTemplate_reuseCompiledTemplates(self):
+        template_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(template_dir, 'template.html'), 'w') as f:
+                f.write('{{ var }}')
+            config = ConfigBuilder().add_template_dirs(template_dir).add_variable('var', 'a').build()
+            with mock.patch.object(config.jinja_env, 'compile', wraps=config.jinja_env.compile) \
+                    as mock_compile:
+                self.assertEqual('a', publish(config, template='template.html', no_write=True))
+                self.assertEqual('a', publish(config, template='template.html', no_write=True))
+            self.assertEqual(1, mock_compile.call_count)
+        finally:
+            shutil.rmtree(template_dir)
+
     def testSourceAndTemplate(self):
         file_map = {
             'docA.md': self.join_lines(
@@ -260,27 +354,213 @@ three""",
                     '{{ blocks["all"] }}')
                 , str(cm.exception))
 
-    def testWrite(self):
-        template_loader = jinja2.DictLoader({
-            'some/path': 'content',
-        })
-        jinja_env = jinja2.Environment(loader=template_loader)
+    def testRecursivelyEvaluateJinjaExpressions_nested(self):
+        config = ConfigBuilder() \
+                .set_recursively_evaluate_jinja_expressions(True) \
+                .add_variable('a', 'A{{ b }}') \
+                .add_variable('b', 'B{{ c|upper }}') \
+                .add_variable('c', 'c') \
+                .build()
+        jinja_env = jinja2.Environment(loader=jinja2.DictLoader({
+            'some/path': self.join_lines(
+                'Text {{ a }} and {{ "{{ c }}" }}',
+                'more text',
+                ''),
+        }))
+        result = publish(config, template='some/path', jinja_env=jinja_env, no_write=True)
+        self.assertEqual(self.join_lines('Text ABC and c', 'more text'), result)
+
+    def testRecursivelyEvaluateJinjaExpressions_withStatements(self):
+        config = ConfigBuilder() \
+                .set_recursively_evaluate_jinja_expressions(True) \
+                .add_variable('a', '{% if flag %}yes{% endif %} {{ b }}') \
+                .add_variable('b', 'b') \
+                .add_variable('flag', True) \
+                .build()
+        jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'some/path': '{{ a }}'}))
+        result = publish(config, template='some/path', jinja_env=jinja_env, no_write=True)
+        self.assertEqual('yes b', result)
+
+    def testRecursivelyEvaluateJinjaExpressions_whitespaceControl(self):
+        config = ConfigBuilder() \
+                .set_recursively_evaluate_jinja_expressions(True) \
+                .add_variable('a', 'a\n  {{- x }}\nb {{ x -}}  \n  c') \
+                .add_variable('x', 'X') \
+                .build()
+        jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'some/path': '{{ a }}'}))
+        result = publish(config, template='some/path', jinja_env=jinja_env, no_write=True)
+        self.assertEqual('aX\nb Xc', result)
+
+    def testRecursivelyEvaluateJinjaExpressions_stopWhenUnchanged(self):
+        config = ConfigBuilder() \
+                .set_recursively_evaluate_jinja_expressions(True) \
+                .add_variable('a', '{{ a }}') \
+                .build()
+        jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'some/path': '{{ a }}'}))
+        with mock.patch('templar.api.publish._compile_jinja_fragment',
+                wraps=publish_module._compile_jinja_fragment) as mock_compile:
+            with self.assertRaises(PublishError):
+                publish(config, template='some/path', jinja_env=jinja_env, no_write=True)
+        self.assertEqual(1, mock_compile.call_count)
 
-        # Use a simple mock_open instead of this test's mock_open method, since we don't need to
-        # open multiple files.
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
+    def testWrite(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            destination = os.path.join(temp_dir, 'out', 'dest.html')
+            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'some/path': 'content'}))
             result = publish(
                     ConfigBuilder().build(),
                     template='some/path',
-                    destination='dest.html',
+                    destination=destination,
                     jinja_env=jinja_env)
-
-        # Verify a file handle to the destination file was opened.
-        mock_open.assert_called_once_with('dest.html', 'w')
-        # Verify the result was actually written to the destination fie handle.
-        handle = mock_open()
-        handle.write.assert_called_once_with('content')
+            self.assertEqual('content', result)
+            with open(destination, 'r') as f:
+                self.assertEqual('content', f.read())
+            self.assertEqual(['dest.html'], os.listdir(os.path.dirname(destination)))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testWrite_keepPermissions(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            destination = os.path.join(temp_dir, 'dest.html')
+            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'some/path': 'new content'}))
+            for stream in (False, True):
+                with self.subTest(stream=stream):
+                    with open(destination, 'w') as f:
+                        f.write('content')
+                    os.chmod(destination, 0o640)
+                    publish(ConfigBuilder().build(), template='some/path',
+                            destination=destination, jinja_env=jinja_env, stream=stream)
+                    self.assertEqual(0o640, stat.S_IMODE(os.stat(destination).st_mode))
+                    with open(destination, 'r') as f:
+                        self.assertEqual('new content', f.read())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testWrite_skipUnchanged(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            destination = os.path.join(temp_dir, 'dest.html')
+            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'some/path': '{{ var }}'}))
+            for stream in (False, True):
+                with self.subTest(stream=stream):
+                    with open(destination, 'w') as f:
+                        f.write('content')
+                    os.utime(destination, (0, 0))
+
+                    # Publishing the same content does not touch the destination.
+                    config = ConfigBuilder().add_variable('var', 'content').build()
+                    result = publish(config, template='some/path', destination=destination,
+                                     jinja_env=jinja_env, stream=stream)
+                    if stream:
+                        self.assertEqual(
+                                WriteResult(hashlib.sha1(b'content').hexdigest(), False), result)
+                    self.assertEqual(0, os.stat(destination).st_mtime)
+
+                    # Content of the same size is compared by hash.
+                    config = ConfigBuilder().add_variable('var', 'CONTENT').build()
+                    result = publish(config, template='some/path', destination=destination,
+                                     jinja_env=jinja_env, stream=stream)
+                    if stream:
+                        self.assertTrue(result.written)
+                    self.assertNotEqual(0, os.stat(destination).st_mtime)
+                    with open(destination, 'r') as f:
+                        self.assertEqual('CONTENT', f.read())
+                    self.assertEqual(['dest.html'], os.listdir(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testWrite_compareDestinationOnce(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            destination = os.path.join(temp_dir, 'dest.html')
+            with open(destination, 'w') as f:
+                f.write('content')
+            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'some/path': 'CONTENT'}))
+            with mock.patch('templar.api.publish._file_matches',
+                    wraps=publish_module._file_matches) as mock_file_matches:
+                publish(ConfigBuilder().build(), template='some/path', destination=destination,
+                        jinja_env=jinja_env)
+            self.assertEqual(1, mock_file_matches.call_count)
+            with open(destination, 'r') as f:
+                self.assertEqual('CONTENT', f.read())
+            self.assertEqual(['dest.html'], os.listdir(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testStream(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            destination = os.path.join(temp_dir, 'out', 'page.html')
+            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({
+                'page.html': '{% for i in range(3) %}<p>{{ i }}</p>{% endfor %}',
+            }))
+            result = publish(
+                    ConfigBuilder().build(),
+                    template='page.html',
+                    destination=destination,
+                    jinja_env=jinja_env,
+                    stream=True)
+            with open(destination, 'r') as f:
+                self.assertEqual('<p>0</p><p>1</p><p>2</p>', f.read())
+            self.assertEqual(
+                    WriteResult(hashlib.sha1(b'<p>0</p><p>1</p><p>2</p>').hexdigest(), True),
+                    result)
+            self.assertEqual(['page.html'], os.listdir(os.path.dirname(destination)))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testStream_recursivelyEvaluateJinjaExpressions(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            destination = os.path.join(temp_dir, 'page.html')
+            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({'page.html': '{{ a }}'}))
+            config = ConfigBuilder() \
+                    .add_variables({'a': '{{ b }}', 'b': 'value'}) \
+                    .set_recursively_evaluate_jinja_expressions(True) \
+                    .build()
+            result = publish(
+                    config,
+                    template='page.html',
+                    destination=destination,
+                    jinja_env=jinja_env,
+                    stream=True)
+            with open(destination, 'r') as f:
+                self.assertEqual('value', f.read())
+            self.assertEqual(WriteResult(hashlib.sha1(b'value').hexdigest(), True), result)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testStream_errorKeepsDestination(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            destination = os.path.join(temp_dir, 'page.html')
+            with open(destination, 'w') as f:
+                f.write('old content')
+            jinja_env = jinja2.Environment(loader=jinja2.DictLoader({
+                'page.html': 'new content {{ none.attribute }}',
+            }), undefined=jinja2.StrictUndefined)
+            with self.assertRaises(jinja2.UndefinedError):
+                publish(
+                        ConfigBuilder().build(),
+                        template='page.html',
+                        destination=destination,
+                        jinja_env=jinja_env,
+                        stream=True)
+            with open(destination, 'r') as f:
+                self.assertEqual('old content', f.read())
+            self.assertEqual(['page.html'], os.listdir(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testStream_requiresDestination(self):
+        for kwargs in ({}, {'destination': 'dest.html', 'no_write': True}):
+            with self.assertRaises(PublishError) as cm:
+                publish(ConfigBuilder().build(), template='page.html', stream=True, **kwargs)
+            self.assertEqual(
+                    'When streaming, a destination is required and no_write must be False.',
+                    str(cm.exception))
 
     ##################
     # Test utilities #
@@ -1,7 +1,15 @@
 """Tests templar/api/rules/core.py"""
 
+from templar.api.rules import compiler_rules
+from templar.api.rules.compiler_rules import MarkdownCache
 from templar.api.rules.compiler_rules import MarkdownToHtmlRule
+from templar.markdown import REGEX_ENGINE
+from templar.markdown import TOKEN_ENGINE
 
+import mock
+import os
+import shutil
+import tempfile
 import unittest
 
 class MarkdownToHtmlRuleTest(unittest.TestCase):
@@ -18,3 +26,108 @@ class MarkdownToHtmlRuleTest(unittest.TestCase):
         content = 'This is *a paragraph* with `code`.'
         result = self.rule.apply(content)
         self.assertEqual('<p>This is <em>a paragraph</em> with <code>code</code>.</p>', result)
+
+    def testApply_tokenEngine(self):
+        rule = MarkdownToHtmlRule(engine=TOKEN_ENGINE)
+        content = 'This is *a paragraph* with `code`.'
+        result = rule.apply(content)
+        self.assertEqual('<p>This is <em>a paragraph</em> with <code>code</code>.</p>', result)
+
+    def testApply_withCache(self):
+        cache = mock.Mock(spec=MarkdownCache)
+        cache.get.return_value = None
+        rule = MarkdownToHtmlRule(cache=cache)
+        self.assertEqual('<p><em>a</em></p>', rule.apply('*a*'))
+        cache.get.assert_called_once_with(REGEX_ENGINE, '*a*')
+        cache.put.assert_called_once_with(REGEX_ENGINE, '*a*', '<p><em>a</em></p>')
+
+        cache.get.return_value = '<p>cached</p>'
+        self.assertEqual('<p>cached</p>', rule.apply('*a*'))
+        self.assertEqual(1, cache.put.call_count)
+
+    def testWithCache(self):
+        cache = MarkdownCache('cache/dir')
+        rule = MarkdownToHtmlRule(r'\.txt', r'\.htm', TOKEN_ENGINE).with_cache(cache)
+        self.assertIs(cache, rule.cache)
+        self.assertEqual(TOKEN_ENGINE, rule.engine)
+        self.assertTrue(rule.applies('source.txt', 'destination.htm'))
+        self.assertFalse(rule.applies('source.md', 'destination.html'))
+
+    def testWithCache_subclass(self):
+        class ArticleRule(MarkdownToHtmlRule):
+            def apply(self, content):
+                return '<article>{}</article>'.format(super().apply(content))
+
+        cache = mock.Mock(spec=MarkdownCache)
+        cache.get.return_value = '<p>cached</p>'
+        rule = ArticleRule().with_cache(cache)
+        self.assertIsInstance(rule, ArticleRule)
+        self.assertEqual('<article><p>cached</p></article>', rule.apply('*a*'))
+
+
+class MarkdownCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def testGet_missing(self):
+        cache = MarkdownCache(os.path.join(self.cache_dir, 'markdown'))
+        self.assertIsNone(cache.get(REGEX_ENGINE, 'content'))
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def testPutAndGet(self):
+        cache = MarkdownCache(os.path.join(self.cache_dir, 'markdown'))
+        cache.put(REGEX_ENGINE, 'content', '<p>content</p>')
+        self.assertEqual('<p>content</p>', cache.get(REGEX_ENGINE, 'content'))
+        self.assertEqual(1, cache.hits)
+
+        # Entries persist across MarkdownCache objects.
+        cache = MarkdownCache(os.path.join(self.cache_dir, 'markdown'))
+        self.assertEqual('<p>content</p>', cache.get(REGEX_ENGINE, 'content'))
+
+    def testGet_keyedOnContentAndEngine(self):
+        cache = MarkdownCache(self.cache_dir)
+        cache.put(REGEX_ENGINE, 'content', '<p>content</p>')
+        self.assertIsNone(cache.get(REGEX_ENGINE, 'other content'))
+        self.assertIsNone(cache.get(TOKEN_ENGINE, 'content'))
+
+    def testGet_keyedOnVersion(self):
+        cache = MarkdownCache(self.cache_dir)
+        cache.put(REGEX_ENGINE, 'content', '<p>content</p>')
+        with mock.patch.object(compiler_rules, '_CACHE_VERSION', ('0.0.0', 1)):
+            self.assertIsNone(cache.get(REGEX_ENGINE, 'content'))
+
+    def testPut_evictsLeastRecentlyUsed(self):
+        cache = MarkdownCache(self.cache_dir, max_size=24)
+        cache.put(REGEX_ENGINE, 'a', 'a' * 10)
+        cache.put(REGEX_ENGINE, 'b', 'b' * 10)
+        self.age_entries(cache)
+        cache.get(REGEX_ENGINE, 'a')
+        cache.put(REGEX_ENGINE, 'c', 'c' * 5)
+        self.assertEqual('a' * 10, cache.get(REGEX_ENGINE, 'a'))
+        self.assertIsNone(cache.get(REGEX_ENGINE, 'b'))
+        self.assertEqual('c' * 5, cache.get(REGEX_ENGINE, 'c'))
+
+    def testPut_existingEntry(self):
+        cache = MarkdownCache(self.cache_dir, max_size=24)
+        cache.put(REGEX_ENGINE, 'b', 'b' * 10)
+        self.age_entries(cache)
+        cache.put(REGEX_ENGINE, 'a', 'a' * 10)
+        cache.put(REGEX_ENGINE, 'a', 'a' * 10)
+        # The entry for 'a' is only counted once, so nothing is evicted.
+        self.assertEqual('a' * 10, cache.get(REGEX_ENGINE, 'a'))
+        self.assertEqual('b' * 10, cache.get(REGEX_ENGINE, 'b'))
+
+    def testPut_tooLarge(self):
+        cache = MarkdownCache(self.cache_dir, max_size=5)
+        cache.put(REGEX_ENGINE, 'content', '<p>content</p>')
+        self.assertIsNone(cache.get(REGEX_ENGINE, 'content'))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def age_entries(self, cache):
+        """Moves the modification time of every entry into the past."""
+        for name in os.listdir(cache.cache_dir):
+            os.utime(os.path.join(cache.cache_dir, name), (0, 0))
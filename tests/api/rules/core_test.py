@@ -1,9 +1,15 @@
 """Tests templar/api/rules/core.py"""
 
+from templar.api.rules.core import FusedSubstitutionRule
 from templar.api.rules.core import Rule
+from templar.api.rules.core import RuleIndex
 from templar.api.rules.core import SubstitutionRule
 from templar.api.rules.core import InvalidRule
+from templar.api.rules.core import VariableRule
+from templar.api.rules.core import _required_literals
+from templar.api.rules.core import fuse_rules
 
+import mock
 import re
 import unittest
 
@@ -28,6 +34,28 @@ class RuleTest(unittest.TestCase):
         rule = Rule(dst='.html')
         self.assertFalse(rule.applies('source.html', None))
 
+    def testApplies_emptyPatterns(self):
+        rule = Rule(src='', dst='')
+        self.assertTrue(rule.applies(None, None))
+
+    def testApplies_memoized(self):
+        rule = Rule(src=r'\.md$')
+        rule._src_regex = mock.Mock(wraps=rule._src_regex)
+        self.assertTrue(rule.applies('a.md', 'a.html'))
+        self.assertTrue(rule.applies('a.md', 'a.html'))
+        self.assertFalse(rule.applies('a.txt', 'a.html'))
+        self.assertEqual(2, rule._src_regex.search.call_count)
+
+    def testInvalidPatterns(self):
+        with self.assertRaises(InvalidRule) as cm:
+            Rule(src='(')
+        self.assertTrue(str(cm.exception).startswith(
+            "Rule's source pattern is not a valid regular expression: '('"))
+        with self.assertRaises(InvalidRule) as cm:
+            Rule(dst='[')
+        self.assertTrue(str(cm.exception).startswith(
+            "Rule's destination pattern is not a valid regular expression: '['"))
+
 class SubstitutionRuleTest(unittest.TestCase):
     def testInvalidPattern(self):
         class TestRule(SubstitutionRule):
@@ -70,3 +98,140 @@ class SubstitutionRuleTest(unittest.TestCase):
         rule = TestRule()
         result = rule.apply('this is spot. see spot run.')
         self.assertEqual('THIS IS SPOT. SEE SPOT RUN.', result)
+
+class ReplaceRule(SubstitutionRule):
+    def __init__(self, pattern, replacement):
+        super().__init__()
+        self.pattern = pattern
+        self.replacement = replacement
+
+    def substitute(self, match):
+        return match.expand(self.replacement)
+
+
+class FusedSubstitutionRuleTest(unittest.TestCase):
+    def assertSameAsSequential(self, rules, content):
+        expected = content
+        for rule in rules:
+            expected = rule.apply(expected)
+        self.assertEqual(expected, FusedSubstitutionRule(rules).apply(content))
+
+    def testIndependentRules(self):
+        rules = [
+            ReplaceRule(r'\*\*(.+?)\*\*', r'<b>\1</b>'),
+            ReplaceRule(re.compile(r':(smile|frown):'), r'<img alt="\1">'),
+            ReplaceRule(re.compile('todo', re.IGNORECASE), 'TBD'),
+            ReplaceRule(r'(\d+)%', r'\1 percent'),
+        ]
+        content = '**Note**: ToDo :smile: 50% and **more** :frown: todo'
+        fused = FusedSubstitutionRule(rules)
+        with mock.patch.object(SubstitutionRule, 'apply') as mock_apply:
+            result = fused.apply(content)
+        mock_apply.assert_not_called()  # Applied in one pass.
+        self.assertEqual(
+                '<b>Note</b>: TBD <img alt="smile"> 50 percent and <b>more</b> '
+                '<img alt="frown"> TBD', result)
+        self.assertSameAsSequential(rules, content)
+
+    def testInteractingRules(self):
+        cases = [
+            # A match of a later rule overlaps a match of an earlier rule.
+            ([ReplaceRule('bc', 'X'), ReplaceRule('ab', 'Y')], 'abc'),
+            # A replacement is matched by a later rule.
+            ([ReplaceRule('a', 'b'), ReplaceRule('b', 'c')], 'a b'),
+            # Adjacent replacements form a match of a later rule.
+            ([ReplaceRule('x', ''), ReplaceRule('y', ''), ReplaceRule('ab', 'Z')], 'axyb'),
+            # A pattern matches the empty string.
+            ([ReplaceRule('a*', '-'), ReplaceRule('b', 'c')], 'bab'),
+        ]
+        for rules, content in cases:
+            with self.subTest(patterns=[rule.pattern for rule in rules], content=content):
+                self.assertIsNone(FusedSubstitutionRule(rules)._apply_fused(content))
+                self.assertSameAsSequential(rules, content)
+
+    def testLaterRuleInsideEarlierMatch(self):
+        rules = [ReplaceRule('abc', 'X'), ReplaceRule('b', 'Y')]
+        self.assertEqual('X Y', FusedSubstitutionRule(rules)._apply_fused('abc b'))
+        self.assertSameAsSequential(rules, 'abc b')
+
+    def testFuseRules(self):
+        class TestVariableRule(VariableRule):
+            pass
+
+        class CustomApplyRule(ReplaceRule):
+            def apply(self, content):
+                return content
+
+        rules = [
+            ReplaceRule('a', 'b'), ReplaceRule('c', 'd'), TestVariableRule(),
+            ReplaceRule('e', 'f'), ReplaceRule('g', 'h'),
+            # Rules that cannot be fused, and a rule with no fusable neighbour.
+            ReplaceRule(r'^i', 'j'), ReplaceRule(r'(k)\1', 'l'), CustomApplyRule('m', 'n'),
+            ReplaceRule('o', 'p'), ReplaceRule(re.compile('q', re.X), 'r'),
+        ]
+        fused = fuse_rules(rules)
+        self.assertEqual(8, len(fused))
+        self.assertIsInstance(fused[0], FusedSubstitutionRule)
+        self.assertSequenceEqual(rules[:2], fused[0].rules)
+        self.assertIs(rules[2], fused[1])
+        self.assertIsInstance(fused[2], FusedSubstitutionRule)
+        self.assertSequenceEqual(rules[3:5], fused[2].rules)
+        self.assertSequenceEqual(rules[5:], fused[3:])
+
+class RuleIndexTest(unittest.TestCase):
+    PATTERNS = [
+        None, '', r'\.md', r'\.md$', '.html', r'^docs/', r'^docs/.*\.md$', 'md|txt', '(?i)README',
+        r'[\]]x', r'page\d+', 'a?bc', 'ab+c', r'\.(md|txt)$', 'x{2}yz', r'\\', r'\x2emd$',
+        r'\N{FULL STOP}md', r'page1\062', r'\-html{|', 'x{a}',
+    ]
+    PATHS = [
+        None, 'a.md', 'docs/a.md', 'docs/a.md.html', 'a.html', 'a.htm', 'readme', 'ax.txt', ']x',
+        'page12.md', 'bc', 'abbc', 'xyz', 'xxyz', 'a\\b', 'docs.md', '-html{', 'x{a}',
+    ]
+
+    def testMatchesLinearSelection(self):
+        rules = [Rule(src, dst) for src in self.PATTERNS for dst in self.PATTERNS]
+        index = RuleIndex(rules)
+        for src in self.PATHS:
+            for dst in self.PATHS:
+                with self.subTest(src=src, dst=dst):
+                    self.assertEqual(
+                            [rule for rule in rules if rule.applies(src, dst)],
+                            index.applicable_rules(src, dst))
+
+    def testCustomApplies(self):
+        class CustomRule(Rule):
+            def applies(self, src, dst):
+                return src == 'custom'
+
+        rules = [Rule(src='custom'), CustomRule(), Rule(dst='custom')]
+        index = RuleIndex(rules)
+        self.assertEqual(rules[:2], index.applicable_rules('custom', None))
+        self.assertEqual([rules[2]], index.applicable_rules('other', 'custom'))
+
+    def testRequiredLiterals(self):
+        cases = [
+            (r'\.md$', ['.md']),
+            ('.html', ['html']),
+            (r'^docs/.*\.md$', ['docs/', '.md']),
+            ('ab+c', ['ab', 'c']),
+            ('a?bc', ['bc']),
+            ('(abc)def', ['def']),
+            (r'[\]]abc', ['abc']),
+            (r'\d+\.txt', ['.txt']),
+            ('a|b', []),
+            (r'^docs/(a|b)\.md', ['docs/', '.md']),
+            ('(?i)abc', []),
+            (r'\x2emd$', ['md']),
+            (r'a\056md', ['a', 'md']),
+            (r'(a)\1bc', ['bc']),
+            (r'\u002emd', ['md']),
+            (r'\U0000002emd', ['md']),
+            (r'\N{FULL STOP}md', ['md']),
+            (r'\-html{|', []),
+            ('x{a}', ['x{a}']),
+            ('ab{,3}c', ['a', 'c']),
+        ]
+        for pattern, literals in cases:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(literals, _required_literals(pattern))
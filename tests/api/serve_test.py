@@ -0,0 +1,225 @@
+"""Integration tests using templar/api/serve.py"""
+
+from templar.api.build import Page
+from templar.api.config import ConfigBuilder
+from templar.api.rules.compiler_rules import MarkdownToHtmlRule
+from templar.api.rules.core import Rule
+from templar.api.serve import LatencyStats
+from templar.api.serve import PageRenderer
+from templar.api.serve import ServeError
+from templar.api.serve import STATS_PATH
+from templar.api.serve import make_server
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+class PageRendererTest(unittest.TestCase):
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        self.write('index.md', '<include partial.md>')
+        self.write('partial.md', 'partial')
+        self.write('doc.md', 'doc')
+        self.write('config.py', 'config = None')
+        self.write('page.html', '<body>{{ blocks.all }}</body>')
+        self.config = ConfigBuilder().add_template_dirs(self.staging_dir).build()
+        self.pages = [
+            Page(self.path('index.md'), 'page.html', self.path('site', 'index.html')),
+            Page(self.path('doc.md'), 'page.html', self.path('site', 'docs', 'doc.html')),
+        ]
+        self.loaded_configs = []
+        self.renderer = PageRenderer(
+                self.load_config, lambda: self.pages, None, [self.path('config.py')])
+
+    def tearDown(self):
+        shutil.rmtree(self.staging_dir)
+
+    def testRender(self):
+        self.assertEqual('<body>partial</body>', self.renderer.render('/index.html'))
+        self.assertEqual('<body>doc</body>', self.renderer.render('/docs/doc.html'))
+        self.assertFalse(os.path.exists(self.path('site')))
+
+    def testRender_destinationRules(self):
+        self.write('doc.md', '# Title')
+        self.config = ConfigBuilder().add_template_dirs(self.staging_dir) \
+                .append_compiler_rules(MarkdownToHtmlRule()).build()
+        self.assertEqual(
+                '<body><h1 id="title">Title</h1></body>', self.renderer.render('/docs/doc.html'))
+        self.assertFalse(os.path.exists(self.path('site')))
+
+    def testRender_directory(self):
+        self.assertEqual('<body>partial</body>', self.renderer.render('/'))
+        self.assertIsNone(self.renderer.render('/docs/'))
+
+    def testRender_notFound(self):
+        self.assertIsNone(self.renderer.render('/missing.html'))
+        self.assertIsNone(self.renderer.render('/../index.md'))
+
+    def testRender_siteDir(self):
+        renderer = PageRenderer(self.load_config, lambda: self.pages, self.staging_dir)
+        self.assertEqual('<body>doc</body>', renderer.render('/site/docs/doc.html'))
+
+    def testRender_reuseUnchangedPage(self):
+        self.renderer.render('/index.html')
+        self.renderer.render('/index.html')
+        self.assertEqual((1, 1), (self.renderer.hits, self.renderer.misses))
+        self.assertEqual(1, len(self.loaded_configs))
+
+    def testRender_changedInclude(self):
+        self.renderer.render('/index.html')
+        self.write('partial.md', 'new partial')
+        self.assertEqual('<body>new partial</body>', self.renderer.render('/index.html'))
+        self.assertEqual((0, 2), (self.renderer.hits, self.renderer.misses))
+
+    def testRender_changedTemplate(self):
+        self.renderer.render('/index.html')
+        self.write('page.html', '<main>{{ blocks.all }}</main>')
+        self.assertEqual('<main>partial</main>', self.renderer.render('/index.html'))
+
+    def testRender_changedConfig(self):
+        self.renderer.render('/index.html')
+        self.write('config.py', 'config = 1')
+        self.renderer.render('/index.html')
+        self.assertEqual(2, len(self.loaded_configs))
+        self.assertEqual((0, 2), (self.renderer.hits, self.renderer.misses))
+
+    def testRender_configError(self):
+        def load_config():
+            raise SyntaxError('invalid syntax')
+        renderer = PageRenderer(load_config, lambda: self.pages, None)
+        with self.assertRaises(ServeError) as cm:
+            renderer.render('/index.html')
+        self.assertEqual(
+                'Could not load the config and pages: SyntaxError: invalid syntax',
+                str(cm.exception))
+
+    def testRender_templateError(self):
+        self.write('page.html', '{% if %}')
+        with self.assertRaises(ServeError) as cm:
+            self.renderer.render('/index.html')
+        self.assertTrue(str(cm.exception).startswith(
+            'Could not render /index.html: TemplateSyntaxError'))
+
+    def testRender_undecodableSource(self):
+        with open(self.path('doc.md'), 'wb') as f:
+            f.write(b'\xff')
+        with self.assertRaises(ServeError) as cm:
+            self.renderer.render('/docs/doc.html')
+        self.assertTrue(str(cm.exception).startswith(
+            'Could not render /docs/doc.html: UnicodeDecodeError'))
+
+    def testRender_ruleError(self):
+        class FailingRule(Rule):
+            def apply(self, content):
+                raise ValueError('mid-edit')
+        self.config = ConfigBuilder().add_template_dirs(self.staging_dir) \
+                .append_compiler_rules(FailingRule()).build()
+        with self.assertRaises(ServeError) as cm:
+            self.renderer.render('/docs/doc.html')
+        self.assertEqual(
+                'Could not render /docs/doc.html: ValueError: mid-edit', str(cm.exception))
+
+    ##################
+    # Test utilities #
+    ##################
+
+    def load_config(self):
+        self.loaded_configs.append(self.config)
+        return self.config
+
+    def path(self, *parts):
+        return os.path.join(self.staging_dir, *parts)
+
+    def write(self, filename, content):
+        """Writes a file, making sure that its modification time changes."""
+        path = self.path(filename)
+        mtime = os.stat(path).st_mtime if os.path.exists(path) else None
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime + 1, mtime + 1))
+
+
+class LatencyStatsTest(unittest.TestCase):
+    def testPercentile(self):
+        stats = LatencyStats()
+        for seconds in range(1, 101):
+            stats.record(seconds / 1000)
+        self.assertEqual(0.05, stats.percentile(50))
+        self.assertEqual(0.099, stats.percentile(99))
+        self.assertEqual(0.1, stats.percentile(100))
+        self.assertEqual(0.001, stats.percentile(0))
+
+    def testPercentile_noSamples(self):
+        self.assertIsNone(LatencyStats().percentile(50))
+
+    def testMaxSamples(self):
+        stats = LatencyStats(max_samples=2)
+        for seconds in [3, 1, 2]:
+            stats.record(seconds)
+        self.assertEqual(3, stats.count)
+        self.assertEqual(2, stats.percentile(100))
+
+    def testSummary(self):
+        stats = LatencyStats()
+        stats.record(0.002)
+        self.assertEqual(
+                {'count': 1, 'p50': 2.0, 'p90': 2.0, 'p99': 2.0, 'p100': 2.0},
+                stats.summary())
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.staging_dir, 'page.md'), 'w') as f:
+            f.write('content')
+        config = ConfigBuilder().build()
+        pages = [Page(os.path.join(self.staging_dir, 'page.md'), None, 'site/page.html')]
+        self.server = make_server(PageRenderer(lambda: config, lambda: pages, 'site'), port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.staging_dir)
+
+    def testServePage(self):
+        with urllib.request.urlopen(self.url('/page.html')) as response:
+            self.assertEqual(200, response.status)
+            self.assertEqual('text/html; charset=utf-8', response.headers['Content-Type'])
+            self.assertEqual(b'content', response.read())
+
+    def testServePage_notFound(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(self.url('/missing.html'))
+        self.assertEqual(404, cm.exception.code)
+        cm.exception.close()
+
+    def testServePage_error(self):
+        os.remove(os.path.join(self.staging_dir, 'page.md'))
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(self.url('/page.html'))
+        self.assertEqual(500, cm.exception.code)
+        cm.exception.close()
+        # The server handles one request at a time, so the failed request was recorded by now.
+        with urllib.request.urlopen(self.url(STATS_PATH)) as response:
+            self.assertEqual(1, json.loads(response.read().decode('utf-8'))['count'])
+
+    def testStats(self):
+        for _ in range(3):
+            urllib.request.urlopen(self.url('/page.html')).close()
+        with urllib.request.urlopen(self.url(STATS_PATH)) as response:
+            stats = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(3, stats['count'])
+        self.assertEqual((2, 1), (stats['hits'], stats['misses']))
+        self.assertLessEqual(stats['p50'], stats['p100'])
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server.server_port, path)
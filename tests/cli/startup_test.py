@@ -0,0 +1,85 @@
+"""Startup time tests for templar/cli/templar.py and templar/markdown.py"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+class StartupTest(unittest.TestCase):
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        self.page = os.path.join(self.staging_dir, 'page.md')
+        with open(self.page, 'w') as f:
+            f.write('Some *Markdown* content.\n')
+        self.config = os.path.join(self.staging_dir, 'config.py')
+        with open(self.config, 'w') as f:
+            f.write('from templar.api.config import ConfigBuilder\n'
+                    'from templar.api.rules.compiler_rules import MarkdownToHtmlRule\n'
+                    'config = ConfigBuilder().append_compiler_rules(MarkdownToHtmlRule()).build()\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.staging_dir)
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime needs Python 3.7')
+    def testVersion(self):
+        imports = self.import_times(['templar', '--version'], 'templar.cli.templar')
+        for module in ['jinja2', 'templar.api.publish', 'templar.markdown', 'templar.linker']:
+            self.assertNotIn(module, imports)
+        self.assertLess(sum(imports.values()), STARTUP_BUDGET_US)
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime needs Python 3.7')
+    def testMarkdownOnlyPublish(self):
+        imports = self.import_times(
+                ['templar', '-s', self.page, '-c', self.config], 'templar.cli.templar')
+        for module in ['jinja2', 'http.server', 'concurrent.futures', 'tempfile']:
+            self.assertNotIn(module, imports)
+        self.assertLess(sum(imports.values()), STARTUP_BUDGET_US)
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime needs Python 3.7')
+    def testMarkdown(self):
+        imports = self.import_times(['markdown', '-s', self.page], 'templar.markdown')
+        for module in ['jinja2', 'tempfile']:
+            self.assertNotIn(module, imports)
+        self.assertLess(sum(imports.values()), STARTUP_BUDGET_US)
+
+    def testMarkdown_noCompiledPatternsOnImport(self):
+        code = ('import html, re; compiled = []; compile = re.compile\n'
+                're.compile = lambda *args: compiled.append(args) or compile(*args)\n'
+                'import templar.markdown, templar.linker\n'
+                'print(len(compiled))')
+        output = subprocess.check_output(
+                [sys.executable, '-c', code], env=self.env(), universal_newlines=True)
+        self.assertEqual('0', output.strip())
+
+    ##################
+    # Test utilities #
+    ##################
+
+    def import_times(self, argv, module):
+        """Runs the main function of module with argv in a fresh interpreter, and returns the
+        import time in microseconds of each top-level import reported by -X importtime.
+        """
+        code = 'import sys; sys.argv = {!r}; from {} import main; main()'.format(argv, module)
+        imports = {}
+        for _ in range(2):  # The first run may compile bytecode.
+            process = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', code],
+                    env=self.env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                    universal_newlines=True, check=True)
+        for line in process.stderr.splitlines():
+            if line.startswith('import time:') and 'cumulative' not in line:
+                _, cumulative_us, name = line[len('import time:'):].split('|')
+                # Nested imports are included in the cumulative time of their importer.
+                imports[name.strip()] = int(cumulative_us) if name[:3] != '   ' else 0
+        return imports
+
+    def env(self):
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        return env
+
+# Time that a command may spend importing modules, well above the time that these commands take
+# on a typical machine. Importing jinja2 alone takes about as long.
+STARTUP_BUDGET_US = 100 * 1000
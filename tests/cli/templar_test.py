@@ -1,9 +1,11 @@
 """End-to-end test for templar/cli/templar.py"""
 
+from templar.api.config import ConfigBuilder
 from templar.api.config import ConfigBuilderError
 from templar.cli import templar
 
 import io
+import json
 import mock
 import os.path
 import shutil
@@ -115,5 +117,127 @@ class TemplarTest(unittest.TestCase):
         with open(os.path.join(destination_file), 'r') as f:
             self.assertEqual('<p>Content in my block.</p>', f.read())
 
+    def testNoCache(self):
+        with mock.patch('templar.api.config.import_config') as mock_import_config:
+            mock_import_config.return_value = ConfigBuilder().set_cache_dir('cache/dir').build()
+            configuration = templar.load_config(templar.flags(['--no-cache']))
+            self.assertIsNone(configuration.cache_dir)
+
+            configuration = templar.load_config(templar.build_flags(['--no-cache']))
+            self.assertIsNone(configuration.cache_dir)
+
+            configuration = templar.load_config(templar.flags([]))
+            self.assertEqual('cache/dir', configuration.cache_dir)
+
+    def testBuild(self):
+        manifest_file = os.path.join(STAGING_DIR, 'manifest.json')
+        with open(manifest_file, 'w') as f:
+            json.dump({
+                'pages': [{
+                    'source': os.path.join(TEST_DATA, 'file.md'),
+                    'template': 'template.html',
+                    'destination': os.path.join(STAGING_DIR, 'a.html'),
+                }],
+                'globs': [{
+                    'root': TEST_DATA,
+                    'sources': '*.md',
+                    'destination': os.path.join(STAGING_DIR, 'glob', '{path}.html'),
+                }],
+            }, f)
+        state_file = os.path.join(STAGING_DIR, 'state.json')
+        args = templar.build_flags([
+            '-m', manifest_file,
+            '-c', os.path.join(TEST_DATA, 'config.py'),
+            '--state', state_file,
+            '--debug',
+        ])
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            templar.run_build(args)
+        with open(os.path.join(STAGING_DIR, 'a.html'), 'r') as f:
+            self.assertEqual('<p>Content in my block.</p>', f.read())
+        self.assertTrue(os.path.isfile(os.path.join(STAGING_DIR, 'glob', 'file.html')))
+        summary = mock_stdout.getvalue().splitlines()
+        self.assertEqual(3, len(summary))
+        self.assertRegex(
+                summary[-1],
+                r'^Built 2 of 2 pages \(0 skipped\) in \d+\.\d{3}s; wrote 2 files \(0 unchanged\)$')
+
+        # Building again should skip every page.
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            templar.run_build(args)
+        self.assertRegex(
+                mock_stdout.getvalue().splitlines()[-1],
+                r'^Built 0 of 2 pages \(2 skipped\) in \d+\.\d{3}s; wrote 0 files \(0 unchanged\)$')
+
+        # Building again without the state file should leave every destination untouched.
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            templar.run_build(templar.build_flags([
+                '-m', manifest_file,
+                '-c', os.path.join(TEST_DATA, 'config.py'),
+                '--debug',
+            ]))
+        summary = mock_stdout.getvalue().splitlines()
+        self.assertRegex(summary[0], r'^\s*\d+\.\d{3}s  unchanged  ')
+        self.assertRegex(
+                summary[-1],
+                r'^Built 2 of 2 pages \(0 skipped\) in \d+\.\d{3}s; wrote 0 files \(2 unchanged\)$')
+
+    def testBuild_manifestNotFound(self):
+        with self.assertRaises(SystemExit) as cm:
+            with mock.patch('sys.stderr', new_callable=io.StringIO) as mock_stderr:
+                templar.run_build(templar.build_flags([
+                    '-m', os.path.join('no', 'such', 'manifest.json'),
+                    '-c', os.path.join(TEST_DATA, 'config.py'),
+                ]))
+        self.assertEqual(
+                'BuildError: Could not read manifest file: no/such/manifest.json\n',
+                mock_stderr.getvalue())
+        self.assertNotEqual(cm.exception.code, 0)
+
+    def testBuild_watch(self):
+        manifest_file = os.path.join(STAGING_DIR, 'manifest.json')
+        with open(manifest_file, 'w') as f:
+            json.dump({'pages': [{
+                'source': os.path.join(TEST_DATA, 'file.md'),
+                'template': 'template.html',
+                'destination': os.path.join(STAGING_DIR, 'a.html'),
+            }]}, f)
+        args = templar.build_flags([
+            '-m', manifest_file,
+            '-c', os.path.join(TEST_DATA, 'config.py'),
+            '--watch',
+        ])
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            # Stop watching after the first poll.
+            with mock.patch('time.sleep', side_effect=KeyboardInterrupt):
+                templar.run_build(args)
+        with open(os.path.join(STAGING_DIR, 'a.html'), 'r') as f:
+            self.assertEqual('<p>Content in my block.</p>', f.read())
+        self.assertRegex(
+                mock_stdout.getvalue().splitlines()[-1],
+                r'^Built 1 of 1 pages \(0 skipped\) in \d+\.\d{3}s; wrote 1 files \(0 unchanged\)$')
 
+    def testWatch_requiresDestination(self):
+        with self.assertRaises(SystemExit) as cm:
+            with mock.patch('sys.stderr', new_callable=io.StringIO) as mock_stderr:
+                templar.run(templar.flags([
+                    '-s', os.path.join(TEST_DATA, 'file.md'),
+                    '-c', os.path.join(TEST_DATA, 'config.py'),
+                    '--watch',
+                ]))
+        self.assertEqual(
+                '--watch requires --destination, and cannot be used with --print\n',
+                mock_stderr.getvalue())
+        self.assertNotEqual(cm.exception.code, 0)
 
+    def testMain_dispatchBuild(self):
+        with mock.patch('sys.argv', ['templar', 'build', '-m', 'site.json']):
+            with mock.patch.object(templar, 'run_build') as mock_run_build:
+                templar.main()
+        self.assertEqual('site.json', mock_run_build.call_args[0][0].manifest)
+
+    def testMain_dispatchServe(self):
+        with mock.patch('sys.argv', ['templar', 'serve', '-p', '8080']):
+            with mock.patch.object(templar, 'run_serve') as mock_run_serve:
+                templar.main()
+        self.assertEqual(8080, mock_run_serve.call_args[0][0].port)
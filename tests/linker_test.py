@@ -7,7 +7,14 @@ from templar.linker import SourceNotFound
 from templar.linker import InvalidBlockName
 from templar.linker import IncludeNonExistentBlock
 from templar.linker import CyclicalIncludeError
-
+from templar.linker import Include
+from templar.linker import LinkCache
+from templar.linker import Linker
+
+import os
+import shutil
+import tempfile
+import time
 import unittest
 import mock
 
@@ -153,6 +160,40 @@ class LinkTest(unittest.TestCase):
                 link('some/path')
         self.assertEqual('Expected closing block called "foo" in some/path', str(cm.exception))
 
+    def testBlocks_catchMismatchedClosingBlock(self):
+        data = self.join_lines(
+        '<block foo>',
+        'content',
+        '</block bar>')
+        with self.mock_open({'some/path': data}):
+            with self.assertRaises(InvalidBlockName) as cm:
+                link('some/path')
+        self.assertEqual(
+                'Expected closing block foo but found block named "bar" in some/path',
+                str(cm.exception))
+
+    def testBlocks_textAroundNestedBlocks(self):
+        data = self.join_lines(
+        'first',
+        '',
+        '<block outer>',
+        '<block inner>',
+        'inner content',
+        '</block inner>',
+        '',
+        '</block outer>',
+        'last')
+        with self.mock_open({'some/path': data}):
+            block, variables = link('some/path')
+
+        block_inner = Block('some/path', 'inner', ['inner content'])
+        block_outer = Block('some/path', 'outer', [block_inner, ''])
+        block_all = Block('some/path', 'all', [
+            self.join_lines('first', ''),
+            block_outer,
+            'last'])
+        self.assertBlockEqual(block_all, block)
+
 
     def testIncludes_omitBlockName(self):
         mock_open = self.mock_open({
@@ -260,6 +301,62 @@ class LinkTest(unittest.TestCase):
                 link('docA.md')
         self.assertEqual('docA.md -> docB.md -> docC.md -> docB.md', str(cm.exception))
 
+    def testIncludes_parseEachFileOnce(self):
+        file_map = {
+            'path/docA.md': self.join_lines(
+                '<include docB.md:one>',
+                '<include ./docB.md:two>',
+                '<include sub/../docB.md:one>',
+                '<include path/docB.md:two>'),
+            'path/docB.md': self.join_lines(
+                '<block one>',
+                'one',
+                '</block one>',
+                '<block two>',
+                'two',
+                '</block two>'),
+        }
+        opened = []
+        def side_effect(filename, *options):
+            filename = os.path.normpath(filename)
+            opened.append(filename)
+            return mock.mock_open(read_data=file_map[filename])(filename, *options)
+        self.mock_is_file.side_effect = lambda f: os.path.normpath(f) in file_map
+        with mock.patch('builtins.open', mock.Mock(side_effect=side_effect)):
+            block, variables = link('path/docA.md')
+
+        self.assertEqual(['path/docA.md', 'path/docB.md'], opened)
+        block_all = Block('path/docA.md', 'all', [self.join_lines('one', 'two', 'one', 'two')])
+        self.assertBlockEqual(block_all, block)
+
+    def testIncludes_preventNonExistentBlockInLinkedFile(self):
+        mock_open = self.mock_open({
+            'docA.md': self.join_lines(
+                '<include docB.md:foo>',
+                '<include docB.md:bar>'),  # docB.md:bar doesn't exist.
+            'docB.md': self.join_lines(
+                '<block foo>',
+                'contents',
+                '</block foo>'),
+        })
+        with mock_open:
+            with self.assertRaises(IncludeNonExistentBlock) as cm:
+                link('docA.md')
+        self.assertEqual(
+            'docA.md tried to include a non-existent block: docB.md:bar',
+            str(cm.exception))
+
+    def testIncludes_preventCycleThroughEquivalentPaths(self):
+        mock_open = self.mock_open({
+            'docA.md': '<include ./docB.md>',
+            './docB.md': '<include docA.md>',
+            './docA.md': '<include ./docB.md>',  # The same file as docA.md.
+        })
+        with mock_open:
+            with self.assertRaises(CyclicalIncludeError) as cm:
+                link('docA.md')
+        self.assertEqual('docA.md -> ./docB.md -> ./docA.md', str(cm.exception))
+
     def testVariables_noIncludes(self):
         mock_open = self.mock_open({
             'docA.md': self.join_lines(
@@ -362,6 +459,279 @@ class LinkTest(unittest.TestCase):
         """
         return '\n'.join(lines)
 
+class LinkCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        self.cache = LinkCache(os.path.join(self.staging_dir, 'cache'))
+        self.doc_a = os.path.join(self.staging_dir, 'docA.md')
+        self.doc_b = os.path.join(self.staging_dir, 'docB.md')
+        self.write(self.doc_a, self.join_lines(
+            '~ title: foo',
+            'content',
+            '<include docB.md:inner>'))
+        self.write(self.doc_b, self.join_lines(
+            '~ author: bar',
+            '<block inner>',
+            'inner content',
+            '</block inner>'))
+
+    def tearDown(self):
+        shutil.rmtree(self.staging_dir)
+
+    def testCacheHit_doesNotReparse(self):
+        block, variables = link(self.doc_a, cache=self.cache)
+        with mock.patch('templar.linker.scan_block') as mock_scan_block:
+            cached_block, cached_variables = link(self.doc_a, cache=self.cache)
+        self.assertFalse(mock_scan_block.called)
+
+        self.assertEqual({'title': 'foo', 'author': 'bar'}, cached_variables)
+        self.assertEqual(variables, cached_variables)
+        self.assertEqual(self.join_lines('content', 'inner content'), str(cached_block))
+        self.assertEqual(str(block), str(cached_block))
+
+    def testCacheMiss_fileChanged(self):
+        link(self.doc_a, cache=self.cache)
+        self.write(self.doc_b, self.join_lines(
+            '<block inner>',
+            'changed inner content',
+            '</block inner>'))
+
+        block, variables = link(self.doc_a, cache=self.cache)
+        self.assertEqual({'title': 'foo'}, variables)
+        self.assertEqual(self.join_lines('content', 'changed inner content'), str(block))
+
+    def testCacheHit_fileTouchedButUnchanged(self):
+        link(self.doc_a, cache=self.cache)
+        stat = os.stat(self.doc_b)
+        os.utime(self.doc_b, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        with mock.patch('templar.linker.scan_block') as mock_scan_block:
+            block, _ = link(self.doc_a, cache=self.cache)
+        self.assertFalse(mock_scan_block.called)
+        self.assertEqual(self.join_lines('content', 'inner content'), str(block))
+
+    def testCorruptEntryIsIgnored(self):
+        link(self.doc_a, cache=self.cache)
+        for entry in os.listdir(self.cache.cache_dir):
+            self.write(os.path.join(self.cache.cache_dir, entry), 'not a pickle')
+
+        block, _ = link(self.doc_a, cache=self.cache)
+        self.assertEqual(self.join_lines('content', 'inner content'), str(block))
+
+    def testCachedBlocksAreNotShared(self):
+        block, _ = link(self.doc_a, cache=self.cache)
+        block.apply_rule(mock.Mock(apply=lambda content: content.upper()))
+
+        cached_block, _ = link(self.doc_a, cache=self.cache)
+        self.assertEqual(self.join_lines('content', 'inner content'), str(cached_block))
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def join_lines(self, *lines):
+        return '\n'.join(lines)
+
+class LinkerTest(unittest.TestCase):
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        self.linker = Linker()
+        # Files are modified in the past, so that their modification times reveal every change.
+        self.mtime_ns = int((time.time() - 3600) * 1e9)
+        self.write('pageA.md', self.join_lines(
+            '~ title: A',
+            '<include partial.md:nav>',
+            'page A'))
+        self.write('pageB.md', self.join_lines(
+            '<include partial.md:nav>',
+            'page B'))
+        self.write('partial.md', self.join_lines(
+            '~ author: bar',
+            '<block nav>',
+            '  <include nested.md>',
+            '</block nav>'))
+        self.write('nested.md', self.join_lines(
+            '~ nested: baz',
+            'nav'))
+
+    def tearDown(self):
+        shutil.rmtree(self.staging_dir)
+
+    def testReuseIncludedFiles(self):
+        block, variables = self.linker.link(self.path('pageA.md'))
+        self.assertEqual('  nav\npage A', str(block))
+        self.assertEqual({'title': 'A', 'author': 'bar', 'nested': 'baz'}, variables)
+
+        with mock.patch('builtins.open', mock.Mock(side_effect=open)) as mock_open:
+            block, variables = self.linker.link(self.path('pageB.md'))
+        # Only pageB.md should be read; partial.md and nested.md are reused.
+        mock_open.assert_called_once_with(self.path('pageB.md'), 'r')
+        self.assertEqual('  nav\npage B', str(block))
+        self.assertEqual({'author': 'bar', 'nested': 'baz'}, variables)
+
+    def testReuseParsedSources(self):
+        self.linker.link(self.path('pageA.md'))
+        with mock.patch('templar.linker.scan_block') as mock_scan_block:
+            block, _ = self.linker.link(self.path('pageA.md'))
+        self.assertFalse(mock_scan_block.called)
+        self.assertEqual('  nav\npage A', str(block))
+
+    def testChangedNestedIncludeInvalidatesIncludingFiles(self):
+        self.linker.link(self.path('pageA.md'))
+        self.write('nested.md', self.join_lines(
+            '~ nested: changed',
+            'changed nav'))
+
+        block, variables = self.linker.link(self.path('pageB.md'))
+        self.assertEqual('  changed nav\npage B', str(block))
+        self.assertEqual({'author': 'bar', 'nested': 'changed'}, variables)
+
+    def testReturnedBlocksAreNotShared(self):
+        block, _ = self.linker.link(self.path('pageA.md'))
+        block.apply_rule(mock.Mock(apply=lambda content: content.upper()))
+
+        block, _ = self.linker.link(self.path('pageA.md'))
+        self.assertEqual('  nav\npage A', str(block))
+
+    def testDetectCycleInChangedFile(self):
+        self.linker.link(self.path('pageA.md'))
+        self.write('nested.md', '<include partial.md:nav>')
+
+        with self.assertRaises(CyclicalIncludeError):
+            self.linker.link(self.path('pageA.md'))
+
+    def testClear(self):
+        self.linker.link(self.path('pageA.md'))
+        self.linker.clear()
+        with mock.patch('builtins.open', mock.Mock(side_effect=open)) as mock_open:
+            self.linker.link(self.path('pageB.md'))
+        self.assertEqual(3, mock_open.call_count)
+
+    def testGetIncludes(self):
+        self.assertIsNone(self.linker.get_includes(self.path('pageA.md')))
+        self.linker.link(self.path('pageA.md'))
+        self.assertEqual(
+                [Include(self.key('partial.md'), 'nav', None)],
+                self.linker.get_includes(self.path('pageA.md')))
+        self.assertEqual(
+                [Include(self.key('nested.md'), 'all', None)],
+                self.linker.get_includes(self.path('partial.md')))
+        self.assertEqual([], self.linker.get_includes(self.path('nested.md')))
+
+    def testDependencies(self):
+        self.linker.link(self.path('pageA.md'))
+        # pageB.md reuses partial.md, but its dependencies should still be recorded.
+        self.linker.link(self.path('pageB.md'))
+        files, missing_paths = self.linker.dependencies(self.path('pageB.md'))
+        self.assertEqual(
+                {self.key('pageB.md'), self.key('partial.md'), self.key('nested.md')},
+                files)
+        self.assertEqual(set(), missing_paths)
+
+    def testDependencies_updatedByRelinking(self):
+        self.linker.link(self.path('pageA.md'))
+        self.write('partial.md', self.join_lines(
+            '<block nav>',
+            '</block nav>'))
+        self.linker.link(self.path('pageA.md'))
+        files, _ = self.linker.dependencies(self.path('pageA.md'))
+        self.assertEqual({self.key('pageA.md'), self.key('partial.md')}, files)
+
+    def testRecentlyModifiedFile(self):
+        self.linker.link(self.path('pageA.md'))
+        # A file modified again within the granularity of its modification time, with the same size.
+        path = self.path('nested.md')
+        with open(path, 'w') as f:
+            f.write('~ nested: baz\nnav')
+        stat = os.stat(path)
+        self.linker.link(self.path('pageA.md'))
+        with open(path, 'w') as f:
+            f.write('~ nested: qux\nNAV')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        block, variables = self.linker.link(self.path('pageB.md'))
+        self.assertEqual('  NAV\npage B', str(block))
+        self.assertEqual({'author': 'bar', 'nested': 'qux'}, variables)
+
+    def testRecentlyModifiedFile_unchanged(self):
+        self.linker.link(self.path('pageA.md'))
+        with open(self.path('nested.md'), 'w') as f:
+            f.write('~ nested: baz\nnav')
+        self.linker.link(self.path('pageA.md'))
+        with mock.patch('templar.linker.scan_block') as mock_scan_block:
+            block, _ = self.linker.link(self.path('pageA.md'))
+        self.assertFalse(mock_scan_block.called)
+        self.assertEqual('  nav\npage A', str(block))
+
+    def key(self, filename):
+        return os.path.realpath(self.path(filename))
+
+    def path(self, filename):
+        return os.path.join(self.staging_dir, filename)
+
+    def write(self, filename, content):
+        path = self.path(filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        # Make sure the modification time changes even on file systems with coarse timestamps.
+        self.mtime_ns += 10**9
+        os.utime(path, ns=(self.mtime_ns, self.mtime_ns))
+
+    def join_lines(self, *lines):
+        return '\n'.join(lines)
+
+class SymlinkTest(unittest.TestCase):
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        self.doc_a = os.path.join(self.staging_dir, 'docA.md')
+        self.doc_b = os.path.join(self.staging_dir, 'docB.md')
+        with open(self.doc_a, 'w') as f:
+            f.write('<include docB.md>\n<include link.md>')
+        with open(self.doc_b, 'w') as f:
+            f.write('content')
+        os.symlink(self.doc_b, os.path.join(self.staging_dir, 'link.md'))
+
+    def tearDown(self):
+        shutil.rmtree(self.staging_dir)
+
+    def testResolveSymlinks(self):
+        with mock.patch('builtins.open', mock.Mock(side_effect=open)) as mock_open:
+            block, _ = link(self.doc_a)
+        self.assertEqual('content\ncontent', str(block))
+        # The symbolic link refers to a file that was already parsed.
+        self.assertEqual(2, mock_open.call_count)
+
+    def testDoNotResolveSymlinks(self):
+        with mock.patch('builtins.open', mock.Mock(side_effect=open)) as mock_open:
+            block, _ = link(self.doc_a, resolve_symlinks=False)
+        self.assertEqual('content\ncontent', str(block))
+        self.assertEqual(3, mock_open.call_count)
+
+class BlockTest(unittest.TestCase):
+    def testApplyRules(self):
+        applied = []
+        class RecordingRule(object):
+            def __init__(self, name):
+                self.name = name
+            def apply(self, content):
+                applied.append((self.name, content))
+                return content + ' ' + self.name
+
+        block_inner = Block('some/path', 'inner', ['inner content'])
+        block_all = Block('some/path', 'all', ['all content', block_inner])
+        self.assertEqual('all content\ninner content', str(block_all))
+
+        block_all.apply_rules([RecordingRule('rule1'), RecordingRule('rule2')])
+        # Each segment is transformed by every rule before the next segment is visited.
+        self.assertEqual([
+            ('rule1', 'all content'),
+            ('rule2', 'all content rule1'),
+            ('rule1', 'inner content'),
+            ('rule2', 'inner content rule1'),
+        ], applied)
+        self.assertEqual('all content rule1 rule2\ninner content rule1 rule2', str(block_all))
+        self.assertEqual('inner content rule1 rule2', str(block_inner))
+
 class GetBlockDictTest(unittest.TestCase):
     def testNoNestedBlocks(self):
         block_all = Block('some/path', 'all', ['all content'])
@@ -396,6 +766,42 @@ class GetBlockDictTest(unittest.TestCase):
             'inner': 'inner content',
         }, block_dict)
 
+    def testBlocksJoinedWhenLookedUp(self):
+        block_inner = Block('some/path', 'inner', ['inner content'])
+        block_all = Block('some/path', 'all', ['all content', block_inner])
+
+        block_dict = get_block_dict(block_all)
+        self.assertEqual({'all', 'inner'}, set(block_dict))
+        self.assertIsNone(block_all._str)
+        self.assertEqual(self.join_lines('all content', 'inner content'), block_dict['all'])
+        # The nested block's contents were not joined on their own.
+        self.assertIsNone(block_inner._str)
+        self.assertEqual('inner content', block_dict['inner'])
+        with self.assertRaises(KeyError):
+            block_dict['missing']
+
+    def testDeeplyNestedAndEmptyBlocks(self):
+        def join_recursively(block):
+            return '\n'.join(segment if isinstance(segment, str) else join_recursively(segment)
+                              for segment in block.segments)
+
+        block = Block('some/path', 'empty', [])
+        for depth in range(20):
+            block = Block('some/path', 'block{}'.format(depth), [
+                'before {}'.format(depth),
+                block,
+                Block('some/path', 'empty{}'.format(depth), []),
+                'after {}'.format(depth)])
+        block_all = Block('some/path', 'all', ['all content', block, ''])
+        expected = {}
+        block_stack = [block_all]
+        while block_stack:
+            block = block_stack.pop()
+            expected[block.name] = join_recursively(block)
+            block_stack.extend(segment for segment in block.segments if isinstance(segment, Block))
+
+        self.assertEqual(expected, get_block_dict(block_all))
+
     def join_lines(self, *lines):
         """Concatenates multiple strings together with newlines in between.
 
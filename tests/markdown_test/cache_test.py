@@ -0,0 +1,85 @@
+import unittest
+
+from templar.markdown import ConversionCache, Markdown
+
+class ConversionCacheTest(unittest.TestCase):
+    def testGet_missing(self):
+        cache = ConversionCache()
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def testGet_present(self):
+        cache = ConversionCache()
+        cache.put('key', 'result')
+        self.assertEqual('result', cache.get('key'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+    def testPut_evictsLeastRecentlyUsed(self):
+        cache = ConversionCache(maxsize=2)
+        cache.put('a', 'A')
+        cache.put('b', 'B')
+        cache.get('a')
+        cache.put('c', 'C')
+        self.assertEqual(2, len(cache))
+        self.assertEqual('A', cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual('C', cache.get('c'))
+
+    def testPut_zeroSize(self):
+        cache = ConversionCache(maxsize=0)
+        cache.put('key', 'result')
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.get('key'))
+
+    def testClear(self):
+        cache = ConversionCache()
+        cache.put('key', 'result')
+        cache.get('key')
+        cache.get('other')
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+    def testNegativeSize(self):
+        with self.assertRaises(ValueError):
+            ConversionCache(maxsize=-1)
+
+class MarkdownCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ConversionCache()
+
+    def testRepeatedFragments(self):
+        text = '| a | b |\n|---|---|\n| *x* | *x* |\n| *x* | *x* |'
+        result = Markdown(text, cache=self.cache).text
+        self.assertEqual(result, Markdown(text, cache=ConversionCache(maxsize=0)).text)
+        self.assertEqual(3, self.cache.hits)
+
+    def testSharedAcrossDocuments(self):
+        Markdown('* Some *text*', cache=self.cache)
+        misses = self.cache.misses
+        Markdown('Other text\n\n* Some *text*', cache=self.cache)
+        self.assertEqual(misses, self.cache.misses)
+        self.assertEqual(1, self.cache.hits)
+
+    def testWholeTextNotMemoized(self):
+        Markdown('Some *text*', cache=self.cache)
+        self.assertEqual(0, len(self.cache))
+
+    def testReferencesAreKeyed(self):
+        first = Markdown('[link][]\n\n[link]: /first', cache=self.cache).text
+        second = Markdown('[link][]\n\n[link]: /second', cache=self.cache).text
+        self.assertEqual('<p><a href="/first">link</a></p>', first)
+        self.assertEqual('<p><a href="/second">link</a></p>', second)
+
+    def testFootnotesAreKeyed(self):
+        first = Markdown('Text[^a]\n\n[^a]: First', cache=self.cache).text
+        second = Markdown('Text[^a]\n\n[^a]: Second', cache=self.cache).text
+        self.assertIn('First', first)
+        self.assertIn('Second', second)
+
+    def testSharedCache(self):
+        self.assertIs(Markdown.cache, Markdown('text').cache)
+        self.assertIs(self.cache, Markdown('text', cache=self.cache).cache)
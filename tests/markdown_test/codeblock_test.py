@@ -1,5 +1,8 @@
+from templar.markdown import pull_out_pre_tags
 from tests.markdown_test.test_utils import MarkdownTest
 
+import unittest
+
 class CodeblockTest(MarkdownTest):
     def testBasic(self):
         text = """
@@ -232,3 +235,18 @@ class CodeblockTest(MarkdownTest):
         <pre><code>Codeblock here</code></pre>
         """
         self.assertMarkdownIgnoreWS(text, expect)
+
+class PullOutPreTagsTest(unittest.TestCase):
+    def testPullOutPreTags(self):
+        cases = [
+            ('no pre blocks', 'no pre blocks'),
+            ('  <pre>a\n  b\n    c\n d</pre>', '<pre>a\nb\n  c\n d</pre>'),
+            ('x  <pre>a\n  b</pre>\n  c', 'x<pre>a\nb</pre>\n  c'),
+            ('<pre>a\n  b</pre>', '<pre>a\n  b</pre>'),
+            (' <pre>a\n b</pre>  <pre>c\n  d</pre>', '<pre>a\nb</pre><pre>c\nd</pre>'),
+            (' <pre>a\n b <pre>c\n d</pre>\n e</pre>', '<pre>a\nb <pre>c\nd</pre>\n e</pre>'),
+            ('  <pre>unclosed\n  pre', '  <pre>unclosed\n  pre'),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(expected, pull_out_pre_tags(text))
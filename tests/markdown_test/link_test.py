@@ -386,6 +386,42 @@ class FootnoteTest(MarkdownTest):
         """
         self.assertMarkdown(text, expect)
 
+    def testNoBackreference_ownLine(self):
+        text = """
+        Text here.
+        [^id]
+
+        More text.
+        [^id]
+        Last text.
+        """
+        expect = """
+        <p>Text here.</p>
+
+
+        <p>More text.</p>
+
+        <p>Last text.</p>
+        """
+        self.assertMarkdown(text, expect)
+
+    def testNoBackreference_ownLineInList(self):
+        text = """
+        - Text here.
+        *emphasis*
+        [^id]
+            more text
+        """
+        expect = """
+        <ul>
+          <li><p>Text here.
+          <em>emphasis</em></p>
+
+          <p>more text</p></li>
+        </ul>
+        """
+        self.assertMarkdown(text, expect)
+
     def testList(self):
         text = """
         * Text here.[^id]
@@ -225,6 +225,18 @@ class ListTest(MarkdownTest):
         """
         self.assertMarkdown(text, expect)
 
+    def testRepeatedLists(self):
+        text = '\n\nNot in list\n\n'.join(['* item 1\n* item 2'] * 3)
+        expect = '\n\n<p>Not in list</p>\n\n'.join(
+                ['<ul>\n  <li>item 1</li>\n  <li>item 2</li>\n</ul>'] * 3)
+        self.assertMarkdown(text, expect)
+
+    def testManyItems(self):
+        text = '\n'.join('* item {}'.format(i) for i in range(1000))
+        expect = '<ul>\n{}\n</ul>'.format(
+                '\n'.join('  <li>item {}</li>'.format(i) for i in range(1000)))
+        self.assertMarkdown(text, expect)
+
     def testNotAList(self):
         text = """
         * * Not a list
@@ -465,6 +477,34 @@ class ListItemTest(MarkdownTest):
         """
         self.assertMarkdown(text, expect)
 
+    def testCodeblockInNestedBlockquote(self):
+        text = """
+        * item 1
+            * nested item
+
+                > quoted
+
+                >     quoted code
+                >         indented
+        * item 2
+        """
+        expect = """
+        <ul>
+          <li><p>item 1</p>
+
+          <ul>
+            <li><p>nested item</p>
+
+            <blockquote><p>quoted</p>
+
+        <pre><code>quoted code
+            indented</code></pre></blockquote></li>
+          </ul></li>
+          <li>item 2</li>
+        </ul>
+        """
+        self.assertMarkdown(text, expect)
+
     def testNotCodeblock(self):
         text = """
         * item 1
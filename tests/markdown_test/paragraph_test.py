@@ -198,6 +198,31 @@ class HorizontalRuleTest(MarkdownTest):
         """
         self.assertMarkdownNotEqual(text, expect)
 
+    def testConsecutiveHorizontalRules(self):
+        text = """
+        paragraph here
+
+        ---
+
+        * * *
+
+        ---
+
+        paragraph here
+        """
+        expect = """
+        <p>paragraph here</p>
+
+        <hr/>
+
+        <p>* * *</p>
+
+        <hr/>
+
+        <p>paragraph here</p>
+        """
+        self.assertMarkdown(text, expect)
+
 class MiscellaneousTest(MarkdownTest):
     def testDoubleDashInLinkIsPreserved(self):
         text = """
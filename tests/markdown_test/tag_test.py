@@ -109,3 +109,12 @@ class TagTest(MarkdownTest):
         id="AT&T>here</span></p>
         """
         self.assertMarkdown(text, expect)
+
+    def testHashLookalike(self):
+        text = """
+        Text like code-1-code or <b>tag-0-tag</b> is not a hash
+        """
+        expect = """
+        <p>Text like code-1-code or <b>tag-0-tag</b> is not a hash</p>
+        """
+        self.assertMarkdown(text, expect)
@@ -3,7 +3,7 @@ import unittest
 import re
 import textwrap
 
-from templar.markdown import convert, Markdown
+from templar.markdown import ENGINES, convert, Markdown
 
 class TemplarTest(unittest.TestCase):
     def dedent(self, text):
@@ -23,24 +23,21 @@ class MarkdownTest(TemplarTest):
     def assertMarkdown(self, markdown, output):
         markdown = self.dedent(markdown)
         output = self.dedent(output)
-        try:
-            self.assertEqual(output + '\n', convert(markdown) + '\n')
-        except AssertionError:
-            raise
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(output + '\n', convert(markdown, engine) + '\n')
 
     def assertMarkdownNotEqual(self, markdown, output):
         markdown = self.dedent(markdown)
         output = self.dedent(output)
-        try:
-            self.assertNotEqual(output, convert(markdown))
-        except AssertionError:
-            raise
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertNotEqual(output, convert(markdown, engine))
 
     def assertMarkdownIgnoreWS(self, markdown, output):
         markdown = self.dedent(markdown)
-        try:
-            self.assertEqual(self.ignoreWhitespace(output),
-                             self.ignoreWhitespace(convert(markdown)))
-        except AssertionError:
-            raise
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(self.ignoreWhitespace(output),
+                                 self.ignoreWhitespace(convert(markdown, engine)))
 